@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import chess
+import chess.polyglot
+from .positions import NO_MOVE, encode_move, decode_move
+from .openings import DATA_DIR
+
+""" Book deviations: the first ply of each game where the move played is not a book move. """
+BOOK_PATH = DATA_DIR / "performance.bin" # Found relative to the package, like the opening tables
+
+
+class OpeningBook:
+    """A polyglot opening book, opened once as a memory-mapped file (python-chess'
+    MemoryMappedReader, which binary searches the sorted keys). Book moves are memoized
+    by Zobrist key, so each distinct position is only looked up once."""
+    def __init__(self, path=BOOK_PATH):
+        self.reader = chess.polyglot.open_reader(path)
+        self.memo = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.reader.close()
+
+    def book_moves(self, board, key=None):
+        """Set of 16-bit move codes (see positions.encode_move) the book has for the board."""
+        key = chess.polyglot.zobrist_hash(board) if key is None else key
+        if key not in self.memo:
+            self.memo[key] = frozenset(encode_move(entry.move) for entry in self.reader.find_all(board))
+        return self.memo[key]
+
+
+def find_book_deviations(index, book):
+    """Walks every game of a PositionIndex from its start, pushing its moves on one board, until
+    the first move that isn't in the book (a deviation), or until the position has no book moves
+    (the book ran out). Returns one row per deviation: (game_id, ply, color, by_user, key, fen, move,
+    book_moves), where key is the position's Zobrist hash."""
+    keys, moves = index.keys.tolist(), index.moves.tolist()
+    starts = np.flatnonzero(np.r_[True, index.game_ids[1:] != index.game_ids[:-1]]) if len(index) else []
+    rows = []
+    for start in starts:
+        row = int(start)
+        game_id = int(index.game_ids[row])
+        board = index.board(game_id)
+        while moves[row] != NO_MOVE:
+            book_codes = book.memo.get(keys[row])
+            if book_codes is None:
+                book_codes = book.book_moves(board, keys[row])
+            if not book_codes:
+                break
+            move = decode_move(moves[row])
+            if moves[row] not in book_codes:
+                color = 'white' if board.turn == chess.WHITE else 'black'
+                rows.append((game_id, int(index.plies[row]), color, int(index.colors[game_id]) == int(board.turn),
+                             keys[row], board.fen(), board.san(move), sorted(board.san(decode_move(code)) for code in book_codes)))
+                break
+            board.push(move)
+            row += 1
+    return pd.DataFrame(rows, columns=['game_id', 'ply', 'color', 'by_user', 'key', 'fen', 'move', 'book_moves'])
+
+
+def aggregate_deviations(deviations):
+    """Deviations per position (by Zobrist key, so transpositions with other move counters are
+    one row, shown with the first game's FEN) and color: number of games, how many of them were
+    the user's deviations, and the most common move played instead of the book."""
+    if len(deviations) == 0:
+        return pd.DataFrame(columns=['fen', 'color', 'n_games', 'n_by_user', 'move', 'book_moves'])
+    grouped = deviations.groupby(['key', 'color'], sort=False)
+    aggregated = grouped.agg(fen=('fen', 'first'), n_games=('game_id', 'size'), n_by_user=('by_user', 'sum'),
+                             move=('move', lambda x: x.value_counts().index[0]), book_moves=('book_moves', 'first'))
+    aggregated = aggregated.reset_index()[['fen', 'color', 'n_games', 'n_by_user', 'move', 'book_moves']]
+    return aggregated.sort_values(['n_by_user', 'n_games'], ascending=False, kind='stable')
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+from .filters import time_class
+
+""" Aggregate cube of the library: game counts for every combination of the user's color,
+opening mainline, time control, month, outcome, opponent rating bucket and termination.
+Games are first reduced to typed facts (categoricals and small integers, one vectorized pass
+over the library table), and the cube is one groupby of the facts. Dashboards then query the
+cube, which has far fewer rows than the library, instead of re-masking the whole table. """
+DIMENSIONS = ['color', 'mainline', 'time_control', 'time_class', 'month', 'outcome', 'opponent_rating',
+              'termination']
+TERMINATIONS = [('checkmate', 'checkmate'), ('resignation', 'resignation'), ('insufficient material', 'insufficient material'),
+                ('time', 'time'), ('abandon', 'abandoned'), ('agreement', 'agreement'), ('repetition', 'repetition'),
+                ('stalemate', 'stalemate'), ('50-move', '50-move rule')]
+
+
+def termination_types(terminations):
+    """Termination headers (e.g. 'Luc777 won by resignation') as categories (see TERMINATIONS)."""
+    texts = pd.Series(terminations, dtype=str).str.lower()
+    conditions = [texts.str.contains(keyword, regex=False).to_numpy() for keyword, _ in TERMINATIONS]
+    return pd.Categorical(np.select(conditions, [name for _, name in TERMINATIONS], 'other'),
+                          categories=[name for _, name in TERMINATIONS] + ['other'])
+
+def game_keys(df):
+    """(fname, offset, mtime, fsize) of a library table's games (a game, as of its file's last change)."""
+    return pd.MultiIndex.from_arrays([df['fname'].to_numpy(), *(df[column].to_numpy(dtype=np.int64)
+                                                              for column in ['offset', 'mtime', 'fsize'])])
+
+def game_facts(df, username):
+    """One row per game of a library table, with the cube's dimensions as typed columns:
+    color/outcome from the user's point of view ('none' for other players' games, whose
+    outcome is from white's), month as YYYYMM (0 if unknown), opponent_rating rounded to the
+    nearest 100 (-1 if unknown)."""
+    as_white, as_black = (df['White'] == username).to_numpy(), (df['Black'] == username).to_numpy()
+    result = df['Result'].to_numpy(dtype=float)
+    user_result = np.where(as_black, 1 - result, result)
+    outcome = np.select([user_result == 1, user_result == 0], ['win', 'loss'], 'draw')
+    opponent_elo = np.where(as_black, pd.to_numeric(df['WElo'], errors='coerce'),
+                            pd.to_numeric(df['BElo'], errors='coerce'))
+    opponent_rating = np.where(np.isnan(opponent_elo), -1, (np.nan_to_num(opponent_elo) + 50) // 100 * 100)
+    dates = df['Date'].astype(str)
+    month = (pd.to_numeric(dates.str[:4], errors='coerce') * 100
+             + pd.to_numeric(dates.str[5:7], errors='coerce')).fillna(0).to_numpy()
+    time_control = pd.Categorical(df['TimeControl'].astype(str))
+    time_classes = [time_class(tc) or 'unknown' for tc in time_control.categories]
+    terminations = [headers.get('Termination', '') for headers in df['Headers']] if 'Headers' in df else [''] * len(df)
+    return pd.DataFrame({
+        'fname': df['fname'].to_numpy(), 'offset': df['offset'].to_numpy(dtype=np.int64),
+        'mtime': df['mtime'].to_numpy(dtype=np.int64), 'fsize': df['fsize'].to_numpy(dtype=np.int64),
+        'color': pd.Categorical(np.select([as_white, as_black], ['white', 'black'], 'none'),
+                                categories=['white', 'black', 'none']),
+        'mainline': pd.Categorical(df['opening_chesscom_general'].astype(str)),
+        'time_control': time_control,
+        'time_class': pd.Categorical(np.array(time_classes, dtype=object)[time_control.codes],
+                                     categories=['bullet', 'blitz', 'rapid', 'daily', 'unknown']),
+        'month': month.astype(np.int32),
+        'outcome': pd.Categorical(outcome, categories=['win', 'loss', 'draw']),
+        'opponent_rating': opponent_rating.astype(np.int16),
+        'termination': termination_types(terminations)})
+
+
+class LibraryCube:
+    """Game counts by DIMENSIONS (the cube), with the facts it was built from, so it can be
+    updated with only the games added to or removed from a library."""
+    def __init__(self):
+        self.facts = None
+        self.cube = None
+
+    def __len__(self):
+        return 0 if self.facts is None else len(self.facts)
+
+    @staticmethod
+    def aggregate(facts):
+        return facts.groupby(DIMENSIONS, observed=True).size().rename('games').astype(np.int64)
+
+    def update(self, library):
+        """Adds the library's new games to the cube and subtracts the removed ones (only their facts
+        are computed and aggregated). A game rewritten in place (new mtime or size) is both. Mainlines
+        are mapped over the whole library (see mainline_map), so a new game can remap older ones:
+        those are updated too, and the cube is then re-aggregated from the facts. Returns True if
+        the cube changed."""
+        df = library.df
+        games = game_keys(df)
+        if self.facts is None:
+            self.facts = game_facts(df, library.username)
+            self.cube = self.aggregate(self.facts)
+            return True
+        indexed = game_keys(self.facts)
+        removed = ~indexed.isin(games)
+        added = ~games.isin(indexed)
+        mainlines = pd.Series(df['opening_chesscom_general'].astype(str).to_numpy(), index=games)
+        kept = self.facts[~removed]
+        current = mainlines.reindex(indexed[~removed]).to_numpy()
+        remapped = kept.mainline.astype(str).to_numpy() != current
+        if not removed.any() and not added.any() and not remapped.any():
+            return False
+        new_facts = game_facts(df[added], library.username)
+        if remapped.any():
+            self.facts = pd.concat([kept.assign(mainline=current), new_facts], ignore_index=True)
+        else:
+            deltas = [self.cube, self.aggregate(new_facts), -self.aggregate(self.facts[removed])]
+            cube = pd.concat(deltas).groupby(level=DIMENSIONS, observed=True).sum()
+            self.cube = cube[cube > 0]
+            self.facts = pd.concat([kept, new_facts], ignore_index=True)
+        for dimension in ['color', 'mainline', 'time_control', 'time_class', 'outcome', 'termination']:
+            self.facts[dimension] = self.facts[dimension].astype('category')
+        if remapped.any():
+            self.cube = self.aggregate(self.facts)
+        return True
+
+    def query(self, by=(), **where):
+        """Number of games, summed over the dimensions not in by, of the cells matching where
+        (dimension=value or dimension=[values]), e.g. query(['month', 'outcome'], color='white')."""
+        cube = self.cube
+        for dimension, values in where.items():
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            cube = cube[cube.index.get_level_values(dimension).isin(values)]
+        if not by:
+            return int(cube.sum())
+        return cube.groupby(level=list(by), observed=True).sum()
+
+    def winrates(self):
+        """Winrate by color, as GameLibrary.winrates."""
+        counts = self.query(['color', 'outcome'])
+        return tuple(counts.get((color, 'win'), 0) / counts[color].sum() for color in ['white', 'black'])
+
+    def timeseries(self, by='outcome', **where):
+        """Games per month (rows) and by dimension (columns), e.g. wins/losses/draws over time."""
+        return self.query(['month', by], **where).unstack(fill_value=0).sort_index()
+
+    def monthly_winrates(self, by=None, **where):
+        """Winrate per month (rows) and by dimension (columns, e.g. color or time_class), or
+        overall (a 'winrate' column) if by is None. NaN where there are no games."""
+        levels = ['month'] if by is None else ['month', by]
+        games = self.query(levels, **where)
+        wins = self.query(levels, **{**where, 'outcome': 'win'}).reindex(games.index, fill_value=0)
+        rates = wins / games
+        if by is None:
+            return rates.rename('winrate').to_frame().sort_index()
+        return rates.unstack().sort_index()
@@ -0,0 +1,42 @@
+import hashlib
+from pathlib import Path
+
+""" Duplicate games (re-downloads, overlapping exports, copied month directories): each game
+gets a content key when a deduplicating load first keeps it, a hash of its identity (the chess.com Link, or its
+players, date, time, result and time control without one) and of its SAN moves. Keys are kept
+with the rest of the library table in its cache, so finding the duplicates of a library is a
+hash-based pass over the keys, instead of comparing games pairwise. """
+IDENTITY_HEADERS = ['White', 'Black', 'UTCDate', 'UTCTime', 'Date', 'Result', 'TimeControl']
+
+
+def normalize_link(link):
+    """'https://www.chess.com/game/live/123?move=4' and 'HTTPS://www.chess.com/game/live/123/' are the same game."""
+    return link.strip().split("?")[0].split("#")[0].rstrip("/").lower()
+
+def game_key(headers, moves):
+    """Content key of a game, from its headers and SAN moves (as a 32 character hex string)."""
+    link = headers.get('Link', '').strip()
+    identity = normalize_link(link) if link else "|".join(headers.get(name, '').strip() for name in IDENTITY_HEADERS)
+    return hashlib.blake2b(f"{identity}\n{' '.join(moves)}".encode(), digest_size=16).hexdigest()
+
+def find_duplicates(df):
+    """(mask, report) of a library table's duplicate rows: all but the first (by fname and offset,
+    so it doesn't depend on directory listing order) of the rows sharing a game_key. The report
+    has the fname and offset of each duplicate, and of the game it duplicates (duplicate_of,
+    duplicate_of_offset)."""
+    ordered = df[['fname', 'offset', 'game_key']].reset_index(drop=True).sort_values(['fname', 'offset'], kind='stable')
+    duplicated = ordered.game_key.duplicated(keep='first').sort_index().to_numpy()
+    report = df.loc[duplicated, ['fname', 'offset', 'game_key']].reset_index(drop=True)
+    originals = df.loc[~duplicated].set_index('game_key')
+    report['duplicate_of'] = originals.fname.reindex(report.game_key).to_numpy()
+    report['duplicate_of_offset'] = originals.offset.reindex(report.game_key).to_numpy()
+    return duplicated, report
+
+def duplicate_sources(report, parent_dir):
+    """Number of duplicates by (directory or archive of the duplicates, of the games they duplicate),
+    relative to parent_dir, e.g. ('2021/01 copy', '2021/01') -> 30."""
+    def source(fname):
+        path = Path(fname).relative_to(parent_dir)
+        return str(path if path.suffix.lower() == ".pgn" else path.parent) # Archives are their own source
+    sources = report.assign(source=report.fname.map(source), original_source=report.duplicate_of.map(source))
+    return sources.groupby(['source', 'original_source']).size().sort_values(ascending=False)
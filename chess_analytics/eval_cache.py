@@ -0,0 +1,110 @@
+import os
+import pickle
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+import chess
+import chess.polyglot
+from .openings import USER_CACHE_DIR
+from . import stats
+
+EVAL_CACHE_PATH = USER_CACHE_DIR / "eval_cache.sqlite" # Shared by runs from any working directory
+
+
+class EvalCache:
+    """Engine evaluations keyed by (Zobrist hash, depth, multipv, engine id), held in a
+    bounded in-memory LRU and backed by SQLite at path (path=None keeps it in memory only).
+    The engine id should name both the engine and the query, e.g. 'stockfish:get_top_moves',
+    since different queries cache different kinds of results."""
+    def __init__(self, path=EVAL_CACHE_PATH, maxsize=100000):
+        self.path = path
+        self.maxsize = maxsize
+        self.memory = OrderedDict()
+        self.hits, self.misses = 0, 0
+        self._connection, self._pid = None, None
+
+    def __getstate__(self):
+        """Only the settings are pickled (e.g. when sent to pool workers)."""
+        return {'path': self.path, 'maxsize': self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return len(self.memory)
+
+    @staticmethod
+    def make_key(board, depth, multipv=1, engine_id="stockfish"):
+        """Zobrist hashes are unsigned 64-bit, stored as signed for SQLite."""
+        zobrist = chess.polyglot.zobrist_hash(board)
+        zobrist = zobrist - 2**64 if zobrist >= 2**63 else zobrist
+        return (zobrist, -1 if depth is None else int(depth), int(multipv), str(engine_id))
+
+    def connection(self):
+        """SQLite connection for this process (connections can't be shared across a fork)."""
+        if self.path is None:
+            return None
+        if self._connection is None or self._pid != os.getpid():
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS evals (zobrist INTEGER, depth INTEGER,
+                                        multipv INTEGER, engine TEXT, value BLOB,
+                                        PRIMARY KEY (zobrist, depth, multipv, engine))""")
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        """Returns the cached evaluation, or None."""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            stats.count('cache.hit')
+            return self.memory[key]
+        connection = self.connection()
+        if connection is not None:
+            row = connection.execute("SELECT value FROM evals WHERE zobrist=? AND depth=? AND multipv=? AND engine=?",
+                                     key).fetchone()
+            if row is not None:
+                self.hits += 1
+                stats.count('cache.hit')
+                value = pickle.loads(row[0])
+                self.remember(key, value)
+                return value
+        self.misses += 1
+        stats.count('cache.miss')
+        return None
+
+    def put(self, key, value):
+        self.remember(key, value)
+        connection = self.connection()
+        if connection is not None:
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?, ?)", key + (pickle.dumps(value),))
+
+    def remember(self, key, value):
+        """Adds to the in-memory LRU, evicting the least recently used entry when full."""
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def get_or_compute(self, board, depth, multipv, engine_id, compute):
+        """Looks the position up, calling compute() (the engine search) only on a miss."""
+        key = self.make_key(board, depth, multipv, engine_id)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+
+_default_cache = None
+
+def default_cache():
+    """The shared cache at EVAL_CACHE_PATH."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EvalCache()
+    return _default_cache
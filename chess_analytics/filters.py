@@ -0,0 +1,87 @@
+import re
+import datetime
+import numpy as np
+import pandas as pd
+
+""" Game filters, checked before any moves are parsed: first against the {year}/{month}/
+directory layout of a library (see pgn_downloader.py), so files outside the date range are
+never opened, then against the header columns of the library table. """
+TIME_CLASSES = ['bullet', 'blitz', 'rapid', 'daily']
+YEAR, MONTH = re.compile(r"^\d{4}$"), re.compile(r"^\d{1,2}$")
+
+
+def time_class(time_control):
+    """chess.com time class of a TimeControl header ('180+2', '600', '1/86400'), from the
+    estimated game duration base + 40 * increment: bullet < 3min, blitz < 10min, else rapid."""
+    if "/" in time_control:
+        return 'daily'
+    base, _, increment = time_control.partition("+")
+    try:
+        duration = int(base) + 40 * int(increment or 0)
+    except ValueError:
+        return None
+    return 'bullet' if duration < 180 else 'blitz' if duration < 600 else 'rapid'
+
+def to_date(date):
+    """datetime.date from a date, datetime or 'YYYY.MM.DD' / 'YYYY-MM-DD' string."""
+    if isinstance(date, datetime.datetime):
+        return date.date()
+    if isinstance(date, datetime.date):
+        return date
+    return datetime.date(*(int(part) for part in re.split(r"[.\-/]", date)))
+
+
+class GameFilter:
+    """Games between start and end dates (inclusive), with time_controls (time classes, e.g.
+    ['blitz'], and/or TimeControl values, e.g. ['180+2']), where the user played color ('white'
+    or 'black') against an opponent rated between min_opponent_elo and max_opponent_elo.
+    Any argument left as None doesn't filter."""
+    def __init__(self, start=None, end=None, time_controls=None, color=None,
+                 min_opponent_elo=None, max_opponent_elo=None):
+        if color not in (None, 'white', 'black'):
+            raise ValueError(f"color must be 'white', 'black' or None, not {color}")
+        self.start = to_date(start) if start is not None else None
+        self.end = to_date(end) if end is not None else None
+        self.time_controls = set(time_controls) if time_controls is not None else None
+        self.color = color
+        self.min_opponent_elo, self.max_opponent_elo = min_opponent_elo, max_opponent_elo
+
+    def match_month(self, year, month):
+        """Whether any day of the month is in the date range."""
+        first = datetime.date(year, month, 1)
+        last = (first + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+        return (self.start is None or last >= self.start) and (self.end is None or first <= self.end)
+
+    def match_path(self, fname, parent_dir):
+        """False if fname is in {year}/{month}/ (or {year}/) directories outside the date range."""
+        parts = fname.relative_to(parent_dir).parts[:-1]
+        if (self.start is None and self.end is None) or len(parts) == 0 or not YEAR.match(parts[0]):
+            return True
+        year = int(parts[0])
+        if len(parts) > 1 and MONTH.match(parts[1]) and 1 <= int(parts[1]) <= 12:
+            return self.match_month(year, int(parts[1]))
+        return ((self.start is None or year >= self.start.year) and (self.end is None or year <= self.end.year))
+
+    def match_rows(self, df, username):
+        """Boolean mask of the library table's rows (from headers only) that pass the filter."""
+        mask = np.ones(len(df), dtype=bool)
+        if self.start is not None or self.end is not None:
+            dates = pd.to_datetime(df['Date'], format="%Y.%m.%d", errors='coerce')
+            if self.start is not None:
+                mask &= (dates >= pd.Timestamp(self.start)).to_numpy()
+            if self.end is not None:
+                mask &= (dates <= pd.Timestamp(self.end)).to_numpy()
+        if self.time_controls is not None:
+            mask &= np.array([tc in self.time_controls or time_class(tc) in self.time_controls
+                              for tc in df['TimeControl']], dtype=bool)
+        as_white, as_black = (df['White'] == username).to_numpy(), (df['Black'] == username).to_numpy()
+        if self.color is not None:
+            mask &= as_white if self.color == 'white' else as_black
+        if self.min_opponent_elo is not None or self.max_opponent_elo is not None:
+            opponent_elo = np.where(as_white, pd.to_numeric(df['BElo'], errors='coerce'),
+                                    np.where(as_black, pd.to_numeric(df['WElo'], errors='coerce'), np.nan))
+            if self.min_opponent_elo is not None:
+                mask &= opponent_elo >= self.min_opponent_elo
+            if self.max_opponent_elo is not None:
+                mask &= opponent_elo <= self.max_opponent_elo
+        return mask
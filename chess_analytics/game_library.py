@@ -1,60 +1,261 @@
+import os
+import pickle
+import numpy as np
 import pandas as pd
+from multiprocessing import Pool
 from .game_reader import GameReader
-from .openings import combine_like_openings, get_mainline
+from .pgn_stream import PGNStream
+from .positions import PositionIndex
+from .move_store import MoveStore
+from .book import OpeningBook, BOOK_PATH, find_book_deviations, aggregate_deviations
+from .openings import combine_like_openings, mainline_map
 from .tactics import find_forced_mate_positions
+from .filters import GameFilter
+from .cube import LibraryCube
+from .repertoire import MoveTrie
+from .dedup import find_duplicates, duplicate_sources
+from . import stats
 from pathlib import Path
 
+LIBRARY_COLUMNS = ['White', 'Black', 'Result', 'WElo', 'BElo', 'ECO', 'Opening', 'Date',
+                   'TimeControl', 'id', 'fname', 'offset']
+CACHE_NAME = ".library_cache_v2.pkl" # v2: game_key column
+POSITIONS_NAME = ".positions_v2.npz" # v2: file mtime and size, start FENs
+MOVES_NAME = ".moves_v2" # v2: file mtime and size
+CUBE_NAME = ".cube_v2.pkl"
+REPERTOIRE_NAME = ".repertoire_v2.npz" # v2: file mtime and size
+
+
+def describe_game(fname, offset=0):
+    """Reads the headers of one game and returns its describe() row and headers. This is the
+    worker for parallel loading, so only these (not the GameReader) are sent between processes."""
+    game = GameReader(fname, offset=offset)
+    return game.describe(), dict(game.headers)
+
+def key_game(fname, headers, offset=0):
+    """Content key of one game (see dedup.game_key, its moves are tokenized for it), the worker
+    for computing the keys of a deduplicating load in parallel."""
+    return GameReader(fname, headers, offset).key
+
 
 class GameLibrary:
     """Reads in all pgns in parent_dir, generates a dataframe of the library with
-    summaries of each game as rows."""
-    def __init__(self, parent_dir, limit = 2000):
+    summaries of each game as rows. Set n_workers > 1 (or None for all cores) to parse
+    games in parallel. The table is cached in parent_dir, so later loads only parse
+    new or changed files. With a GameFilter, e.g. GameFilter(start="2024.01.01",
+    time_controls=['blitz'], color='black'), only matching games are kept: other months'
+    directories are skipped, and the rest is filtered on headers before any moves are parsed.
+    Duplicate games (same Link and moves, e.g. re-downloaded or copied) are dropped unless dedup
+    is False, and listed in self.duplicates (see duplicate_report)."""
+    def __init__(self, parent_dir, limit = 2000, n_workers = 1, chunksize = 64, use_cache = True, filters = None,
+                 dedup = True):
         self.parent_dir = parent_dir
         self.username = parent_dir.split('/')[-1]
-        self.df = self.load_library(limit)
+        self.limit, self.n_workers, self.chunksize = limit, n_workers, chunksize
+        self.use_cache = use_cache
+        self.filters = filters
+        self.dedup = dedup
+        self.duplicates = None
+        self._positions, self._moves, self._cube, self._repertoire = None, None, None, None
+        self._similarity = {} # method -> GameSimilarity
+        self.df = self.load_library(limit, n_workers, chunksize)
         self.get_chcom_openings()
         self.load_games()
 
-    def load_library(self, limit):
+    def load_library(self, limit, n_workers = 1, chunksize = 64):
         """From the parent_dir, loads pgns and their summaries into a dataframe.
-        TODO - Speed up, using multiprocessing."""
-        library = [] 
-
-        library_files = list(Path(self.parent_dir).rglob("*.[tT][xX][tT]"))
-        print(f"Loading library ({len(library_files)} files)...") 
-        for i, fname in enumerate(library_files[:limit]):
-            game = GameReader(str(fname))
-            library.append(game.describe())
-        print("...loaded.\n")
-
-        library_df = pd.DataFrame(library, columns = ['White', 'Black', 'Result', 'WElo', 'BElo',
-                                                        'ECO', 'Opening', 'Date', 'TimeControl', 'id', 'fname'])
+        Rows for files whose (fname, mtime, size) match the cache are reused, the rest
+        are parsed. With n_workers > 1 (None = one per core) games are parsed by a process
+        pool, in chunks of chunksize games; rows keep the same order as a serial load.
+        The limit applies to the games in the filters' date range, before header filtering.
+        Dedup keys are only computed for the games kept by the filters (and then cached)."""
+        with stats.stage('library.list_games'):
+            library_games = self.list_games()
+        print(f"Loading library ({len(library_games)} games)...")
+        library_games = library_games[:limit]
+
+        with stats.stage('library.read_cache'):
+            cache = self.read_cache() if self.use_cache else None
+        cached = {}
+        if cache is not None:
+            cached = {key: i for i, key in enumerate(zip(cache.fname, cache.offset, cache.mtime, cache.fsize))}
+        cached_rows, cached_positions, new_games, new_positions = [], [], [], []
+        for position, game_key in enumerate(library_games):
+            if game_key in cached:
+                cached_rows.append(cached[game_key])
+                cached_positions.append(position)
+            else:
+                new_games.append(game_key)
+                new_positions.append(position)
+
+        with stats.stage('library.describe_games', len(new_games)):
+            new_df = self.describe_games([(fname, offset) for fname, offset, _, _ in new_games], n_workers, chunksize)
+        # int64 even when nothing was parsed, so concatenating doesn't round mtimes through float64
+        new_df['mtime'] = pd.array([mtime for _, _, mtime, _ in new_games], dtype='int64')
+        new_df['fsize'] = pd.array([fsize for _, _, _, fsize in new_games], dtype='int64')
+        print(f"...loaded ({len(new_games)} parsed, {len(cached_rows)} from cache).\n")
+        if cache is None:
+            library_df = new_df
+        else:
+            library_df = pd.concat([cache.iloc[cached_rows], new_df])
+            library_df.index = cached_positions + new_positions
+            library_df = library_df.sort_index()
+
+        keep = np.ones(len(library_df), dtype=bool)
+        if self.filters is not None:
+            keep = self.filters.match_rows(library_df, self.username)
+        missing_keys = keep & library_df.game_key.isna().to_numpy() if self.dedup else np.zeros_like(keep)
+        if missing_keys.any():
+            with stats.stage('library.game_keys', int(missing_keys.sum())):
+                library_df['game_key'] = library_df.game_key.astype(object)
+                library_df.loc[missing_keys, 'game_key'] = self.game_keys(library_df[missing_keys], n_workers, chunksize)
+
+        cache_df = self.with_unlisted_rows(library_df, cache)
+        if self.use_cache and (cache is None or len(new_games) > 0 or missing_keys.any() or len(cache) != len(cache_df)):
+            with stats.stage('library.write_cache'):
+                self.write_cache(cache_df)
+        library_df = library_df[keep].reset_index(drop=True)
+        if self.dedup:
+            library_df = self.drop_duplicates(library_df)
         return library_df
 
+    def game_keys(self, library_df, n_workers = 1, chunksize = 64):
+        """Dedup keys of the library table's rows (see key_game), in parallel like describe_games."""
+        games = list(zip(library_df.fname, library_df.Headers, library_df.offset))
+        if (n_workers is None or n_workers > 1) and len(games) > 0:
+            with Pool(n_workers) as pool:
+                return pool.starmap(key_game, games, chunksize=chunksize)
+        return [key_game(fname, headers, offset) for fname, headers, offset in games]
+
+    def drop_duplicates(self, library_df):
+        """Drops the games already in the library (same game_key), keeping the first one listed,
+        in one pass over the keys. The dropped ones are kept in self.duplicates, only their total is
+        printed (see duplicate_report() for where they were)."""
+        duplicated, self.duplicates = find_duplicates(library_df)
+        if len(self.duplicates) > 0:
+            stats.count('library.duplicates', len(self.duplicates))
+            print(f"Dropped {len(self.duplicates)} duplicate games (see duplicate_report()).")
+            library_df = library_df[~duplicated].reset_index(drop=True)
+        return library_df
+
+    def duplicate_report(self):
+        """Number of duplicates dropped, by (where they were, where the games they duplicate are)."""
+        return duplicate_sources(self.duplicates, self.parent_dir)
+
+    def with_unlisted_rows(self, library_df, cache):
+        """Cached rows outside the filters' date range are kept in the cache, so a filtered load
+        doesn't evict the rest of the library (deleted games go with the next unfiltered load)."""
+        if cache is None or self.filters is None:
+            return library_df
+        unlisted = [not self.filters.match_path(Path(fname), self.parent_dir) for fname in cache.fname]
+        return pd.concat([library_df, cache[unlisted]]) if any(unlisted) else library_df
+
+    def describe_games(self, library_games, n_workers = 1, chunksize = 64):
+        """Parses the headers of the (fname, offset) games into a dataframe. The reader.* stats
+        stages are only recorded for in-process parsing, a pool is timed as a whole."""
+        if (n_workers is None or n_workers > 1) and len(library_games) > 0:
+            with Pool(n_workers) as pool:
+                library = pool.starmap(describe_game, library_games, chunksize=chunksize)
+        else:
+            library = [describe_game(fname, offset) for fname, offset in library_games]
+
+        library_df = pd.DataFrame([row for row, _ in library], columns = LIBRARY_COLUMNS)
+        library_df['Headers'] = [headers for _, headers in library]
+        library_df['game_key'] = None # Computed for the games kept by the filters, see load_library
+        return library_df
+
+    def list_games(self):
+        """Returns (fname, offset, mtime, size) for every game under parent_dir. *.txt files hold
+        one game each, *.pgn files are multi-game archives, indexed by byte offset (see PGNStream)."""
+        library_games = []
+        for fname in self.library_files("*.[tT][xX][tT]"):
+            stat = os.stat(fname)
+            library_games.append((str(fname), 0, stat.st_mtime_ns, stat.st_size))
+        for fname in self.library_files("*.[pP][gG][nN]"):
+            stat = os.stat(fname)
+            library_games.extend((str(fname), int(offset), stat.st_mtime_ns, stat.st_size)
+                                 for offset in PGNStream(fname).offsets)
+        return library_games
+
+    def library_files(self, pattern):
+        """Files matching pattern under parent_dir, skipping {year}/{month}/ directories outside
+        the filters' date range."""
+        fnames = Path(self.parent_dir).rglob(pattern)
+        if self.filters is None:
+            return fnames
+        return (fname for fname in fnames if self.filters.match_path(fname, self.parent_dir))
+
+    def cache_path(self):
+        return Path(self.parent_dir) / CACHE_NAME
+
+    def read_cache(self):
+        """Loads the cached library table, or None if there is none (or it's unreadable)."""
+        try:
+            return pd.read_pickle(self.cache_path())
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+
+    def write_cache(self, library_df):
+        """Writes the library table next to the games (atomically, via a temporary file)."""
+        tmp_path = self.cache_path().with_suffix(".tmp")
+        library_df.reset_index(drop=True).to_pickle(tmp_path)
+        os.replace(tmp_path, self.cache_path())
+
+    def refresh(self):
+        """Re-scans parent_dir, only parsing new or changed games, and drops deleted ones."""
+        self.df = self.load_library(self.limit, self.n_workers, self.chunksize)
+        self._positions, self._moves, self._cube, self._repertoire = None, None, None, None
+        self._similarity = {} # method -> GameSimilarity
+        self.get_chcom_openings()
+        self.load_games()
+
     def __len__(self):
         return len(self.df)
 
     def load_games(self, limit=5000):
-        """ Loads all games into memory, unless above the limit. This increases
-        the object size by ~ 10MB/(1000 games). """
+        """ Loads all games into memory, unless above the limit. GameReaders are built from
+        the stored headers (no re-read), their moves are parsed on first access, after which
+        the object size grows by ~ 10MB/(1000 games). Library-wide scans use move_store()
+        instead, which needs ~2 bytes per move. """
         if len(self.df) <= limit:
-            self.df['Game'] = self.df.fname.apply(lambda fname: GameReader(fname))
+            self.df['Game'] = [GameReader(fname, headers, offset) for fname, headers, offset
+                               in zip(self.df.fname, self.df.Headers, self.df.offset)]
         else:
             self.df['Game'] = None
 
     def winrates(self):
-        """ Winrate by color. """
-        white_df = self.df[self.df['White'] == self.username]
-        black_df = self.df[self.df['Black'] == self.username]
-        black_wr = len(black_df[black_df['Result']==0])/len(black_df)
-        white_wr = len(white_df[white_df['Result']==1])/len(white_df)
-        return white_wr, black_wr
+        """ Winrate by color (from the cube). """
+        return self.cube().winrates()
+
+    def cube(self):
+        """The LibraryCube of game counts by color, mainline, time control, month, outcome, opponent
+        rating and termination, loaded from parent_dir and updated with any new or removed games."""
+        if self._cube is None:
+            path = Path(self.parent_dir) / CUBE_NAME
+            cube = None
+            if self.use_cache and path.exists():
+                try:
+                    with open(path, 'rb') as f:
+                        cube = pickle.load(f)
+                except (OSError, EOFError, pickle.UnpicklingError):
+                    cube = None
+            cube = cube if cube is not None else LibraryCube()
+            with stats.stage('cube.update', len(self)):
+                changed = cube.update(self)
+            if changed and self.use_cache and self.filters is None:
+                tmp_path = path.with_suffix(".tmp")
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(cube, f)
+                os.replace(tmp_path, path)
+            self._cube = cube
+        return self._cube
 
 
     def get_chcom_openings(self):
         """Chess.com suggested opening, simplify this to get ~mainlines."""
-        self.df['opening_chesscom_spec'] = self.extract_openings_from_ecourl()
-        self.df['opening_chesscom_general'] = self.mainline_openings()
+        with stats.stage('library.openings', len(self.df)):
+            self.df['opening_chesscom_spec'] = self.extract_openings_from_ecourl()
+            self.df['opening_chesscom_general'] = self.mainline_openings()
 
 
     def extract_openings_from_ecourl(self, color=None):
@@ -63,11 +264,21 @@ class GameLibrary:
             sub_df = self.df[self.df[color] == self.username]
         else:
             sub_df = self.df
-        eco_urls = sub_df['fname'].apply(lambda x: GameReader(x).headers['ECOUrl'] if 'ECOUrl' in GameReader(x).headers else '').values
+        eco_urls = [headers.get('ECOUrl', '') for headers in sub_df['Headers']]
         openings = [eco_url.split('/')[-1] for eco_url in eco_urls]
         return openings
 
 
+    def classify_openings(self):
+        """Adds ECO_moves and Opening_moves columns: the opening found from each game's moves
+        (longest matching line of data/ECO.txt), next to the ECO header based ones."""
+        classifier = GameReader.load_opening_classifier()
+        store = self.move_store()
+        move_lists = (store.san(i) for i in range(len(self)))
+        with stats.stage('openings.classify_moves', len(self)):
+            self.df['ECO_moves'], self.df['Opening_moves'] = classifier.classify_move_lists(move_lists)
+
+
     def opening_frequencies(self, color=None):
         """Aggregates opening names from ECOURL, by string similarity, 
         and sums their counts to get frequency of main lines."""
@@ -75,50 +286,122 @@ class GameLibrary:
     
 
     def mainline_openings(self):
-        """Maps specific openings to mainlines, based on mainlines from opening_frequencies()."""
-        specific_openings = self.df.opening_chesscom_spec
-        mainlines = [x[0] for x in self.opening_frequencies()]
-        return [get_mainline(mainlines, opening) for opening in specific_openings]
+        """Maps specific openings to mainlines (computed once per distinct opening, see mainline_map)."""
+        mapping = mainline_map(self.df.opening_chesscom_spec)
+        return [mapping.get(opening, 'NAO') for opening in self.df.opening_chesscom_spec]
 
 
     def results_by_openings(self, color = 'White'):
-        """Returns a mapping between opening: (wins, losses, draws)."""
+        """Returns a mapping between opening: (wins, losses, draws), ordered by number of games.
+        Each game counts towards its mainline (among this color's openings), using one groupby."""
         games = self.df[self.df[color] == self.username]
-        openings = games['opening_chesscom_spec']
-        opening_freqs = combine_like_openings(openings)
-
-        # Get results for top openings
-        opening_wrs = {}
-        for main_op in [x[0] for x in opening_freqs]:
-            mask = [main_op in op for op in openings]
-            games_op = games[mask]
-            if color=="White":   
-                opening_wrs[main_op] = (len(games_op[games_op.Result==1]), len(games_op[games_op.Result==0]),
-                                        len(games_op[games_op.Result==0.5]))
-            else:
-                opening_wrs[main_op] = (len(games_op[games_op.Result==0]), len(games_op[games_op.Result==1]),
-                                        len(games_op[games_op.Result==0.5]))
-                        
-        return opening_wrs
+        mainlines = games['opening_chesscom_spec'].map(mainline_map(games['opening_chesscom_spec']))
+        results = games.groupby([mainlines, games['Result']]).size().unstack(fill_value=0)
+        results = results.reindex(columns=[1, 0, 0.5], fill_value=0)
+        if color != "White":
+            results = results[[0, 1, 0.5]]
+        totals = results.sum(axis=1)
+        results = results.loc[sorted(results.index, key=lambda op: (-totals[op], op))]
+        return {op: tuple(int(n) for n in counts) for op, counts in zip(results.index, results.values)}
 
     def get_nth_game(self, n):
-        """Returns the nth game as a GameReader object."""
-        return GameReader(self.df.fname.iloc[n])
+        """Returns the nth game as a GameReader object (reusing the loaded one if available,
+        otherwise a seek to the game's offset and one parse)."""
+        if 'Game' in self.df and self.df.Game.iloc[n] is not None:
+            return self.df.Game.iloc[n]
+        return GameReader(self.df.fname.iloc[n], self.df.Headers.iloc[n], self.df.offset.iloc[n])
+
+    def move_store(self):
+        """The MoveStore of the library (row i is game i), memory-mapped from parent_dir and
+        updated with any new games (only those are parsed). Filtered libraries take their subset
+        of the saved store, without saving it back."""
+        if self._moves is None:
+            path = Path(self.parent_dir) / MOVES_NAME
+            store = MoveStore.load(path) if (self.use_cache and (path / "games.npz").exists()) else MoveStore()
+            with stats.stage('moves.update', len(self)):
+                changed = store.update(self)
+            if changed and self.use_cache and self.filters is None:
+                store.save(path)
+            self._moves = store
+        return self._moves
+
+    def position_index(self):
+        """The PositionIndex of the library, loaded from parent_dir and updated with any
+        new games (only those are replayed). As for move_store(), filtered libraries don't save it."""
+        if self._positions is None:
+            path = Path(self.parent_dir) / POSITIONS_NAME
+            index = PositionIndex.load(path) if (self.use_cache and path.exists()) else None
+            index = index if index is not None else PositionIndex() # Rebuilt if missing or unreadable
+            self.move_store() # Timed as its own stage
+            with stats.stage('positions.update', len(self)):
+                changed = index.update(self)
+            if changed and self.use_cache and self.filters is None:
+                index.save(path)
+            self._positions = index
+        return self._positions
 
-    def rank_fen_positions(self):
+    def rank_fen_positions(self, n=20, min_ply=0):
         """Returns a dictionary containing the most common positions reached by the player,
         ranked by frequency, and split by color"""
-        pass
+        index = self.position_index()
+        return {color: index.most_common(color, n, min_ply) for color in ['white', 'black']}
+
+    def games_reaching(self, fen):
+        """Rows of the games that reached the position (by any move order)."""
+        games = set(self.position_index().games_reaching(fen))
+        return self.df[[game in games for game in zip(self.df.fname, self.df.offset)]]
+
+    def moves_from(self, fen):
+        """Moves played from the position across the library, as [(san, count), ...]."""
+        return self.position_index().moves_from(fen)
+
+    def repertoire(self, max_ply=30):
+        """The MoveTrie (opening tree) of the first max_ply moves of every game, loaded from
+        parent_dir and updated with any new or removed games, e.g.
+            library.repertoire().continuations("e4 c5", n=5, color='white')"""
+        if self._repertoire is None or self._repertoire.max_ply != max_ply:
+            path = Path(self.parent_dir) / REPERTOIRE_NAME
+            trie = MoveTrie.load(path) if (self.use_cache and path.exists()) else None
+            trie = trie if (trie is not None and trie.max_ply == max_ply) else MoveTrie(max_ply)
+            with stats.stage('repertoire.update', len(self)):
+                changed = trie.update(self)
+            if changed and self.use_cache and self.filters is None:
+                trie.save(path)
+            self._repertoire = trie
+        return self._repertoire
+
+    def book_deviations(self, book_path=BOOK_PATH, user_only=True):
+        """Positions where games leave the opening book, by position and color, with how often
+        the user was the one deviating (see book.find_book_deviations)."""
+        with OpeningBook(book_path) as book:
+            deviations = find_book_deviations(self.position_index(), book)
+        if user_only:
+            deviations = deviations[deviations.by_user]
+        return aggregate_deviations(deviations)
+
+    def game_similarity(self, method='overlap'):
+        """GameSimilarity over the moves of every game, for all-pairs or top-k queries. It's built
+        once per method and kept until the library is refreshed."""
+        if method not in self._similarity:
+            from .similarity import GameSimilarity # scipy is only needed here
+            store = self.move_store()
+            self._similarity[method] = GameSimilarity([store.san(i) for i in range(len(self))], method)
+        return self._similarity[method]
+
+    def similar_games(self, n, k=5, method='overlap'):
+        """The k games most similar to the nth game, with a 'similarity' column."""
+        neighbours, similarities = self.game_similarity(method).nearest(n, k)
+        similar = self.df.iloc[neighbours].copy()
+        similar['similarity'] = similarities
+        return similar
 
-    def find_mate_positions(self, mate_in=2, limit=100):
+    def find_mate_positions(self, mate_in=2, limit=100, n_workers=None, search=None):
         """Finds all forced mate positions across the library, and returns the FEN position,
-        description, and link to game (t ~= 5mins/1000 games scanned)."""
-        return find_forced_mate_positions(self, mate_in, limit)
+        description, and link to game (t ~= 5mins/1000 games scanned, per engine process).
+        Pass a tactics.MateSearch for the staged search (mate_in can then be a range)."""
+        return find_forced_mate_positions(self, mate_in, limit, n_workers, search=search)
 
     # TODO
     # Rank most common positions after nth move (what are the correct continuations, mistakes user makes)
     # Generate tactics automatically (Mate in 2, mate in 3, ...)
-    # Longest common sequence of moves
-    # Most common ways of losing (time, resignation, mate)
     # Cluster games by opening, or similarity
-    # Plot against time, allow filtering on dates
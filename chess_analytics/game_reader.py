@@ -1,37 +1,85 @@
 import sys
 import json
-from functools import lru_cache
-import re
-import pandas as pd
+from functools import lru_cache, cached_property
 import chess.pgn
 import chess.polyglot
+try:
+    from .openings import OpeningClassifier, ECO_PATH, NIC_PATH, OPENINGS_PATH, USER_OPENINGS_PATH
+    from .pgn_tokens import read_headers, read_tokens
+    from .dedup import game_key
+    from . import stats
+except ImportError: # Run as a script
+    from openings import OpeningClassifier, ECO_PATH, NIC_PATH, OPENINGS_PATH, USER_OPENINGS_PATH
+    from pgn_tokens import read_headers, read_tokens
+    from dedup import game_key
+    import stats
 
 
 class GameReader:
-    """Read games from pgn files."""
-    def __init__(self, fgame):
+    """Read games from pgn files. Headers are read eagerly (or passed in, e.g. from a
+    GameLibrary row), the moves and opening are parsed on first access: moves, clocks and
+    pgn from the tokenizer (see pgn_tokens), which doesn't validate them unless validate
+    is True, game with python-chess (full game tree).
+    For multi-game files, offset is the byte offset of the game (see PGNStream)."""
+    def __init__(self, fgame, headers=None, offset=0, validate=False):
         self.fgame = fgame
-        self.game, self.headers = self.read_game()
-        self.pgn = self.parse_pgn()
-        self.moves = self.parse_moves()
+        self.offset = offset
+        self.validate = validate
+        self.headers = headers if headers is not None else self.read_headers()
         self.result = self.get_result()
         self.date = self.infer_date()
         self.eco_code = self.headers['ECO'] if 'ECO' in self.headers else "NaO"
         self.time_control = self.headers['TimeControl'] if 'TimeControl' in self.headers else "NT"
-        self.df_eco = self.load_eco_table()
-        self.df_nic = self.load_nic_table()
-        self.opening = self.eco_to_nic_opening()
+
+    @cached_property
+    def game(self):
+        return self.read_game()
+
+    @cached_property
+    def tokens(self):
+        return self.read_tokens()
+
+    @cached_property
+    def pgn(self):
+        return self.parse_pgn()
+
+    @cached_property
+    def moves(self):
+        return self.parse_moves()
+
+    @property
+    def clocks(self):
+        """Clock (seconds left) after each move, None where the PGN has no [%clk]."""
+        return self.tokens.clocks
+
+    @cached_property
+    def opening(self):
+        return self.eco_to_nic_opening()
+
+    @property
+    def df_eco(self):
+        return self.load_eco_table()
+
+    @property
+    def df_nic(self):
+        return self.load_nic_table()
+
+    @property
+    def key(self):
+        """Content key of the game (Link and moves, see dedup.game_key)."""
+        return game_key(self.headers, self.moves)
 
     def __eq__(self, other):
-        """If two games have the same pgn (including headers), they're the same game."""
-        return str(self.game) == str(other.game)
+        """If two games have the same content key, they're the same game (e.g. downloaded twice)."""
+        return self.key == other.key
 
     
     @classmethod
     @lru_cache(maxsize=None)
     def load_eco_table(cls):
         """Load Encyclopedia of Chess Openings into dataframe (2700+ openings)."""
-        df_eco = pd.read_csv("data/ECO.txt", sep='\t', names = ["Name", "Moves", "nq"])
+        import pandas as pd
+        df_eco = pd.read_csv(ECO_PATH, sep='\t', names = ["Name", "Moves", "nq"])
         df_eco = df_eco.reset_index().drop(columns=['nq']).iloc[:-2]
         df_eco.columns = ['ECO', 'Name', 'Moves']
         df_eco['ECO'] = df_eco['ECO'].apply(lambda x: x.rstrip())
@@ -41,19 +89,49 @@ class GameReader:
     @lru_cache(maxsize=None)
     def load_nic_table(self):
         """Load New in Chess key (35 ECOs --> Names)."""
-        return pd.read_csv("data/NIC_Key.txt", sep='\t')
+        import pandas as pd
+        return pd.read_csv(NIC_PATH, sep='\t')
 
     def __str__(self):
         return self.pgn
 
+    def read_headers(self):
+        """Returns the headers only, without parsing the moves."""
+        with stats.stage('reader.read_headers'):
+            return read_headers(self.fgame, self.offset)
+
+    def read_tokens(self):
+        """Returns the game's PGNTokens (headers, SAN moves and clocks), validated if self.validate."""
+        with stats.stage('reader.tokenize'):
+            tokens = read_tokens(self.fgame, self.offset)
+        if self.validate:
+            with stats.stage('reader.validate'):
+                tokens.validate()
+        return tokens
+
     def read_game(self):
-        """Returns headers, python-chess' game object, and the PGN string. """
-        with open(self.fgame) as pgn_file:
-            game = chess.pgn.read_game(pgn_file)
-        return game, game.headers
+        """Returns python-chess' game object (full parse of the moves)."""
+        with stats.stage('reader.parse_game'), open(self.fgame) as pgn_file:
+            pgn_file.seek(self.offset)
+            return chess.pgn.read_game(pgn_file)
 
 
     # Openings
+    @classmethod
+    @lru_cache(maxsize=None)
+    def load_opening_classifier(cls):
+        """ECO + NIC tables compiled into lookup dicts and a move trie (see OpeningClassifier),
+        loaded from the tables precompiled with the package. If those are missing or out of date, they
+        are rebuilt once and saved to the user's cache directory (the package is left untouched)."""
+        classifier = OpeningClassifier.load(OPENINGS_PATH) or OpeningClassifier.load(USER_OPENINGS_PATH)
+        if classifier is None:
+            classifier = OpeningClassifier(cls.load_eco_table(), cls.load_nic_table())
+            try:
+                classifier.save(USER_OPENINGS_PATH)
+            except OSError: # No writable cache directory, compile again next time
+                pass
+        return classifier
+
     def eco_to_opening(self):
         """Using the eco table + game's ECO code, find the opening name.
         Issue: this assumes the first row is the main line, but that's not the case."""
@@ -61,58 +139,27 @@ class GameReader:
             return self.eco_code
         else:
             # Lookup main line name
-            return self.df_eco[self.df_eco['ECO'] == self.eco_code].iloc[0]['Name']
+            return self.load_opening_classifier().eco_to_opening(self.eco_code)
 
     def eco_to_nic_opening(self):
-        """Use NIC table for opening name."""
-        if self.eco_code == 'NaO': # Not an opening
-            return self.eco_code
-
-        # Direct match
-        match = self.df_nic.Name[self.df_nic['Codes'] == self.eco_code]
-        if match.size > 0:
-            return match.values[0]
-        else:
-            # Get from code_range
-            letter, code_int = self.eco_code[0], int(self.eco_code[1:])
-            for i, code_range in enumerate(self.df_nic.Code_ranges.values):
-                if (letter == code_range[0]) and (code_int >= code_range[1]) and (code_int <= code_range[2]):
-                    return self.df_nic.Name.iloc[i].rstrip()
-            
-            # If missing, fall back on data/ECO.txt
-            # (e.g the Philidor Defense)
-            return self.eco_to_opening() + "*"
-    
-    def clean_pgn(self):
-        """ Scrubs comments, side-lines and move-numbers from PGN. """
-        clean_pgn = ""
-        is_dirty = False
-        for x in self.pgn:
-            if x =="{":
-                is_dirty = True
-            elif x == "}":
-                is_dirty = False
-            else:
-                if not is_dirty:
-                    clean_pgn += x
-        
-        # Remove redundant move-numbers (1...) and result
-        clean_pgn = re.sub('\d{1,2}[.]{3} ', '', clean_pgn) 
-        return " ".join([p for p in clean_pgn.split(' ')[:-1] if p !=""])
+        """Use NIC table for opening name (narrowest NIC code range containing the ECO code),
+        falling back on data/ECO.txt (e.g the Philidor Defense)."""
+        with stats.stage('reader.opening'):
+            return self.load_opening_classifier().eco_to_nic_opening(self.eco_code)
 
+    def moves_to_opening(self):
+        """(ECO, name) of the longest ECO line matching the game's moves."""
+        return self.load_opening_classifier().classify_moves(self.moves)
 
     def parse_pgn(self):
-        """Parses and cleans the pgn, removing comments, side-lines, result. """
-        self.pgn = str(self.game).split('\n\n')[1] # 0 is headers, 1 is the moves
-        return self.clean_pgn()
+        """The moves with move numbers, without comments, side-lines or result, e.g. '1. e4 e5 2. Nf3'."""
+        return self.tokens.movetext()
 
 
     def parse_moves(self):
         """ Parse moves from pgn, returns either i) two separate arrays for B/W or ii) one list,
         e.g. ['e4', 'e5', 'Nf3', 'Nf6', ...]."""
-        moves = self.pgn.split(" ")
-        del moves[::3] # Remove move numbers
-        return moves # moves_white, moves_black = moves[0::2], moves[1::2]  
+        return list(self.tokens.sans) # moves_white, moves_black = moves[0::2], moves[1::2]
 
     def play_nth_move(self, n=1):
         """Play n plys using python-chess game object, return new board state. In Jupyter, this renders
@@ -168,7 +215,7 @@ class GameReader:
         return [self.headers['White'], self.headers['Black'], self.result,
                 self.headers['WhiteElo'], self.headers['BlackElo'], self.eco_code,
                 self.opening, self.date, self.time_control, self.headers['Link'],
-                self.fgame]
+                self.fgame, self.offset]
         
             
 
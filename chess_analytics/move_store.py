@@ -0,0 +1,143 @@
+import os
+from multiprocessing import Pool
+from pathlib import Path
+import numpy as np
+import chess
+from .pgn_tokens import read_tokens
+from .positions import encode_move, decode_move, library_games
+
+""" Compact move store: the mainline of every game as 16-bit move codes (see
+positions.encode_move) in one contiguous buffer, with game i's moves at
+codes[offsets[i]:offsets[i + 1]]. Both arrays are saved as .npy files and memory-mapped
+on load, so scans over the whole library replay boards from the codes instead of holding
+a parsed GameReader per game (~2 bytes per ply instead of ~10KB per game). """
+
+
+def encode_game(fname, offset=0):
+    """Tokenizes one game and returns (move codes, starting FEN or None for the standard start).
+    This is the worker for parallel encoding, so only arrays are sent between processes."""
+    tokens = read_tokens(fname, offset)
+    codes = np.array([encode_move(move) for move in tokens.validate(strict=False)], dtype=np.uint16)
+    board = tokens.board()
+    return codes, None if board == chess.Board() else board.fen()
+
+
+class MoveStore:
+    """Games are stored as (fname, offset, mtime, fsize), like PositionIndex, so the store can be
+    updated incrementally as a library changes (a file rewritten in place is re-encoded). Games
+    that don't start from the standard position (e.g. a SetUp/FEN header) keep their starting
+    FEN in start_fens."""
+    def __init__(self):
+        self.codes = np.zeros(0, dtype=np.uint16)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.games = []
+        self.start_fens = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Loads a store saved in the directory path, memory-mapping the move buffers."""
+        path = Path(path)
+        store = cls()
+        store.codes = np.load(path / "codes.npy", mmap_mode=mmap_mode)
+        store.offsets = np.load(path / "offsets.npy", mmap_mode=mmap_mode)
+        with np.load(path / "games.npz") as data:
+            store.games = list(zip(data['fnames'].tolist(), data['offsets'].tolist(), data['mtimes'].tolist(),
+                                   data['fsizes'].tolist()))
+            store.start_fens = dict(zip(data['start_ids'].tolist(), data['start_fens'].tolist()))
+        return store
+
+    def save(self, path):
+        """Saves to the directory path (each file atomically, via a temporary file)."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        fnames = np.array([game[0] for game in self.games], dtype=str)
+        offsets, mtimes, fsizes = (np.array([game[i] for game in self.games], dtype=np.int64) for i in [1, 2, 3])
+        start_ids = np.array(list(self.start_fens), dtype=np.int64)
+        start_fens = np.array(list(self.start_fens.values()), dtype=str)
+        for name, save in [("codes.npy", lambda f: np.save(f, self.codes)),
+                           ("offsets.npy", lambda f: np.save(f, self.offsets)),
+                           ("games.npz", lambda f: np.savez(f, fnames=fnames, offsets=offsets, mtimes=mtimes,
+                                                             fsizes=fsizes, start_ids=start_ids,
+                                                             start_fens=start_fens))]:
+            tmp_path = path / (name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                save(f)
+            os.replace(tmp_path, path / name)
+
+    def update(self, library, n_workers=None, chunksize=64):
+        """Encodes the library's new games (parsed by a process pool when n_workers > 1,
+        defaulting to the library's n_workers), drops games no longer in it, and puts the
+        rest in library order, so game i is library.df row i. Returns True if the store changed."""
+        games = library_games(library.df)
+        ids = {game: i for i, game in enumerate(self.games)}
+        new_games = [game for game in games if game not in ids]
+        n_workers = library.n_workers if n_workers is None else n_workers
+        if (n_workers is None or n_workers > 1) and len(new_games) > 0:
+            with Pool(n_workers) as pool:
+                encoded = pool.starmap(encode_game, [game[:2] for game in new_games], chunksize=chunksize)
+        else:
+            encoded = [encode_game(fname, offset) for fname, offset, _, _ in new_games]
+        for game, (codes, start_fen) in zip(new_games, encoded):
+            if start_fen is not None:
+                self.start_fens[len(self.games)] = start_fen
+            ids[game] = len(self.games)
+            self.games.append(game)
+        if new_games:
+            self.append([codes for codes, _ in encoded])
+
+        order = [ids[game] for game in games]
+        reordered = order != list(range(len(self)))
+        if reordered:
+            self.take(order)
+        return reordered or len(new_games) > 0
+
+    def append(self, code_lists):
+        """Appends games given as arrays of move codes (their games entries are added by the caller)."""
+        lengths = np.array([len(codes) for codes in code_lists], dtype=np.int64)
+        self.codes = np.concatenate([self.codes, *code_lists]).astype(np.uint16)
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+
+    def take(self, ids):
+        """Keeps only the games ids, in that order (one vectorized gather of the buffer)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        lengths = np.diff(self.offsets)[ids]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        rows = np.repeat(self.offsets[:-1][ids] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        self.codes, self.offsets = np.asarray(self.codes[rows], dtype=np.uint16), offsets
+        self.start_fens = {new_id: self.start_fens[old_id] for new_id, old_id in enumerate(ids.tolist())
+                           if old_id in self.start_fens}
+        self.games = [self.games[i] for i in ids]
+
+    # Per game access
+    def game_codes(self, i):
+        """Move codes of game i (a view, so a slice of the memory map)."""
+        return self.codes[self.offsets[i]:self.offsets[i + 1]]
+
+    def moves(self, i):
+        return [decode_move(code) for code in self.game_codes(i)]
+
+    def board(self, i):
+        """Starting position of game i."""
+        return chess.Board(self.start_fens.get(i, chess.STARTING_FEN))
+
+    def boards(self, i):
+        """Yields (board, move) for every move of game i, advancing one board in place."""
+        board = self.board(i)
+        for code in self.game_codes(i):
+            move = decode_move(code)
+            yield board, move
+            board.push(move)
+
+    def board_at(self, i, ply):
+        """Board of game i before ply (after all its moves if ply >= the game's length)."""
+        board = self.board(i)
+        for code in self.game_codes(i)[:ply]:
+            board.push(decode_move(code))
+        return board
+
+    def san(self, i):
+        """SAN moves of game i, as in GameReader.moves."""
+        return [board.san(move) for board, move in self.boards(i)]
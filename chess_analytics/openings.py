@@ -1,43 +1,71 @@
+import os
+import ast
+import re
+import pickle
+import hashlib
 from collections import defaultdict
-import sys
+from pathlib import Path
+
+# Opening tables, found relative to the package (not the working directory)
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+ECO_PATH, NIC_PATH = DATA_DIR / "ECO.txt", DATA_DIR / "NIC_Key.txt"
+OPENINGS_PATH = Path(__file__).resolve().parent / "openings_v1.pkl" # Precompiled OpeningClassifier
+# Files written at runtime go to the user's cache directory, not the (possibly read-only, tracked) package
+USER_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / ".cache") / "chess_analytics"
+USER_OPENINGS_PATH = USER_CACHE_DIR / "openings_v1.pkl" # Recompiled when the tables change
 
 # Utility functions to combine openings (from ECOURL)
 def chop_opening_ending(opening):
     """Removes the non-word parts of openings."""
-    if (opening.split('-')[-1]).isalpha():
-        return opening
-    else:
-        return chop_opening_ending("-".join(opening.split("-")[:-1]))
+    parts = opening.split('-')
+    while parts and not parts[-1].isalpha():
+        parts.pop()
+    return "-".join(parts)
     
     
 def compress_openings(openings):
-    """ Compress openings, such that side-lines and main-lines are combined."""
+    """ Compress (sorted) openings, such that side-lines and main-lines are combined."""
     openings_compressed = defaultdict(int)
-    last_matched = -sys.maxsize
-    for i, op in enumerate(openings):
-        if i <= last_matched:
-            continue
-        else:
-            openings_compressed[op] += 1
-            for j, op_2 in enumerate(openings[i+1:]):
-                if op in op_2:
-                    openings_compressed[op] += 1
-                    last_matched = i + 1 + j
-                else:
-                    break
+    mainline = None
+    for op in openings:
+        if mainline is None or mainline not in op:
+            mainline = op
+        openings_compressed[mainline] += 1
     return openings_compressed
 
+
+def mainline_map(openings):
+    """Maps each distinct opening to its mainline: the shortest chopped opening (see
+    chop_opening_ending) among openings that its own chopped name starts with, e.g.
+    Sicilian-Defense-Najdorf-6.Bg5 --> Sicilian-Defense. Found with a prefix trie over the
+    hyphen-separated names, so the cost is linear in the number of distinct openings."""
+    chopped = {op: chop_opening_ending(op) for op in set(openings) if op}
+    trie = {}
+    for name in set(chopped.values()):
+        node = trie
+        for token in name.split('-'):
+            node = node.setdefault(token, {})
+        node[None] = name # None marks the end of a name
+    mapping = {}
+    for op, name in chopped.items():
+        node = trie
+        for token in name.split('-'):
+            node = node[token]
+            if None in node:
+                mapping[op] = node[None]
+                break
+    return mapping
+
     
 def combine_like_openings(openings):
     """Chop off the ends of openings and then combine them to get main-line counts."""
-    openings = sorted([chop_opening_ending(op) for op in openings if op])
-    openings = compress_openings(openings)
-    print(f"Number of main-lines played: {len(openings)}")
-    # Number of games for which an opening was found
-    # print(sum(openings.values()))
-    
-    openings = sorted(openings.items(), key=lambda x: -x[1])
-    return openings
+    mapping = mainline_map(openings)
+    counts = defaultdict(int)
+    for op in openings:
+        if op in mapping:
+            counts[mapping[op]] += 1
+    print(f"Number of main-lines played: {len(counts)}")
+    return sorted(counts.items(), key=lambda x: (-x[1], x[0]))
 
 def get_mainline(mainlines, opening):
     for mainline in mainlines:
@@ -52,4 +80,117 @@ def process_opening(x):
         x = ";".join(x[:-2].split(";"))
         return x if len(x) == 1 else x
     else:
-        return x
\ No newline at end of file
+        return x
+
+# Indexed opening classifier (ECO/NIC tables compiled once)
+MOVE_NUMBER = re.compile(r'^\d+\.+')
+
+def split_eco_moves(moves):
+    """'1.e4 e5 2.Nf3' --> ['e4', 'e5', 'Nf3']"""
+    tokens = [MOVE_NUMBER.sub('', token) for token in str(moves).split()]
+    return [token for token in tokens if token]
+
+
+class OpeningClassifier:
+    """Opening names from ECO codes or from moves, compiled once from the ECO and NIC tables:
+    - ECO code --> name of its first row in the ECO table (dict)
+    - ECO code --> NIC name, from the narrowest NIC code range containing it (dict over all
+      A00-E99 codes, built from the sorted ranges)
+    - a trie of the ECO table's move sequences, for classifying games by their moves."""
+    def __init__(self, df_eco, df_nic):
+        self.eco_names = {}
+        self.move_trie = {}
+        for eco, name, moves in zip(df_eco['ECO'], df_eco['Name'], df_eco['Moves']):
+            self.eco_names.setdefault(eco, name.rstrip())
+            self.add_line(split_eco_moves(moves), (eco, name.rstrip()))
+        self.nic_names = self.compile_nic_ranges(df_nic)
+
+    @staticmethod
+    def tables_digest(paths=(ECO_PATH, NIC_PATH)):
+        """Hash of the opening tables, to tell whether a precompiled classifier is up to date
+        (None if the tables aren't available, e.g. only the precompiled one is installed)."""
+        digest = hashlib.sha1()
+        for path in paths:
+            if not os.path.exists(path):
+                return None
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    @classmethod
+    def load(cls, path=OPENINGS_PATH):
+        """The precompiled classifier saved at path, or None if missing, unreadable or older than the tables."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError):
+            return None
+        digest = cls.tables_digest()
+        if digest is not None and digest != data['digest']:
+            return None
+        classifier = cls.__new__(cls)
+        classifier.eco_names, classifier.nic_names, classifier.move_trie = (data['eco_names'], data['nic_names'],
+                                                                           data['move_trie'])
+        return classifier
+
+    def save(self, path=OPENINGS_PATH):
+        """Saves the compiled tables (plain dicts, so loading doesn't need pandas or this class' module path)."""
+        data = {'digest': self.tables_digest(), 'eco_names': self.eco_names, 'nic_names': self.nic_names,
+                'move_trie': self.move_trie}
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def compile_nic_ranges(df_nic):
+        """Exact NIC codes take precedence, then the narrowest range containing the code."""
+        intervals = []
+        for name, code_range in zip(df_nic['Name'], df_nic['Code_ranges']):
+            letter, low, high = ast.literal_eval(code_range) if isinstance(code_range, str) else code_range
+            intervals.append((high - low, letter, low, high, name.strip()))
+        nic_names = {}
+        for _, letter, low, high, name in sorted(intervals, key=lambda x: x[0]):
+            for code_int in range(low, high + 1):
+                nic_names.setdefault(f"{letter}{code_int:02d}", name)
+        return nic_names
+
+    def add_line(self, moves, entry):
+        node = self.move_trie
+        for move in moves:
+            node = node.setdefault(move, {})
+        node.setdefault(None, entry) # None holds the (eco, name) ending at this node
+
+    def eco_to_opening(self, eco_code):
+        """Name of the first ECO table row for the code (the code itself if unknown)."""
+        return self.eco_names.get(eco_code, eco_code)
+
+    def eco_to_nic_opening(self, eco_code):
+        """NIC opening name, falling back on the ECO table (marked with *, e.g. Philidor Defense)."""
+        if eco_code == 'NaO': # Not an opening
+            return eco_code
+        if eco_code in self.nic_names:
+            return self.nic_names[eco_code]
+        return self.eco_to_opening(eco_code) + " *"
+
+    def classify_moves(self, moves):
+        """(eco, name) of the longest ECO line that the moves start with, or ('NaO', 'NaO')."""
+        node, entry = self.move_trie, ('NaO', 'NaO')
+        for move in moves:
+            if move not in node:
+                break
+            node = node[move]
+            entry = node.get(None, entry)
+        return entry
+
+    def classify_codes(self, eco_codes):
+        """eco_to_nic_opening over a whole column of codes."""
+        return [self.eco_to_nic_opening(eco_code) for eco_code in eco_codes]
+
+    def classify_move_lists(self, move_lists):
+        """classify_moves over many games, as two lists (ecos, names)."""
+        entries = [self.classify_moves(moves) for moves in move_lists]
+        return [eco for eco, _ in entries], [name for _, name in entries]
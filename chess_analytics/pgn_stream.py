@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import chess.pgn
+
+
+class PGNStream:
+    """Streams games from a multi-game PGN file (e.g. a monthly archive, or the output of
+    GameDownloader.games_to_file). On the first scan, the byte offset of every game is saved
+    next to the file ({fname}.idx.npy), so the nth game is a seek plus one parse."""
+    def __init__(self, fname):
+        self.fname = str(fname)
+        self.index_fname = self.fname + ".idx.npy"
+        self.offsets = self.load_index()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return self.iter_games()
+
+    def load_index(self):
+        """Loads the saved offsets, or re-scans if the file changed since (size or mtime).
+        The index is stored as [size, mtime_ns, offset_0, offset_1, ...]."""
+        stat = os.stat(self.fname)
+        if os.path.exists(self.index_fname):
+            index = np.load(self.index_fname)
+            if len(index) >= 2 and index[0] == stat.st_size and index[1] == stat.st_mtime_ns:
+                return index[2:]
+
+        offsets = self.scan_offsets()
+        index = np.concatenate([[stat.st_size, stat.st_mtime_ns], offsets]).astype(np.int64)
+        try:
+            np.save(self.index_fname, index)
+        except OSError:
+            pass # Read-only directory, keep the index in memory only
+        return offsets
+
+    def scan_offsets(self):
+        """Byte offsets of the first header line of each game, found with a raw byte scan
+        (no move parsing). Lines inside {comments} are never treated as headers."""
+        offsets = []
+        offset = 0
+        prev_is_header, in_comment = False, False
+        with open(self.fname, 'rb') as pgn_file:
+            for line in pgn_file:
+                is_header = not in_comment and line.lstrip(b'\xef\xbb\xbf \t').startswith(b'[')
+                if is_header and not prev_is_header:
+                    offsets.append(offset)
+                if not is_header:
+                    open_at, close_at = line.rfind(b'{'), line.rfind(b'}')
+                    if open_at > close_at:
+                        in_comment = True
+                    elif close_at > open_at:
+                        in_comment = False
+                prev_is_header = is_header
+                offset += len(line)
+        return np.array(offsets, dtype=np.int64)
+
+    def iter_games(self):
+        """Yields python-chess game objects one at a time, reading the file sequentially."""
+        with open(self.fname) as pgn_file:
+            while True:
+                game = chess.pgn.read_game(pgn_file)
+                if game is None:
+                    break
+                yield game
+
+    def iter_headers(self):
+        """Yields (offset, headers) for every game, skipping over the moves."""
+        with open(self.fname) as pgn_file:
+            for offset in self.offsets:
+                pgn_file.seek(offset)
+                yield int(offset), chess.pgn.read_headers(pgn_file)
+
+    def read_game(self, n):
+        """Returns the nth game (seek + parse)."""
+        with open(self.fname) as pgn_file:
+            pgn_file.seek(self.offsets[n])
+            return chess.pgn.read_game(pgn_file)
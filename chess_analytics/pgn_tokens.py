@@ -0,0 +1,142 @@
+import re
+import chess
+import chess.pgn
+
+""" Fast PGN tokenizer: headers and the mainline's SAN moves and clocks, read straight from
+the PGN text, without building python-chess' game tree (GameNodes, comments, variations)
+or playing every move on a board. Most library statistics only need headers and SAN, so
+moves are only checked against a board when asked for (validate), e.g.
+    tokens = read_tokens("game.txt")
+    tokens.sans, tokens.clocks    # ['e4', 'e5', ...], [179.9, 178.2, ...]
+    tokens.validate()             # [Move.from_uci('e2e4'), ...], or raises ValueError """
+TAG_REGEX = chess.pgn.TAG_REGEX # Same headers as chess.pgn.read_headers
+TOKEN_REGEX = re.compile(r"\{([^}]*)\}|;[^\n]*|([()])|([^\s{}();]+)")
+CLOCK_REGEX = re.compile(r"\[%clk\s+(\d+):(\d+):(\d+(?:\.\d*)?)\]")
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+
+
+def comment_open(line, is_open=False):
+    """Whether a {comment} is still open at the end of a movetext line (is_open: at its start)."""
+    position = 0
+    while True:
+        if is_open:
+            end = line.find("}", position)
+            if end < 0:
+                return True
+            is_open, position = False, end + 1
+        else:
+            start, semicolon = line.find("{", position), line.find(";", position)
+            if start < 0 or 0 <= semicolon < start: # None left, or commented out until the end of the line
+                return False
+            is_open, position = True, start + 1
+
+def read_pgn_text(fname, offset=0, headers_only=False):
+    """(header lines, movetext) of the game at byte offset of a PGN file, reading no further
+    than the game's end (or than its headers). Blank lines inside a {comment} don't end the game."""
+    header_lines, movetext = [], []
+    in_comment = False
+    with open(fname) as pgn_file:
+        pgn_file.seek(offset)
+        for line in pgn_file:
+            if in_comment:
+                movetext.append(line)
+                in_comment = comment_open(line, True)
+                continue
+            if line.startswith("%") or line.startswith(";"):
+                continue
+            if not movetext and line.startswith("["):
+                header_lines.append(line)
+            elif line.isspace():
+                if movetext or (header_lines and headers_only):
+                    break
+            elif headers_only:
+                break
+            else:
+                movetext.append(line)
+                in_comment = comment_open(line)
+    return header_lines, "".join(movetext)
+
+def parse_headers(header_lines):
+    headers = chess.pgn.Headers({})
+    for line in header_lines:
+        tag = TAG_REGEX.match(line)
+        if tag:
+            headers[tag.group(1)] = tag.group(2)
+    return headers
+
+def tokenize_movetext(movetext):
+    """(SAN moves, clocks in seconds) of the mainline, skipping move numbers, NAGs, variations
+    and the result. A move's clock is None if it has no [%clk] comment."""
+    sans, clocks, depth = [], [], 0
+    for comment, paren, token in TOKEN_REGEX.findall(movetext):
+        if token:
+            if depth or token[0] == "$" or token in RESULTS:
+                continue
+            if token[0].isdigit():
+                if token.startswith("0-0"): # Castling written with zeros
+                    token = token.replace("0", "O")
+                else:
+                    token = token.lstrip("0123456789").lstrip(".") # Move numbers, also '1.e4'
+                    if not token:
+                        continue
+            sans.append(token.rstrip("!?"))
+            clocks.append(None)
+        elif paren:
+            depth += 1 if paren == "(" else -1
+        elif comment and not depth and sans:
+            clock = CLOCK_REGEX.search(comment)
+            if clock:
+                hours, minutes, seconds = clock.groups()
+                clocks[-1] = 3600 * int(hours) + 60 * int(minutes) + float(seconds)
+    return sans, clocks
+
+
+class PGNTokens:
+    """Headers (chess.pgn.Headers), SAN moves and clocks of a game's mainline, unvalidated."""
+    def __init__(self, headers, sans, clocks):
+        self.headers, self.sans, self.clocks = headers, sans, clocks
+
+    def __len__(self):
+        return len(self.sans)
+
+    def board(self):
+        """Starting position (from the FEN header, if any)."""
+        return self.headers.board()
+
+    def validate(self, strict=True):
+        """Plays the moves from the starting position, returning them as chess.Move. Raises
+        ValueError (chess.IllegalMoveError, ...) on the first illegal or ambiguous move, or
+        if not strict, returns the moves before it (as chess.pgn.read_game's mainline)."""
+        board, moves = self.board(), []
+        for san in self.sans:
+            try:
+                moves.append(board.push_san(san))
+            except ValueError:
+                if strict:
+                    raise
+                break
+        return moves
+
+    def movetext(self):
+        """Moves with move numbers, e.g. '1. e4 e5 2. Nf3' (no comments or result)."""
+        board = self.board() if "FEN" in self.headers else None
+        first_ply = 0 if board is None else 2 * (board.fullmove_number - 1) + (board.turn == chess.BLACK)
+        parts = []
+        for ply, san in enumerate(self.sans, first_ply):
+            if ply % 2 == 0:
+                parts.append(f"{ply // 2 + 1}.")
+            elif ply == first_ply:
+                parts.append(f"{ply // 2 + 1}...")
+            parts.append(san)
+        return " ".join(parts)
+
+
+def read_headers(fname, offset=0):
+    """Headers of the game at offset, as chess.pgn.read_headers."""
+    header_lines, _ = read_pgn_text(fname, offset, headers_only=True)
+    return parse_headers(header_lines)
+
+def read_tokens(fname, offset=0):
+    """PGNTokens of the game at offset."""
+    header_lines, movetext = read_pgn_text(fname, offset)
+    return PGNTokens(parse_headers(header_lines), *tokenize_movetext(movetext))
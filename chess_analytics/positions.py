@@ -0,0 +1,200 @@
+import os
+import pickle
+import zipfile
+from collections import Counter
+import numpy as np
+import chess
+import chess.polyglot
+
+""" Library-wide position index: every position reached in every game, as 64-bit Zobrist
+keys in flat NumPy arrays (one row per ply), so that lookups are a binary search. """
+NO_MOVE = 0 # Move code for the final position of a game
+COLORS = {'white': 1, 'black': 0}
+# Errors of np.load on a truncated or corrupt .npz file (load() returns None, so it's rebuilt)
+LOAD_ERRORS = (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile, pickle.UnpicklingError)
+
+
+def encode_move(move):
+    """16-bit move code: from square (6 bits), to square (6 bits), promotion piece (3 bits)."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+def decode_move(code):
+    code = int(code)
+    return chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
+
+def library_games(df):
+    """(fname, offset, mtime, fsize) of a library table's games: a game as of its file's last
+    change, so a file rewritten in place is a new game for the indexes."""
+    return list(zip(df.fname, (int(offset) for offset in df.offset), (int(mtime) for mtime in df.mtime),
+                    (int(fsize) for fsize in df.fsize)))
+
+
+class PositionIndex:
+    """Rows are (key, game_id, ply, turn, move): the Zobrist key of the position before
+    ply, the side to move (True = white), and the move played from it. Games are stored
+    as (fname, offset, mtime, fsize) with the user's color (1 = white, 0 = black, -1 = neither),
+    so the index can be updated incrementally as a library changes, and games that don't start
+    from the standard position keep their starting FEN in start_fens (by game id)."""
+    def __init__(self):
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.game_ids = np.zeros(0, dtype=np.int32)
+        self.plies = np.zeros(0, dtype=np.uint16)
+        self.turns = np.zeros(0, dtype=bool)
+        self.moves = np.zeros(0, dtype=np.uint16)
+        self.games = []
+        self.colors = np.zeros(0, dtype=np.int8)
+        self.start_fens = {}
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def load(cls, path):
+        """The index saved at path, or None if it's unreadable (e.g. cut short by a crash)."""
+        index = cls()
+        try:
+            with np.load(path) as data:
+                for name in ['keys', 'game_ids', 'plies', 'turns', 'moves', 'colors']:
+                    setattr(index, name, data[name])
+                index.games = list(zip(data['fnames'].tolist(), data['offsets'].tolist(), data['mtimes'].tolist(),
+                                       data['fsizes'].tolist()))
+                index.start_fens = dict(zip(data['start_ids'].tolist(), data['start_fens'].tolist()))
+            if {len(index.game_ids), len(index.plies), len(index.turns), len(index.moves)} != {len(index.keys)} \
+                    or len(index.colors) != len(index.games):
+                raise ValueError(f"{path} has arrays of different lengths")
+        except LOAD_ERRORS:
+            return None
+        return index
+
+    def save(self, path):
+        """Saves to path (atomically, via a temporary file)."""
+        fnames = np.array([game[0] for game in self.games], dtype=str)
+        offsets, mtimes, fsizes = (np.array([game[i] for game in self.games], dtype=np.int64) for i in [1, 2, 3])
+        start_ids = np.array(list(self.start_fens), dtype=np.int64)
+        start_fens = np.array(list(self.start_fens.values()), dtype=str)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, keys=self.keys, game_ids=self.game_ids, plies=self.plies, turns=self.turns,
+                     moves=self.moves, colors=self.colors, fnames=fnames, offsets=offsets, mtimes=mtimes,
+                     fsizes=fsizes, start_ids=start_ids, start_fens=start_fens)
+        os.replace(tmp_path, path)
+
+    def update(self, library):
+        """Drops games no longer in the library and indexes the new ones, walking each new game's
+        mainline once (replayed from the library's MoveStore). Returns True if the index changed."""
+        store = library.move_store()
+        games = library_games(library.df)
+        current = set(games)
+        keep = np.array([game in current for game in self.games], dtype=bool)
+        changed = not keep.all()
+        if changed:
+            self.drop_games(keep)
+
+        indexed = set(self.games)
+        new_rows = [i for i, game in enumerate(games) if game not in indexed]
+        columns = [[], [], [], [], []]
+        colors = []
+        for i in new_rows:
+            row = library.df.iloc[i]
+            colors.append(1 if row.White == library.username else 0 if row.Black == library.username else -1)
+            if i in store.start_fens:
+                self.start_fens[len(self.games)] = store.start_fens[i]
+            walked = self.walk_moves(store.board(i), store.moves(i), len(self.games))
+            for column, values in zip(columns, walked):
+                column.append(values)
+            self.games.append(games[i])
+        if new_rows:
+            self.append(*[np.concatenate(column) for column in columns], np.array(colors, dtype=np.int8))
+        return changed or len(new_rows) > 0
+
+    @classmethod
+    def walk_game(cls, game, game_id):
+        """Arrays of (keys, game_ids, plies, turns, moves) for one python-chess game."""
+        return cls.walk_moves(game.board(), game.mainline_moves(), game_id)
+
+    @staticmethod
+    def walk_moves(board, game_moves, game_id):
+        """Arrays of (keys, game_ids, plies, turns, moves) for the moves played from board."""
+        keys, turns, moves = [], [], []
+        for move in game_moves:
+            keys.append(chess.polyglot.zobrist_hash(board))
+            turns.append(board.turn)
+            moves.append(encode_move(move))
+            board.push(move)
+        keys.append(chess.polyglot.zobrist_hash(board))
+        turns.append(board.turn)
+        moves.append(NO_MOVE)
+        n = len(keys)
+        return (np.array(keys, dtype=np.uint64), np.full(n, game_id, dtype=np.int32),
+                np.arange(n, dtype=np.uint16), np.array(turns, dtype=bool), np.array(moves, dtype=np.uint16))
+
+    def append(self, keys, game_ids, plies, turns, moves, colors):
+        self.keys = np.concatenate([self.keys, keys])
+        self.game_ids = np.concatenate([self.game_ids, game_ids])
+        self.plies = np.concatenate([self.plies, plies])
+        self.turns = np.concatenate([self.turns, turns])
+        self.moves = np.concatenate([self.moves, moves])
+        self.colors = np.concatenate([self.colors, colors])
+        self._sorted = None
+
+    def drop_games(self, keep):
+        """Removes the games where keep is False and renumbers the rest (rows stay in order)."""
+        rows = keep[self.game_ids]
+        new_ids = np.cumsum(keep, dtype=np.int32) - 1
+        self.keys, self.plies, self.turns, self.moves = (self.keys[rows], self.plies[rows],
+                                                         self.turns[rows], self.moves[rows])
+        self.game_ids = new_ids[self.game_ids[rows]]
+        self.games = [game for game, kept in zip(self.games, keep) if kept]
+        self.colors = self.colors[keep]
+        self.start_fens = {int(new_ids[game_id]): fen for game_id, fen in self.start_fens.items() if keep[game_id]}
+        self._sorted = None
+
+    # Queries
+    def sorted_keys(self):
+        if self._sorted is None:
+            order = np.argsort(self.keys, kind='stable')
+            self._sorted = (order, self.keys[order])
+        return self._sorted
+
+    def rows_for(self, position):
+        """Row numbers where the position (a FEN string or a chess.Board) was reached."""
+        board = chess.Board(position) if isinstance(position, str) else position
+        order, keys = self.sorted_keys()
+        key = np.uint64(chess.polyglot.zobrist_hash(board))
+        return order[np.searchsorted(keys, key, 'left'):np.searchsorted(keys, key, 'right')]
+
+    def games_reaching(self, position):
+        """(fname, offset) of every game that reached the position, by any move order."""
+        return [self.games[game_id][:2] for game_id in np.unique(self.game_ids[self.rows_for(position)])]
+
+    def moves_from(self, position):
+        """Moves played from the position, as [(san, count), ...] by frequency."""
+        board = chess.Board(position) if isinstance(position, str) else position
+        codes = self.moves[self.rows_for(board)]
+        counts = Counter(board.san(decode_move(code)) for code in codes[codes != NO_MOVE])
+        return counts.most_common()
+
+    def most_common(self, color=None, n=10, min_ply=0):
+        """Most common positions reached in games where the user played color ('white', 'black',
+        or None for all games), as [(fen, count), ...]."""
+        mask = self.plies >= min_ply
+        if color is not None:
+            mask &= self.colors[self.game_ids] == COLORS[color]
+        rows = np.flatnonzero(mask)
+        keys, first, counts = np.unique(self.keys[rows], return_index=True, return_counts=True)
+        top = np.argsort(-counts, kind='stable')[:n]
+        return [(self.fen_at(rows[first[i]]), int(counts[i])) for i in top]
+
+    def board(self, game_id):
+        """Starting position of a game."""
+        return chess.Board(self.start_fens.get(int(game_id), chess.STARTING_FEN))
+
+    def fen_at(self, row):
+        """Rebuilds the FEN of a row by replaying its game's moves from the index."""
+        game_id, ply = self.game_ids[row], int(self.plies[row])
+        start = np.searchsorted(self.game_ids, game_id, 'left')
+        board = self.board(game_id)
+        for code in self.moves[start:start + ply]:
+            board.push(decode_move(code))
+        return board.fen()
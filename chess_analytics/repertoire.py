@@ -0,0 +1,258 @@
+import os
+import numpy as np
+import pandas as pd
+import chess
+from .positions import NO_MOVE, LOAD_ERRORS, encode_move, decode_move, library_games
+
+""" Repertoire explorer: an opening tree (move trie) of the first max_ply moves of every game,
+built from MoveStore codes without parsing any game. Nodes are numbered depth by depth, and
+within a depth by (parent, move), so each node's children are a contiguous range of ids and
+every array below is flat:
+    parents, moves, depths    one entry per node (node 0 is the starting position)
+    counts                    (nodes, 3, 3) games by the user's color (white, black, other)
+                              and outcome for the user (win, loss, draw; white's for 'other')
+    game_nodes                (games, max_ply) node reached by each game after each ply (-1 past its end)
+The games through a node are held as CSR offsets into one int32 array (see node_games).
+Adding games merges their nodes level by level, and removing games compacts the ids, so
+neither replays the games already in the tree. """
+COLOR_INDEX = {'white': 0, 'black': 1, None: 2}
+OUTCOMES = ['win', 'loss', 'draw']
+
+
+class MoveTrie:
+    def __init__(self, max_ply=30):
+        self.max_ply = max_ply
+        self.parents = np.array([-1], dtype=np.int32)
+        self.moves = np.array([NO_MOVE], dtype=np.uint16)
+        self.depths = np.zeros(1, dtype=np.uint16)
+        self.counts = np.zeros((1, 3, 3), dtype=np.int32)
+        self.game_nodes = np.zeros((0, max_ply), dtype=np.int32)
+        self.colors = np.zeros(0, dtype=np.int8)
+        self.outcomes = np.zeros(0, dtype=np.int8)
+        self.games = []
+        self._csr = None
+
+    def __len__(self):
+        return len(self.parents)
+
+    @classmethod
+    def load(cls, path):
+        """The trie saved at path, or None if it's unreadable (e.g. cut short by a crash)."""
+        try:
+            with np.load(path) as data:
+                trie = cls(int(data['max_ply']))
+                for name in ['parents', 'moves', 'depths', 'counts', 'game_nodes', 'colors', 'outcomes']:
+                    setattr(trie, name, data[name])
+                trie.games = list(zip(data['fnames'].tolist(), data['offsets'].tolist(), data['mtimes'].tolist(),
+                                      data['fsizes'].tolist()))
+            n_nodes, n_games = len(trie.parents), len(trie.games)
+            if {len(trie.moves), len(trie.depths), len(trie.counts)} != {n_nodes} or len(trie.colors) != n_games \
+                    or len(trie.outcomes) != n_games or trie.game_nodes.shape != (n_games, trie.max_ply):
+                raise ValueError(f"{path} has arrays of different lengths")
+        except LOAD_ERRORS:
+            return None
+        return trie
+
+    def save(self, path):
+        """Saves to path (atomically, via a temporary file)."""
+        fnames = np.array([game[0] for game in self.games], dtype=str)
+        offsets, mtimes, fsizes = (np.array([game[i] for game in self.games], dtype=np.int64) for i in [1, 2, 3])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, max_ply=self.max_ply, parents=self.parents, moves=self.moves, depths=self.depths,
+                     counts=self.counts, game_nodes=self.game_nodes, colors=self.colors, outcomes=self.outcomes,
+                     fnames=fnames, offsets=offsets, mtimes=mtimes, fsizes=fsizes)
+        os.replace(tmp_path, path)
+
+    def update(self, library):
+        """Drops games no longer in the library and adds the new ones (from its MoveStore). Games
+        are (fname, offset, mtime, fsize), so a file rewritten in place is dropped and re-added.
+        Returns True if the trie changed."""
+        games = library_games(library.df)
+        current = set(games)
+        keep = np.array([game in current for game in self.games], dtype=bool)
+        changed = not keep.all()
+        if changed:
+            self.drop_games(keep)
+
+        indexed = set(self.games)
+        new_rows = [i for i, game in enumerate(games) if game not in indexed]
+        if new_rows:
+            store, df = library.move_store(), library.df.iloc[new_rows]
+            codes = np.zeros((len(new_rows), self.max_ply), dtype=np.uint16)
+            for j, i in enumerate(new_rows):
+                if i not in store.start_fens: # Only games from the standard start
+                    game_codes = store.game_codes(i)[:self.max_ply]
+                    codes[j, :len(game_codes)] = game_codes
+            colors = np.select([df.White == library.username, df.Black == library.username], [0, 1], 2)
+            result = df.Result.to_numpy(dtype=float)
+            user_result = np.where(colors == 1, 1 - result, result)
+            outcomes = np.select([user_result == 1, user_result == 0], [0, 1], 2)
+            self.add_games(codes, colors, outcomes)
+            self.games.extend(games[i] for i in new_rows)
+        return changed or len(new_rows) > 0
+
+    def add_games(self, codes, colors, outcomes):
+        """Merges games, given as (games, max_ply) move codes padded with NO_MOVE, into the trie."""
+        n_old = len(self)
+        level_offsets = self.level_offsets()
+        new_ids = np.zeros(n_old, dtype=np.int64) # Old node id -> merged node id
+        parents, moves = [np.array([-1])], [np.array([NO_MOVE])]
+        game_nodes = np.full(codes.shape, -1, dtype=np.int64)
+        game_parents = np.zeros(len(codes), dtype=np.int64) # Node of each new game at the previous depth
+        active = np.ones(len(codes), dtype=bool)
+        start = 1
+        for depth in range(self.max_ply):
+            old_nodes = np.arange(level_offsets[depth + 1], level_offsets[depth + 2])
+            old_keys = new_ids[self.parents[old_nodes]] * 65536 + self.moves[old_nodes]
+            active &= codes[:, depth] != NO_MOVE
+            new_keys = game_parents[active] * 65536 + codes[active, depth]
+            keys = np.union1d(old_keys, new_keys)
+            if len(keys) == 0:
+                break
+            new_ids[old_nodes] = start + np.searchsorted(keys, old_keys)
+            game_parents[active] = start + np.searchsorted(keys, new_keys)
+            game_nodes[active, depth] = game_parents[active]
+            parents.append(keys // 65536)
+            moves.append(keys % 65536)
+            start += len(keys)
+
+        self.parents = np.concatenate(parents).astype(np.int32)
+        self.moves = np.concatenate(moves).astype(np.uint16)
+        self.depths = np.repeat(np.arange(len(parents), dtype=np.uint16), [len(p) for p in parents])
+        counts = np.zeros((len(self.parents), 3, 3), dtype=np.int32)
+        counts[new_ids] = self.counts
+        valid = game_nodes >= 0
+        nodes = np.concatenate([np.zeros(len(codes), dtype=np.int64), game_nodes[valid]])
+        rows = np.concatenate([np.arange(len(codes)), np.nonzero(valid)[0]])
+        np.add.at(counts, (nodes, np.asarray(colors)[rows], np.asarray(outcomes)[rows]), 1)
+        self.counts = counts
+        remapped = np.where(self.game_nodes >= 0, new_ids[np.maximum(self.game_nodes, 0)], -1)
+        self.game_nodes = np.concatenate([remapped, game_nodes]).astype(np.int32)
+        self.colors = np.concatenate([self.colors, colors]).astype(np.int8)
+        self.outcomes = np.concatenate([self.outcomes, outcomes]).astype(np.int8)
+        self._csr = None
+
+    def drop_games(self, keep):
+        """Removes the games where keep is False, and the nodes no game reaches anymore."""
+        dropped = ~keep
+        valid = self.game_nodes[dropped] >= 0
+        rows = np.nonzero(dropped)[0]
+        nodes = np.concatenate([np.zeros(len(rows), dtype=np.int64), self.game_nodes[dropped][valid]])
+        game_rows = np.concatenate([rows, rows[np.nonzero(valid)[0]]])
+        np.subtract.at(self.counts, (nodes, self.colors[game_rows], self.outcomes[game_rows]), 1)
+        alive = self.counts.sum(axis=(1, 2)) > 0
+        alive[0] = True
+        new_ids = np.cumsum(alive) - 1
+        self.parents = np.where(self.parents[alive] >= 0, new_ids[np.maximum(self.parents[alive], 0)], -1).astype(np.int32)
+        self.moves, self.depths, self.counts = self.moves[alive], self.depths[alive], self.counts[alive]
+        game_nodes = self.game_nodes[keep]
+        self.game_nodes = np.where(game_nodes >= 0, new_ids[np.maximum(game_nodes, 0)], -1).astype(np.int32)
+        self.colors, self.outcomes = self.colors[keep], self.outcomes[keep]
+        self.games = [game for game, kept in zip(self.games, keep) if kept]
+        self._csr = None
+
+    def level_offsets(self):
+        """Node ids of depth d are level_offsets[d]:level_offsets[d + 1]."""
+        return np.searchsorted(self.depths, np.arange(self.max_ply + 2))
+
+    def node_games(self):
+        """(offsets, game_ids): the games through node n are game_ids[offsets[n]:offsets[n + 1]]
+        (the root, which every game goes through, is left empty)."""
+        if self._csr is None:
+            nodes = self.game_nodes.ravel()
+            valid = np.flatnonzero(nodes >= 0)
+            order = valid[np.argsort(nodes[valid], kind='stable')]
+            game_ids = (order // self.max_ply).astype(np.int32)
+            offsets = np.zeros(len(self) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(np.bincount(nodes[valid], minlength=len(self)))
+            self._csr = (offsets, game_ids)
+        return self._csr
+
+    # Queries
+    def children(self, node):
+        return np.arange(np.searchsorted(self.parents, node, 'left'), np.searchsorted(self.parents, node, 'right'))
+
+    def node_for(self, line):
+        """Node of a line, given as SAN moves ('e4 c5' or ['e4', 'c5']), or None if no game played it."""
+        board, node = chess.Board(), 0
+        for san in (line.split() if isinstance(line, str) else line):
+            code = encode_move(board.push_san(san))
+            children = self.children(node)
+            match = children[self.moves[children] == code]
+            if len(match) == 0:
+                return None
+            node = int(match[0])
+        return node
+
+    def line(self, node):
+        """SAN moves leading to node."""
+        codes = []
+        while node > 0:
+            codes.append(self.moves[node])
+            node = self.parents[node]
+        board, line = chess.Board(), []
+        for code in reversed(codes):
+            move = decode_move(code)
+            line.append(board.san(move))
+            board.push(move)
+        return line
+
+    def games_through(self, line):
+        """Ids (indices into games) of the games that played the line."""
+        node = self.node_for(line)
+        if node is None:
+            return np.zeros(0, dtype=np.int32)
+        if node == 0:
+            return np.arange(len(self.games), dtype=np.int32)
+        offsets, game_ids = self.node_games()
+        return game_ids[offsets[node]:offsets[node + 1]]
+
+    def table(self, nodes, color=None):
+        """Line, games, wins, losses, draws and win rate of nodes (for games where the user played color)."""
+        counts = self.counts[nodes]
+        counts = counts[:, COLOR_INDEX[color]] if color is not None else counts.sum(axis=1)
+        table = pd.DataFrame(counts, columns=OUTCOMES)
+        table.insert(0, 'games', counts.sum(axis=1))
+        table.insert(0, 'line', [" ".join(self.line(node)) for node in nodes])
+        table['winrate'] = table.win / table.games.where(table.games > 0)
+        return table
+
+    def continuations(self, line=(), n=5, color=None):
+        """The n most played moves after line, with their results."""
+        node = self.node_for(line)
+        if node is None:
+            return self.table([], color)
+        children = self.children(node)
+        table = self.table(children, color)
+        table.insert(1, 'move', [self.line(child)[-1] for child in children])
+        return table[table.games > 0].sort_values('games', ascending=False, kind='stable').head(n).reset_index(drop=True)
+
+    def common_lines(self, ply=12, n=10, color=None):
+        """The n most played lines of ply plies (or the games' full lines when they were shorter)."""
+        ends = self.game_nodes[:, min(ply, self.max_ply) - 1]
+        lengths = (self.game_nodes >= 0).sum(axis=1)
+        ends = np.where(ends >= 0, ends, self.game_nodes[np.arange(len(ends)), np.maximum(lengths - 1, 0)])
+        if color is not None:
+            ends = ends[self.colors == COLOR_INDEX[color]]
+        ends = ends[ends >= 0]
+        nodes, counts = np.unique(ends, return_counts=True)
+        top = nodes[np.argsort(-counts, kind='stable')[:n]]
+        return self.table(top, color)
+
+    def longest_shared_prefix(self, outcome=None, color=None, min_games=2):
+        """Deepest line played in at least min_games of the games with this outcome ('win', 'loss',
+        'draw') and user color, as (SAN moves, game ids)."""
+        selected = np.ones(len(self.games), dtype=bool)
+        if outcome is not None:
+            selected &= self.outcomes == OUTCOMES.index(outcome)
+        if color is not None:
+            selected &= self.colors == COLOR_INDEX[color]
+        nodes = self.game_nodes[selected].ravel()
+        counts = np.bincount(nodes[nodes >= 0], minlength=len(self))
+        candidates = np.flatnonzero(counts >= min_games)
+        if len(candidates) == 0:
+            return [], np.zeros(0, dtype=np.int32)
+        node = candidates[np.lexsort((-counts[candidates], -self.depths[candidates].astype(np.int64)))[0]]
+        game_ids = np.flatnonzero(selected & (self.game_nodes == node).any(axis=1)).astype(np.int32)
+        return self.line(node), game_ids
@@ -0,0 +1,91 @@
+import numpy as np
+from scipy import sparse
+
+""" Library-wide game similarity, with the same definitions as utils.jaccard_similarity and
+utils.overlap_similarity (on the sets of SAN moves of each game), but computed for all games
+at once. Each game is a row of a sparse binary (games x distinct moves) matrix, so the
+intersections of a block of games with every other game is one sparse product, and no
+dense n x n matrix is ever built: this exact path is the one that scales (memory is one
+block_size x n block at a time). There's no approximate (MinHash) mode: games share many moves,
+so typical similarities (~0.3) are too low for LSH banding to prune candidate pairs, and
+comparing every pair of signatures is slower than the exact sparse products. """
+
+
+def move_matrix(move_lists):
+    """Sparse binary matrix, where row i marks the distinct moves of game i."""
+    vocabulary = {}
+    indices, indptr = [], [0]
+    for moves in move_lists:
+        indices.extend(sorted({vocabulary.setdefault(move, len(vocabulary)) for move in moves}))
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.int32)
+    return sparse.csr_matrix((data, np.array(indices, dtype=np.int32), np.array(indptr)),
+                             shape=(len(indptr) - 1, len(vocabulary)))
+
+
+class GameSimilarity:
+    """All-pairs and top-k similarity for a list of move lists (e.g. GameReader.moves).
+    method is 'overlap' or 'jaccard', as in utils.compare_games."""
+    def __init__(self, move_lists, method='overlap'):
+        if method not in ('overlap', 'jaccard'):
+            raise Exception("Similarity method not available")
+        self.method = method
+        self.matrix = move_matrix(move_lists)
+        self.sizes = np.diff(self.matrix.indptr)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def block_similarities(self, start, stop):
+        """Dense (stop - start) x n float32 similarities of games start:stop to every game."""
+        intersection = (self.matrix[start:stop] @ self.matrix.T).toarray().astype(np.float32)
+        if self.method == 'jaccard':
+            sums = self.sizes[start:stop, None] + self.sizes[None, :]
+            return safe_divide(intersection, sums - intersection)
+        return safe_divide(intersection, np.minimum(self.sizes[start:stop, None], self.sizes[None, :]))
+
+    def iter_blocks(self, block_size=256):
+        for start in range(0, len(self), block_size):
+            stop = min(start + block_size, len(self))
+            yield start, stop, self.block_similarities(start, stop)
+
+    def top_k(self, k=5, block_size=256):
+        """For every game, its k most similar other games: returns (neighbours, similarities),
+        both of shape (n, k), sorted by decreasing similarity."""
+        k = min(k, len(self) - 1)
+        neighbours = np.zeros((len(self), k), dtype=np.int32)
+        similarities = np.zeros((len(self), k), dtype=np.float32)
+        for start, stop, block in self.iter_blocks(block_size):
+            rows = np.arange(stop - start)
+            block[rows, rows + start] = -1 # Exclude the game itself
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k] if k > 0 else np.zeros((stop - start, 0), int)
+            order = np.argsort(-block[rows[:, None], top], axis=1, kind='stable')
+            neighbours[start:stop] = np.take_along_axis(top, order, axis=1)
+            similarities[start:stop] = block[rows[:, None], neighbours[start:stop]]
+        return neighbours, similarities
+
+    def nearest(self, i, k=5):
+        """The k games most similar to game i, as (indices, similarities)."""
+        similarities = self.block_similarities(i, i + 1)[0]
+        similarities[i] = -1
+        neighbours = np.argsort(-similarities, kind='stable')[:k]
+        return neighbours, similarities[neighbours]
+
+    def similarity_matrix(self, threshold=0.5, block_size=256):
+        """Sparse (n x n) matrix of all pairs with similarity >= threshold (float32)."""
+        rows, cols, values = [], [], []
+        for start, _, block in self.iter_blocks(block_size):
+            block_rows, block_cols = np.nonzero(block >= threshold)
+            rows.append(block_rows + start)
+            cols.append(block_cols)
+            values.append(block[block_rows, block_cols])
+        if not rows:
+            return sparse.csr_matrix((len(self), len(self)), dtype=np.float32)
+        return sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                                 shape=(len(self), len(self)), dtype=np.float32)
+
+
+def safe_divide(numerator, denominator):
+    """numerator/denominator, with 0 where the denominator is 0 (games without moves)."""
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator, dtype=np.float32),
+                     where=denominator > 0).astype(np.float32)
@@ -0,0 +1,144 @@
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+""" Pipeline instrumentation: wall time, calls and items per stage (e.g. 'reader.parse_game',
+'engine.search'), plus plain counters (e.g. 'cache.hit'). Disabled by default, in which case
+stage() returns a shared no-op context manager and count() returns immediately, so
+instrumented code only pays for a function call. Enable it around a run:
+    stats = enable(progress=True)
+    library.find_mate_positions()
+    print(stats.report()); stats.dump("stats.json")
+Pool workers inherit the setting (and, when forked, the parent's stats so far, which they
+drop with reset()), and send their stats back with their results (see tactics.scan_game),
+which are added to the parent's with merge(). """
+
+
+class Stats:
+    """Stages are name -> [calls, items, seconds], counters are name -> count."""
+    def __init__(self, progress=False, interval=5.0):
+        self.stages, self.counters = {}, {}
+        self.progress, self.interval = progress, interval
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, items=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, 1, items, time.perf_counter() - start)
+
+    def add(self, name, calls, items, seconds):
+        stage = self.stages.setdefault(name, [0, 0, 0.0])
+        stage[0] += calls
+        stage[1] += items
+        stage[2] += seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        """Adds stats from another Stats or as_dict() (e.g. from a pool worker)."""
+        other = other.as_dict() if isinstance(other, Stats) else other
+        for name, stage in other['stages'].items():
+            self.add(name, stage['calls'], stage['items'], stage['seconds'])
+        for name, n in other['counters'].items():
+            self.count(name, n)
+
+    def reset(self):
+        self.stages, self.counters = {}, {}
+
+    def as_dict(self):
+        return {'wall_time': time.perf_counter() - self.start,
+                'stages': {name: {'calls': calls, 'items': items, 'seconds': seconds}
+                           for name, (calls, items, seconds) in self.stages.items()},
+                'counters': dict(self.counters)}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=4)
+
+    def report(self):
+        """Table of stages by total time, then counters."""
+        lines = [f"{'stage':<28} {'calls':>9} {'items':>9} {'seconds':>10} {'ms/item':>9}"]
+        for name, (calls, items, seconds) in sorted(self.stages.items(), key=lambda s: -s[1][2]):
+            lines.append(f"{name:<28} {calls:>9} {items:>9} {seconds:>10.3f} {1000 * seconds / max(items, 1):>9.3f}")
+        lines.extend(f"{name:<28} {n:>9}" for name, n in sorted(self.counters.items()))
+        return "\n".join(lines)
+
+
+class Progress:
+    """Prints done/total, rate and ETA at most every interval seconds."""
+    def __init__(self, name, total, interval, out=sys.stderr):
+        self.name, self.total, self.interval, self.out = name, total, interval, out
+        self.done = 0
+        self.start = self.last = time.perf_counter()
+
+    def update(self, n=1, **extra):
+        self.done += n
+        now = time.perf_counter()
+        if now - self.last >= self.interval or self.done == self.total:
+            self.last = now
+            rate = self.done / max(now - self.start, 1e-9)
+            eta = f", ETA {(self.total - self.done) / rate:.0f}s" if self.total and rate > 0 else ""
+            details = "".join(f", {key}={value}" for key, value in extra.items())
+            print(f"[{self.name}] {self.done}/{self.total or '?'} ({rate:.1f}/s{eta}{details})", file=self.out)
+
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def update(self, n=1, **extra):
+        pass
+
+
+NULL_STAGE = NullStage()
+_stats = None
+
+
+def enable(progress=False, interval=5.0):
+    """Starts recording (to a new Stats, which is returned), optionally with progress lines."""
+    global _stats
+    _stats = Stats(progress, interval)
+    return _stats
+
+def disable():
+    global _stats
+    _stats = None
+
+def get_stats():
+    """The active Stats, or None when disabled."""
+    return _stats
+
+def stage(name, items=1):
+    """Context manager timing one call of a stage, covering items items."""
+    return NULL_STAGE if _stats is None else _stats.stage(name, items)
+
+def count(name, n=1):
+    if _stats is not None:
+        _stats.count(name, n)
+
+def progress(name, total=None):
+    """Progress reporter with update(n, **extra), a no-op unless enabled with progress=True."""
+    if _stats is None or not _stats.progress:
+        return NULL_STAGE
+    return Progress(name, total, _stats.interval)
+
+def reset():
+    """Drops the stats recorded so far (e.g. those a forked pool worker inherited)."""
+    if _stats is not None:
+        _stats.reset()
+
+def collect():
+    """This process' stats since the last collect() (for pool workers), or None when disabled."""
+    if _stats is None:
+        return None
+    collected = _stats.as_dict()
+    _stats.reset()
+    return collected
@@ -0,0 +1,28 @@
+import chess
+
+""" Synthetic chess.com-style games (random legal moves), shared by the tests' sample library
+(tests/sample_games.py) and the benchmark corpora (scripts/benchmark.py), so both are built
+the same way. """
+
+
+def random_game(rng, n_plies):
+    """Random legal game of up to n_plies as chess.com movetext (with clock comments), and its
+    result if the board says the game is over (else None)."""
+    board = chess.Board()
+    tokens = []
+    for ply in range(n_plies):
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        move = rng.choice(legal_moves)
+        number = f"{board.fullmove_number}." if board.turn == chess.WHITE else f"{board.fullmove_number}..."
+        tokens.append(f"{number} {board.san(move)} {{[%clk 0:02:{59 - ply % 60:02d}]}}")
+        board.push(move)
+    result = board.result(claim_draw=False)
+    return " ".join(tokens), result if result != "*" else None
+
+
+def pgn_text(headers, movetext, result):
+    """PGN string of a game, from its (name, value) headers and movetext."""
+    header_text = "\n".join(f'[{name} "{value}"]' for name, value in headers)
+    return f"{header_text}\n\n{movetext} {result}\n"
@@ -1,36 +1,258 @@
 # Tactics
+import os
+import time
 import random
+from contextlib import closing
+from multiprocessing import Pool
+import numpy as np
 import chess
-from stockfish import Stockfish
-import chess.engine
+from .eval_cache import default_cache
+from .positions import decode_move
+from . import stats
 
-def find_forced_mate(game, stockfish_engine, mate_in=2, extra_description=""):
+STOCKFISH_PATH = "/usr/games/stockfish"
+STOCKFISH_DEPTH = 15 # The stockfish package's default search depth
+# The engine packages (stockfish, chess.engine) are imported when an engine is started, so
+# importing the library doesn't pay for them
+
+# One engine per pool worker, created by init_engine() (or init_uci_engine() for MateSearch), with
+# its search depth and the worker's EvalCache (sent once, so its LRU is kept across games)
+_engine, _depth, _cache = None, None, None
+# Error of a pool worker's initializer, raised from its tasks (see init_pool_worker)
+_init_error = None
+
+
+def get_top_moves(stockfish_engine, board, cache, depth=STOCKFISH_DEPTH):
+    """stockfish_engine.get_top_moves() for the board, looked up in the cache first (depth is
+    the engine's search depth, part of the cache key)."""
+    def search():
+        with stats.stage('engine.search'):
+            stockfish_engine.set_fen_position(board.fen())
+            return stockfish_engine.get_top_moves()
+    return cache.get_or_compute(board, depth, 5, "stockfish:get_top_moves", search)
+
+def find_forced_mate(game, stockfish_engine, mate_in=2, extra_description="", cache=None, depth=STOCKFISH_DEPTH):
     """Given a GameReader object, return (fen_position, description, link) of the first
-    forced mate in the game."""
-    for j in range(len(game.moves)):
-    # Find first Mate in 2 and break
-        board = game.play_nth_move(j)
-        stockfish_engine.set_fen_position(board.fen())
-        proposed_moves = stockfish_engine.get_top_moves()
-        if proposed_moves[0]['Mate'] == mate_in:
-            describer = game.describe()
-            description = f"{describer[0]} vs. {describer[1]} ({describer[2]}) {extra_description}"
-            return (board.fen(), description, describer[9])
-    return (None, None, None)
-
-def find_forced_mate_positions(library, mate_in = 2, limit=100):
-    """Finds up to limit forced mates and returns the FEN position + description."""
-    stockfish_engine = Stockfish("/usr/games/stockfish")
+    forced mate in the game. The board is advanced one move at a time (no replays), and
+    positions already analysed (e.g. common openings) come from the EvalCache."""
+    fen = first_forced_mate(game.game.board(), game.game.mainline_moves(), stockfish_engine, mate_in, cache, depth)
+    if fen is None:
+        return (None, None, None)
+    describer = game.describe()
+    description = f"{describer[0]} vs. {describer[1]} ({describer[2]}) {extra_description}"
+    return (fen, description, describer[9])
+
+def first_forced_mate(board, moves, stockfish_engine, mate_in=2, cache=None, depth=STOCKFISH_DEPTH):
+    """FEN of the first position, playing moves from board, where the engine (searching to
+    depth) finds a forced mate in mate_in (or None)."""
+    cache = cache if cache is not None else default_cache()
+    n_positions = 0
+    try:
+        for move in moves:
+        # Find first Mate in 2 and break
+            n_positions += 1
+            proposed_moves = get_top_moves(stockfish_engine, board, cache, depth)
+            if proposed_moves[0]['Mate'] == mate_in:
+                return board.fen()
+            board.push(move)
+        return None
+    finally:
+        stats.count('tactics.positions', n_positions)
+
+def init_pool_worker(initializer, *initargs):
+    """Pool initializer: drops the stats the worker inherited from the parent, so they aren't sent
+    back, then runs initializer. Its error is kept and raised from the worker's first task (see
+    check_worker): a pool whose initializer raises starts new workers forever."""
+    global _init_error
+    stats.reset()
+    try:
+        initializer(*initargs)
+    except Exception as e:
+        _init_error = e
+
+def check_worker():
+    """Raises the error of this worker's initializer, if it failed."""
+    if _init_error is not None:
+        raise _init_error
+
+def init_engine(stockfish_path, depth=None, cache=None):
+    """Start this process' Stockfish (at STOCKFISH_DEPTH if depth is None), using cache."""
+    global _engine, _depth, _cache
+    from stockfish import Stockfish
+    _depth = depth if depth is not None else STOCKFISH_DEPTH
+    _engine = Stockfish(stockfish_path, depth=_depth)
+    _cache = cache if cache is not None else default_cache()
+
+def quit_stockfish(engine):
+    """Stops a stockfish package engine's process (older versions of the package only quit in __del__)."""
+    if hasattr(engine, 'send_quit_command'):
+        engine.send_quit_command()
+    else:
+        engine.__del__()
+
+def scan_game(task):
+    """Pool worker: first_forced_mate with this worker's engine, for a game sent as its
+    starting FEN (None = standard) and move codes (see MoveStore), with its description and link.
+    Returns the (fen, description, link) tuple and the worker's stats for it (see stats.collect)."""
+    start_fen, codes, mate_in, description, link = task
+    check_worker()
+    with stats.stage('tactics.scan_game'):
+        board = chess.Board(start_fen or chess.STARTING_FEN)
+        fen = first_forced_mate(board, (decode_move(code) for code in codes), _engine, mate_in, _cache, _depth)
+    result = (fen, description, link) if fen is not None else (None, None, None)
+    return result, stats.collect()
+
+# Staged search
+class MateSearch:
+    """Settings of the staged forced-mate search (see find_mate_staged). Positions first go
+    through static screens: the first min_ply plies are skipped, and so are positions where the
+    side to move can't mate (game over, insufficient material, no check available for a mate in
+    1) or attacks fewer than min_king_pressure squares around the enemy king. The rest get a
+    shallow probe, and only those where the probe sees a mate get the full confirmation search.
+    Both searches are limited by depth, nodes and/or time (seconds), as in chess.engine.Limit,
+    and budget caps the engine time spent per game (None = no cap)."""
+    def __init__(self, min_ply = 6, min_king_pressure = 1, probe_depth = 6, probe_nodes = None, probe_time = None,
+                 confirm_depth = 18, confirm_nodes = None, confirm_time = None, budget = None):
+        import chess.engine
+        self.min_ply, self.min_king_pressure = min_ply, min_king_pressure
+        self.probe_limit = chess.engine.Limit(depth=probe_depth, nodes=probe_nodes, time=probe_time)
+        self.confirm_limit = chess.engine.Limit(depth=confirm_depth, nodes=confirm_nodes, time=confirm_time)
+        self.budget = budget
+
+def mate_lengths(mate_in):
+    """mate_in as a set of lengths: an int, or e.g. range(1, 4) for mates in 1 to 3."""
+    return {mate_in} if isinstance(mate_in, int) else set(mate_in)
+
+def king_pressure(board):
+    """Squares around (and including) the opponent's king attacked by the side to move."""
+    king = board.king(not board.turn)
+    if king is None:
+        return 0
+    zone = chess.SquareSet(board.attacks_mask(king) | chess.BB_SQUARES[king])
+    return sum(1 for square in zone if board.is_attacked_by(board.turn, square))
+
+def static_screen(board, ply, lengths, search):
+    """Cheap checks that rule out a forced mate (in one of lengths) before any engine call."""
+    if ply < search.min_ply or board.has_insufficient_material(board.turn) or board.is_game_over():
+        return False
+    if max(lengths) == 1:
+        return any(board.gives_check(move) for move in board.legal_moves)
+    return king_pressure(board) >= search.min_king_pressure
+
+def engine_mate(engine, board, limit, stage, cache):
+    """Mate length found by a chess.engine search within limit, for the side to move (negative
+    when being mated, None without a mate), looked up in the cache first."""
+    def search():
+        with stats.stage(f'engine.{stage}'):
+            info = engine.analyse(board, limit)
+        return (info['score'].pov(board.turn).mate(),)
+    engine_id = f"uci:mate:nodes={limit.nodes}:time={limit.time}"
+    return cache.get_or_compute(board, limit.depth, 1, engine_id, search)[0]
+
+def find_mate_staged(board, moves, engine, mate_in=2, search=None, cache=None):
+    """(fen, mate length) of the first position, playing moves from board, with a forced mate
+    in mate_in (an int, or a range of lengths) confirmed by the staged search, or None."""
+    search = search if search is not None else MateSearch()
+    cache = cache if cache is not None else default_cache()
+    lengths = mate_lengths(mate_in)
+    start = time.perf_counter()
+    for ply, move in enumerate(moves):
+        if search.budget is not None and time.perf_counter() - start > search.budget:
+            stats.count('tactics.over_budget')
+            return None
+        if static_screen(board, ply, lengths, search):
+            stats.count('tactics.screened_in')
+            probe = engine_mate(engine, board, search.probe_limit, 'probe', cache)
+            if probe is not None and probe > 0:
+                stats.count('tactics.candidates')
+                mate = engine_mate(engine, board, search.confirm_limit, 'confirm', cache)
+                if mate in lengths:
+                    return board.fen(), mate
+        board.push(move)
+    return None
+
+def init_uci_engine(stockfish_path, cache=None):
+    """Like init_engine, for the staged search: start this process' chess.engine process."""
+    global _engine, _cache
+    import chess.engine
+    _engine = chess.engine.SimpleEngine.popen_uci(stockfish_path)
+    _cache = cache if cache is not None else default_cache()
+
+def scan_game_staged(task):
+    """Pool worker: like scan_game, with find_mate_staged (the mate length is added to the description)."""
+    start_fen, codes, mate_in, description, link, search = task
+    check_worker()
+    with stats.stage('tactics.scan_game'):
+        board = chess.Board(start_fen or chess.STARTING_FEN)
+        found = find_mate_staged(board, (decode_move(code) for code in codes), _engine, mate_in, search, _cache)
+    result = (found[0], f"{description} (mate in {found[1]})", link) if found is not None else (None, None, None)
+    return result, stats.collect()
+
+def find_forced_mate_positions(library, mate_in = 2, limit=100, n_workers=None, stockfish_path=STOCKFISH_PATH,
+                               cache=None, depth=None, search=None):
+    """Finds up to limit forced mates and returns the FEN position + description. Games are
+    scanned by a pool of n_workers engine processes (None = one per core); results keep the
+    library's order, so the output is the same as a serial scan. Games are replayed from the
+    library's MoveStore, so only their move codes are sent to the workers. depth fixes the
+    engines' search depth (None = STOCKFISH_DEPTH, the stockfish package default).
+    With a MateSearch, games go through the staged search instead (with chess.engine, and
+    mate_in can be a range, e.g. range(1, 4))."""
     forced_mate_boards = []
-    for i, game in enumerate(library.df.Game.values):
-        # For everygame...
-        if len(forced_mate_boards) == limit:
-            break
-        forced_mate_tuple = find_forced_mate(game, stockfish_engine, extra_description=f"[{library.df.iloc[i]['opening_chesscom_general']}]")
-        if forced_mate_tuple[0] is not None:
-            forced_mate_boards.append(forced_mate_tuple)
+    if limit <= 0:
+        return forced_mate_boards
+    with closing(iter_forced_mates(library, mate_in, n_workers, stockfish_path, cache, depth, search)) as results:
+        for _, forced_mate_tuple in results:
+            # For everygame...
+            if forced_mate_tuple[0] is not None:
+                forced_mate_boards.append(forced_mate_tuple)
+            if len(forced_mate_boards) >= limit:
+                break
     return forced_mate_boards
 
+def iter_forced_mates(library, mate_in = 2, n_workers=None, stockfish_path=STOCKFISH_PATH, cache=None, depth=None,
+                      search=None, skip=()):
+    """Scans the library's games, except the rows in skip, and yields (row, (fen, description, link))
+    for each game as soon as it's scanned, in library order ((None, None, None) when there's no
+    mate), e.g. to checkpoint a long scan. Closing the generator stops the engines."""
+    n_workers = n_workers if n_workers is not None else os.cpu_count()
+    cache = cache if cache is not None else default_cache()
+    store = library.move_store()
+    skip = set(skip)
+    rows = [i for i in range(len(library)) if i not in skip]
+    df = library.df
+    tasks = ((store.start_fens.get(i), np.array(store.game_codes(i)), mate_in,
+              f"{df.White.iloc[i]} vs. {df.Black.iloc[i]} ({df.Result.iloc[i]}) [{df.opening_chesscom_general.iloc[i]}]",
+              df.id.iloc[i]) for i in rows)
+    if search is None:
+        initializer, initargs, worker = init_engine, (stockfish_path, depth, cache), scan_game
+    else:
+        initializer, initargs, worker = init_uci_engine, (stockfish_path, cache), scan_game_staged
+        tasks = (task + (search,) for task in tasks)
+    pool = None
+    if n_workers > 1:
+        pool = Pool(n_workers, initializer=init_pool_worker, initargs=(initializer,) + initargs)
+        results = pool.imap(worker, tasks)
+    else:
+        initializer(*initargs)
+        results = map(worker, tasks)
+
+    n_mates = 0
+    progress = stats.progress('tactics', len(rows))
+    try:
+        for row, (forced_mate_tuple, worker_stats) in zip(rows, results):
+            if worker_stats is not None:
+                stats.get_stats().merge(worker_stats)
+            n_mates += forced_mate_tuple[0] is not None
+            progress.update(mates=n_mates)
+            yield row, forced_mate_tuple
+    finally:
+        if pool is not None:
+            pool.terminate()
+        elif search is not None:
+            _engine.quit()
+        else:
+            quit_stockfish(_engine)
+
 def render_tactic(tactic_data):
     """Renders a board with tactic and prints extra information."""
     print(tactic_data[1])
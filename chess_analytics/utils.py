@@ -22,37 +22,111 @@ def compare_games(game_1, game_2, method='overlap'):
 
 
 # Position evaluation functions:
-from stockfish import Stockfish
-import chess.engine
-def evaluate_position(fen_board, stockfish_path = '/usr/games/stockfish'):
-    """Evaluate a position with chess.engine with a path to stockfish (or another engine),
-    position must be in Forsyth–Edwards Notation."""
+import atexit
+from functools import lru_cache
+import chess
+from .eval_cache import default_cache
+
+@lru_cache(maxsize=None)
+def get_uci_engine(stockfish_path):
+    """One chess.engine process per path, kept alive between evaluations and quit at exit."""
+    import chess.engine
     engine = chess.engine.SimpleEngine.popen_uci(stockfish_path)
+    atexit.register(engine.quit)
+    return engine
+
+@lru_cache(maxsize=None)
+def get_stockfish(threads, depth):
+    from stockfish import Stockfish
+    return Stockfish(parameters={"Threads": threads}, depth=depth)
+
+def evaluate_position(fen_board, stockfish_path = '/usr/games/stockfish', depth=20, cache=None):
+    """Evaluate a position with chess.engine with a path to stockfish (or another engine),
+    position must be in Forsyth–Edwards Notation. Results are cached (see EvalCache)."""
+    cache = cache if cache is not None else default_cache()
+    import chess.engine
     board = chess.Board(fen_board)
-    return engine.analyse(board, chess.engine.Limit(depth=20))
+    return cache.get_or_compute(board, depth, 1, f"uci:{stockfish_path}:analyse",
+                                lambda: get_uci_engine(stockfish_path).analyse(board, chess.engine.Limit(depth=depth)))
 
-def evaluate_position_sf(fen_board, threads=2, depth=2):
+def evaluate_position_sf(fen_board, threads=2, depth=2, cache=None):
     """Evaluate a position using stockfish, position must be in Forsyth–Edwards Notation.
+    Results are cached (see EvalCache).
     TODO - Pass arbitrary params, the default depth seems OOL with evaluate_position()"""
-    stockfish_engine = Stockfish(parameters={"Threads": threads})
-    stockfish_engine.set_fen_position(fen_board)
-    return stockfish_engine.get_evaluation()
+    cache = cache if cache is not None else default_cache()
+
+    def get_evaluation():
+        stockfish_engine = get_stockfish(threads, depth)
+        stockfish_engine.set_fen_position(fen_board)
+        return stockfish_engine.get_evaluation()
+    return cache.get_or_compute(chess.Board(fen_board), depth, 1, "stockfish:get_evaluation", get_evaluation)
 
 
 # Image work  
-def position_to_image(fen_position, output_name, filetype="png"):
-    """Given a FEN position, save it as an SVG or PNG image to fname."""
+BOARD_CACHE_DIR = "data/output/.board_cache"
+
+def position_to_svg(fen_position, orientation=True, size=None):
+    """SVG of the board, with white (orientation=True) or black at the bottom."""
     import chess.svg
+    return chess.svg.board(board=chess.Board(fen_position), orientation=orientation, size=size)
+
+def position_to_png(fen_position, orientation=True, size=None, cache_dir=BOARD_CACHE_DIR):
+    """PNG bytes of the board, converted from SVG in memory. PNGs are cached in cache_dir
+    (None for no cache) by (FEN, orientation, size), so a board is only rendered once."""
+    cache_path = board_cache_path(fen_position, orientation, size, cache_dir)
+    if cache_path is not None:
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                return f.read()
     import cairosvg
-    fname_svg = output_name + ".svg"
-    boardsvg = chess.svg.board(board=chess.Board(fen_position))
-    with open(fname_svg, "w") as f:
-        f.write(boardsvg)
-    
+    png = cairosvg.svg2png(bytestring=position_to_svg(fen_position, orientation, size).encode())
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(png)
+        os.replace(tmp_path, cache_path)
+    return png
+
+def board_cache_path(fen_position, orientation=True, size=None, cache_dir=BOARD_CACHE_DIR):
+    if cache_dir is None:
+        return None
+    import hashlib
+    key = hashlib.sha1(f"{fen_position}|{bool(orientation)}|{size}".encode()).hexdigest()
+    return os.path.join(cache_dir, key + ".png")
+
+def render_png_task(task):
+    """Pool worker for positions_to_images."""
+    return position_to_png(*task)
+
+def position_to_image(fen_position, output_name, filetype="png", orientation=True, size=None,
+                      cache_dir=BOARD_CACHE_DIR):
+    """Given a FEN position, save it as an SVG or PNG image to fname."""
     if filetype == "png":
-        cairosvg.svg2png(url=fname_svg, write_to=output_name + ".png")
-        os.remove(fname_svg)
-    
+        with open(output_name + ".png", 'wb') as f:
+            f.write(position_to_png(fen_position, orientation, size, cache_dir))
+    else:
+        with open(output_name + ".svg", "w") as f:
+            f.write(position_to_svg(fen_position, orientation, size))
+
+def positions_to_images(fen_positions, output_names, orientation=True, size=None, n_workers=None,
+                        cache_dir=BOARD_CACHE_DIR):
+    """Saves each FEN position as output_name.png. Distinct boards are rendered once, by a
+    process pool of n_workers (None = one per core, 1 = in this process), and boards
+    already in the cache aren't rendered at all."""
+    from multiprocessing import Pool
+    tasks = list(dict.fromkeys((fen, orientation, size, cache_dir) for fen in fen_positions))
+    cached = [task for task in tasks if cache_dir is not None and os.path.exists(board_cache_path(*task))]
+    pngs = {task: render_png_task(task) for task in cached}
+    missing = [task for task in tasks if task not in pngs]
+    if (n_workers is None or n_workers > 1) and len(missing) > 1:
+        with Pool(n_workers) as pool:
+            pngs.update(zip(missing, pool.map(render_png_task, missing)))
+    else:
+        pngs.update((task, render_png_task(task)) for task in missing)
+    for fen, output_name in zip(fen_positions, output_names):
+        with open(output_name + ".png", 'wb') as f:
+            f.write(pngs[(fen, orientation, size, cache_dir)])
 
 # TODO - Render a board in iPython (create figure)
 
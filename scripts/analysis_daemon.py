@@ -0,0 +1,323 @@
+import sys
+import json
+import asyncio
+import argparse
+import traceback
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import chess
+sys.path.append(".")
+from chess_analytics.game_library import GameLibrary
+from chess_analytics.tactics import STOCKFISH_PATH
+from chess_analytics.eval_cache import default_cache
+from chess_analytics.cube import DIMENSIONS
+
+""" Analysis daemon: loads a GameLibrary once, keeps its indexes (move store, positions,
+cube, repertoire) and a pool of engine processes warm, and answers JSON queries over local
+HTTP (or a UNIX socket), e.g.
+    python scripts/analysis_daemon.py -input data/games/Luc777 -port 8765
+    curl "localhost:8765/winrates"
+    curl "localhost:8765/eval?fen=r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R%20w%20KQkq%20-%202%203&depth=20"
+Requests are handled by asyncio: engine searches run concurrently (one per engine), and
+library queries run one at a time in a worker thread, so neither blocks the event loop.
+The library directory is polled, and the library reloaded when games are added or changed
+(only those are parsed, and the indexes are updated incrementally, see GameLibrary.refresh). """
+HOST, PORT = "127.0.0.1", 8765
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+REQUIRED = object()
+WINRATE_DIMENSIONS = [dimension for dimension in DIMENSIONS if dimension not in ('month', 'outcome')]
+
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def param(params, name, type=str, default=REQUIRED):
+    """Query parameter name, converted with type (400 if missing or invalid)."""
+    if name not in params:
+        if default is REQUIRED:
+            raise QueryError(400, f"missing parameter '{name}'")
+        return default
+    try:
+        return type(params[name])
+    except ValueError:
+        raise QueryError(400, f"invalid parameter '{name}': {params[name]}")
+
+def color_param(params, default=None):
+    """The color parameter, 'white' or 'black' (400 otherwise)."""
+    color = param(params, 'color', default=default)
+    if color is default:
+        return color
+    if color.lower() not in ('white', 'black'):
+        raise QueryError(400, f"color must be white or black, not {color}")
+    return color.lower()
+
+def to_json(value):
+    """json.dumps default for numpy, pandas and chess values."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, pd.DataFrame):
+        return value.to_dict('records')
+    if isinstance(value, (Path, chess.Move)):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def score_to_dict(score):
+    """A chess.engine.PovScore from white's point of view, as {'cp': ..., 'mate': ...}."""
+    score = score.white()
+    return {'cp': score.score(), 'mate': score.mate()}
+
+
+class EnginePool:
+    """size UCI engine processes (chess.engine's asyncio API), each searching for one query at a time."""
+    def __init__(self, path=STOCKFISH_PATH, size=2):
+        self.path, self.size = path, size
+        self.engines = []
+        self.idle = asyncio.Queue()
+
+    async def start(self):
+        import chess.engine
+        for _ in range(self.size):
+            _, engine = await chess.engine.popen_uci(self.path)
+            self.engines.append(engine)
+            self.idle.put_nowait(engine)
+
+    async def analyse(self, board, limit):
+        engine = await self.idle.get()
+        try:
+            return await engine.analyse(board, limit)
+        finally:
+            self.idle.put_nowait(engine)
+
+    async def close(self):
+        for engine in self.engines:
+            await engine.quit()
+        self.engines = []
+
+
+class AnalysisDaemon:
+    """Serves queries on a library. engines is an EnginePool (None: no evaluations), and the
+    library's directory is checked for new games every watch_interval seconds (None: never)."""
+    def __init__(self, library, engines=None, cache=None, watch_interval=10.0):
+        self.library = library
+        self.engines = engines
+        self.cache = cache if cache is not None else default_cache()
+        self.watch_interval = watch_interval
+        self.executor = ThreadPoolExecutor(1) # Library queries, one at a time
+        self.cache_executor = ThreadPoolExecutor(1) # Eval cache lookups (its SQLite connection stays in one thread)
+        self.snapshot = self.directory_snapshot()
+        self.reloads = 0
+        self.watcher = None
+        self.routes = {'/status': self.status, '/winrates': self.winrates, '/openings': self.openings,
+                       '/position': self.position, '/similar': self.similar, '/repertoire': self.repertoire}
+
+    # Library
+    def warm_up(self):
+        """Builds (or loads and updates) the indexes queries use, before the first query."""
+        self.library.move_store()
+        self.library.position_index()
+        self.library.cube()
+        self.library.repertoire()
+        self.library.game_similarity()
+
+    def directory_snapshot(self):
+        """(fname, mtime, size) of every game file, to tell when the library changed."""
+        snapshot = set()
+        for fname in [*self.library.library_files("*.[tT][xX][tT]"), *self.library.library_files("*.[pP][gG][nN]")]:
+            try:
+                stat = fname.stat()
+            except FileNotFoundError: # Removed since it was listed
+                continue
+            snapshot.add((str(fname), stat.st_mtime_ns, stat.st_size))
+        return frozenset(snapshot)
+
+    def refresh(self):
+        self.library.refresh()
+        self.warm_up()
+        self.reloads += 1
+
+    async def in_library_thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def reload(self):
+        """Refreshes the library if its files changed since the last load. Returns True if it did."""
+        snapshot = await self.in_library_thread(self.directory_snapshot)
+        if snapshot == self.snapshot:
+            return False
+        await self.in_library_thread(self.refresh)
+        self.snapshot = snapshot
+        print(f"Reloaded library ({len(self.library)} games)")
+        return True
+
+    async def watch(self):
+        """Reloads the library when it changes. A failed reload is printed and retried on the next
+        check (the library keeps serving the games it had)."""
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                await self.reload()
+            except Exception:
+                print("Reloading the library failed:", file=sys.stderr)
+                traceback.print_exc()
+
+    # Queries (params are the query string's parameters)
+    def status(self, params):
+        return {'games': len(self.library), 'username': self.library.username, 'reloads': self.reloads,
+                'engines': len(self.engines.engines) if self.engines is not None else 0}
+
+    def winrates(self, params):
+        """Winrates by color, or per month and by a cube dimension (e.g. by=color or by=time_class,
+        one row per month, with a winrate for each of the dimension's values, null without games),
+        or per month overall (by=month)."""
+        by = param(params, 'by', default=None)
+        if by is None:
+            white, black = self.library.winrates()
+            return {'white': white, 'black': black}
+        if by != 'month' and by not in WINRATE_DIMENSIONS:
+            raise QueryError(400, f"by must be month or one of {', '.join(WINRATE_DIMENSIONS)}, not {by}")
+        rates = self.library.cube().monthly_winrates(None if by == 'month' else by,
+                                                     color=color_param(params, default=['white', 'black']))
+        rates.columns = rates.columns.astype(str)
+        rates = rates.reset_index()
+        return rates.astype(object).where(rates.notna(), None)
+
+    def openings(self, params):
+        """Wins, losses and draws by mainline opening for color ('White' or 'Black'), top n."""
+        color = param(params, 'color', default='White').capitalize()
+        if color not in ('White', 'Black'):
+            raise QueryError(400, f"color must be 'White' or 'Black', not {color}")
+        results = self.library.results_by_openings(color)
+        return [{'opening': opening, 'win': win, 'loss': loss, 'draw': draw}
+                for opening, (win, loss, draw) in list(results.items())[:param(params, 'n', int, 10)]]
+
+    def position(self, params):
+        """Games that reached a FEN, and the moves played from it."""
+        fen = param(params, 'fen')
+        games = self.library.games_reaching(fen)
+        return {'games': len(games), 'links': list(games.id[:param(params, 'n', int, 20)]),
+                'moves': self.library.moves_from(fen)}
+
+    def similar(self, params):
+        """The k games most similar to game n (its row in the library)."""
+        n, k = param(params, 'game', int), param(params, 'k', int, 5)
+        if not 0 <= n < len(self.library):
+            raise QueryError(404, f"no game {n} (the library has {len(self.library)} games)")
+        similar = self.library.similar_games(n, k)
+        return [{'game': int(row), 'link': link, 'similarity': similarity}
+                for row, link, similarity in zip(similar.index, similar.id, similar.similarity)]
+
+    def repertoire(self, params):
+        """Most played continuations after a line (SAN moves, e.g. 'e4 c5'), with win rates."""
+        return self.library.repertoire().continuations(param(params, 'line', default=""), param(params, 'n', int, 5),
+                                                       color_param(params))
+
+    async def evaluate(self, params):
+        """Engine evaluation of a FEN at depth, shared with utils.evaluate_position's cache."""
+        import chess.engine
+        if self.engines is None or not self.engines.engines:
+            raise QueryError(503, "no engines running")
+        board, depth = chess.Board(param(params, 'fen')), param(params, 'depth', int, 20)
+        key = self.cache.make_key(board, depth, 1, f"uci:{self.engines.path}:analyse")
+        loop = asyncio.get_running_loop()
+        info = await loop.run_in_executor(self.cache_executor, self.cache.get, key)
+        if info is None:
+            info = await self.engines.analyse(board, chess.engine.Limit(depth=depth))
+            await loop.run_in_executor(self.cache_executor, self.cache.put, key, info)
+        return {'fen': board.fen(), 'depth': info.get('depth', depth), 'score': score_to_dict(info['score']),
+                'pv': board.variation_san(info.get('pv', [])[:10])}
+
+    # HTTP
+    async def respond(self, request_line):
+        """(status, JSON-able body) for a request line, e.g. 'GET /winrates HTTP/1.1'."""
+        parts = request_line.split()
+        if len(parts) < 2:
+            return 400, {'error': "malformed request"}
+        if parts[0] != 'GET':
+            return 405, {'error': "only GET is supported"}
+        url = urlsplit(parts[1])
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/eval':
+                return 200, await self.evaluate(params)
+            if url.path not in self.routes:
+                return 404, {'error': f"unknown query {url.path}", 'queries': sorted([*self.routes, '/eval'])}
+            return 200, await self.in_library_thread(self.routes[url.path], params)
+        except QueryError as error:
+            return error.status, {'error': str(error)}
+        except ValueError as error: # e.g. an invalid FEN or SAN move
+            return 400, {'error': str(error)}
+        except Exception as error: # A bug: the client still gets a reply, and the daemon keeps serving
+            traceback.print_exc()
+            return 500, {'error': f"{type(error).__name__}: {error}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""): # Headers aren't used
+                pass
+            status, body = await self.respond(request_line)
+            payload = json.dumps(body, default=to_json).encode()
+            writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host=HOST, port=PORT, socket_path=None):
+        """Starts the engines, the directory watcher and the server (on a UNIX socket if socket_path)."""
+        if self.engines is not None:
+            await self.engines.start()
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        self.watcher = asyncio.create_task(self.watch()) if self.watch_interval else None
+        return server
+
+    async def close(self):
+        if self.watcher is not None:
+            self.watcher.cancel()
+        if self.engines is not None:
+            await self.engines.close()
+        self.executor.shutdown()
+        self.cache_executor.shutdown()
+
+    async def serve(self, host=HOST, port=PORT, socket_path=None):
+        server = await self.start(host, port, socket_path)
+        print(f"Serving {self.library.username}'s library on {socket_path or f'http://{host}:{port}'}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-input', type=str)
+    parser.add_argument('-host', type=str, default=HOST)
+    parser.add_argument('-port', type=int, default=PORT)
+    parser.add_argument('-socket', type=str, default=None, help="serve on this UNIX socket instead of HTTP over TCP")
+    parser.add_argument('-limit', type=int, default=2000)
+    parser.add_argument('-workers', type=int, default=1)
+    parser.add_argument('-engines', type=int, default=2, help="engine processes (0 for no evaluations)")
+    parser.add_argument('-stockfish', type=str, default=STOCKFISH_PATH)
+    parser.add_argument('-watch', type=float, default=10.0, help="seconds between checks for new games (0 = never)")
+    args = parser.parse_args()
+    library = GameLibrary(args.input, limit=args.limit, n_workers=args.workers)
+    engines = EnginePool(args.stockfish, args.engines) if args.engines > 0 else None
+    daemon = AnalysisDaemon(library, engines, watch_interval=args.watch or None)
+    daemon.warm_up()
+    try:
+        asyncio.run(daemon.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+if __name__=="__main__":
+    main()
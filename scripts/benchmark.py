@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+from pathlib import Path
+import chess
+sys.path.append(".")
+from chess_analytics.game_library import GameLibrary
+from chess_analytics.game_reader import GameReader
+from chess_analytics.tactics import find_forced_mate_positions, STOCKFISH_PATH
+from chess_analytics.eval_cache import EvalCache
+from chess_analytics.utils import compare_games
+from chess_analytics.synthetic import random_game, pgn_text
+
+""" Benchmarks: times the library's hot paths on reproducible synthetic chess.com-style
+libraries (random legal games, see chess_analytics.synthetic), and writes the timings as JSON, e.g.
+    python scripts/benchmark.py -sizes 1000 10000 -output data/output/benchmarks/$(git rev-parse --short HEAD).json
+Game i of a corpus only depends on (seed, i), so smaller corpora are prefixes of larger ones,
+and generated corpora are kept in CORPUS_DIR for later runs. """
+CORPUS_DIR = "data/benchmarks"
+USERNAME = "Luc777"
+OPPONENTS = ["glennergy", "chocopizza", "manolito49", "KnightofCamelot", "Zuggzwang"]
+OPENINGS = [("C50", "Italian-Game"), ("C50", "Italian-Game-Two-Knights-Defense"),
+            ("B20", "Sicilian-Defense-Bowdler-Attack"), ("B01", "Scandinavian-Defense-2...Qxd5-3.Nc3"),
+            ("D02", "Queens-Pawn-Opening-London-System"), ("C00", "French-Defense-Knight-Variation"),
+            ("A40", "Englund-Gambit"), ("B10", "Caro-Kann-Defense-Two-Knights-Attack")]
+TIME_CONTROLS = ["60", "180", "180+2", "300", "600", "1/86400"]
+
+
+# Synthetic corpus
+def synthetic_pgn(i, seed=0, min_plies=20, max_plies=120):
+    """The i-th game of a synthetic library, as a chess.com PGN string."""
+    rng = random.Random(seed * 1000003 + i)
+    opponent = rng.choice(OPPONENTS)
+    white, black = (USERNAME, opponent) if rng.random() < 0.5 else (opponent, USERNAME)
+    movetext, result = random_game(rng, rng.randint(min_plies, max_plies))
+    result = result or rng.choice(["1-0", "0-1", "1/2-1/2"])
+    year, month, day = 2015 + rng.randrange(7), 1 + rng.randrange(12), 1 + rng.randrange(28)
+    eco, eco_url = rng.choice(OPENINGS)
+    winner = {"1-0": white, "0-1": black}.get(result)
+    termination = f"{winner} won by {rng.choice(['resignation', 'checkmate', 'time'])}" if winner else "Game drawn by agreement"
+    headers = [("Event", "Live Chess"), ("Site", "Chess.com"), ("Date", f"{year}.{month:02d}.{day:02d}"),
+               ("Round", "-"), ("White", white), ("Black", black), ("Result", result),
+               ("CurrentPosition", chess.STARTING_FEN), ("Timezone", "UTC"), ("ECO", eco),
+               ("ECOUrl", f"https://www.chess.com/openings/{eco_url}"), ("UTCDate", f"{year}.{month:02d}.{day:02d}"),
+               ("WhiteElo", str(rng.randint(800, 2200))), ("BlackElo", str(rng.randint(800, 2200))),
+               ("TimeControl", rng.choice(TIME_CONTROLS)), ("Termination", termination),
+               ("Link", f"https://www.chess.com/game/live/{seed}{i:09d}")]
+    return pgn_text(headers, movetext, result), (year, month)
+
+def write_synthetic_library(n_games, seed=0, root=CORPUS_DIR):
+    """Writes (or reuses) a library of n_games under root/synthetic_v2_{n_games}_{seed}/USERNAME,
+    one game per file in {year}/{month}/ directories, like pgn_downloader.py. Returns its path."""
+    parent_dir = Path(root) / f"synthetic_v2_{n_games}_{seed}" / USERNAME # v2: games from chess_analytics.synthetic
+    done = parent_dir.parent / ".complete"
+    if done.exists():
+        return str(parent_dir)
+    shutil.rmtree(parent_dir, ignore_errors=True)
+    print(f"Generating {n_games} synthetic games in {parent_dir}...")
+    for i in range(n_games):
+        pgn, (year, month) = synthetic_pgn(i, seed)
+        month_dir = parent_dir / str(year) / f"{month:02d}"
+        month_dir.mkdir(parents=True, exist_ok=True)
+        (month_dir / f"game_{i}.txt").write_text(pgn)
+    done.touch()
+    return str(parent_dir)
+
+
+# Timing
+def timed(fn, repeat=1):
+    """Best wall time of repeat calls to fn, and its last return value."""
+    best, value = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+def remove_caches(parent_dir):
+    for path in Path(parent_dir).glob(".*"):
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+
+def run_benchmarks(parent_dir, n_games, args):
+    """Times each hot path on one library; returns [{'benchmark', 'n_games', 'n_items', 'seconds'}, ...]."""
+    results = []
+    def record(name, seconds, n_items):
+        results.append({'benchmark': name, 'n_games': n_games, 'n_items': n_items, 'seconds': round(seconds, 6),
+                        'us_per_item': round(1e6 * seconds / max(n_items, 1), 3)})
+        print(f"{name:<32} {n_games:>8} games  {seconds:10.4f}s  ({n_items} items)")
+
+    remove_caches(parent_dir)
+    seconds, library = timed(lambda: GameLibrary(parent_dir, limit=n_games, n_workers=args.workers))
+    record("load_library_cold", seconds, len(library))
+    seconds, library = timed(lambda: GameLibrary(parent_dir, limit=n_games, n_workers=args.workers), args.repeat)
+    record("load_library_cached", seconds, len(library))
+
+    fnames = list(library.df.fname[:args.sample])
+    seconds, _ = timed(lambda: [GameReader(fname) for fname in fnames], args.repeat)
+    record("game_reader_headers", seconds, len(fnames))
+    seconds, _ = timed(lambda: [GameReader(fname).moves for fname in fnames], args.repeat)
+    record("game_reader_moves", seconds, len(fnames))
+    seconds, _ = timed(lambda: [GameReader(fname).game for fname in fnames], args.repeat)
+    record("game_reader_game_tree", seconds, len(fnames))
+
+    seconds, _ = timed(library.move_store)
+    record("move_store_build", seconds, len(library))
+    seconds, _ = timed(library.classify_openings, args.repeat)
+    record("classify_openings", seconds, len(library))
+    seconds, _ = timed(lambda: (library.results_by_openings('White'), library.results_by_openings('Black')),
+                       args.repeat)
+    record("results_by_openings", seconds, len(library))
+
+    games = [library.get_nth_game(i) for i in range(min(len(library), args.pairs_sample))]
+    for game in games:
+        game.moves
+    pairs = [(games[i], games[j]) for i in range(len(games)) for j in range(i + 1, len(games))]
+    seconds, _ = timed(lambda: [compare_games(g1, g2) for g1, g2 in pairs], args.repeat)
+    record("compare_games_all_pairs", seconds, len(pairs))
+    seconds, _ = timed(lambda: library.game_similarity().top_k(5), args.repeat)
+    record("game_similarity_top_k", seconds, len(library) * (len(library) - 1) // 2)
+    seconds, _ = timed(library.position_index)
+    record("position_index_build", seconds, len(library))
+
+    if shutil.which(args.stockfish) or os.path.exists(args.stockfish):
+        sub_library = GameLibrary(parent_dir, limit=min(n_games, args.mate_games), use_cache=False)
+        seconds, _ = timed(lambda: find_forced_mate_positions(sub_library, limit=len(sub_library), n_workers=args.workers,
+                                                              stockfish_path=args.stockfish, depth=args.depth,
+                                                              cache=EvalCache(path=None)))
+        record(f"find_forced_mate_depth_{args.depth}", seconds, len(sub_library))
+    else:
+        print(f"Skipping find_forced_mate_positions (no engine at {args.stockfish})")
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('-seed', type=int, default=0)
+    parser.add_argument('-output', type=str, default=None)
+    parser.add_argument('-workers', type=int, default=1)
+    parser.add_argument('-repeat', type=int, default=3)
+    parser.add_argument('-sample', type=int, default=1000, help="games for the GameReader benchmarks")
+    parser.add_argument('-pairs_sample', type=int, default=300, help="games for compare_games all-pairs")
+    parser.add_argument('-mate_games', type=int, default=50, help="games scanned for forced mates")
+    parser.add_argument('-depth', type=int, default=8)
+    parser.add_argument('-stockfish', type=str, default=STOCKFISH_PATH)
+    parser.add_argument('-corpus_dir', type=str, default=CORPUS_DIR)
+    args = parser.parse_args()
+
+    report = {'commit': git_commit(), 'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'cpu_count': os.cpu_count(), 'seed': args.seed, 'workers': args.workers, 'results': []}
+    for n_games in args.sizes:
+        parent_dir = write_synthetic_library(n_games, args.seed, args.corpus_dir)
+        report['results'].extend(run_benchmarks(parent_dir, n_games, args))
+
+    if args.output is not None:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=4))
+
+if __name__=="__main__":
+    main()
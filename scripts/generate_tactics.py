@@ -1,25 +1,117 @@
+import os
 import sys
 import json
 import argparse
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(".")
 from chess_analytics.game_library import GameLibrary
-from chess_analytics.utils import position_to_image
+from chess_analytics.tactics import MateSearch, iter_forced_mates
+from chess_analytics.utils import positions_to_images
+from chess_analytics import stats
 
 """ Tactics Generator: From a library of pgns, automatically find and
-generate tactics and output them as PNGs."""
+generate tactics and output them as PNGs. With -stream, each tactic is appended to
+tactics.jsonl (and its PNG rendered, while the search goes on) as soon as it's found, and
+every scanned game is recorded in a checkpoint, so an interrupted run resumes where it stopped."""
 OUTPUT_DIR = "data/output/tactics/"
+STREAM_NAME = "tactics.jsonl"
+CHECKPOINT_NAME = ".tactics_checkpoint"
+SEARCH_ARGS = ['input', 'mate', 'max_mate', 'staged', 'min_ply', 'probe_depth', 'confirm_depth', 'confirm_nodes',
+               'budget']
 
 
 def tactics_to_json(tactics_data, output_name):
-    tactics_dict = [{'link': link, 'description': descrip, 'position': pos} for (pos, descrip, link) in tactics_data]
+    tactics_dict = [tactic_to_dict(tactic_data) for tactic_data in tactics_data]
     with open(output_name, 'w') as f:
         json.dump(tactics_dict, f, indent=4)
 
-def generate_tactics_pngs(tactics_data, output_dir):
-    for tactic_data in tactics_data:
-        image_name = f"{'_'.join(tactic_data[1].split()[:3])}_{tactic_data[0].split()[1]}_to_move"
-        image_name = f"{output_dir}" + image_name
-        position_to_image(tactic_data[0], image_name, filetype="png")
+def tactic_to_dict(tactic_data):
+    pos, descrip, link = tactic_data
+    return {'link': link, 'description': descrip, 'position': pos}
+
+def image_name(tactic_data, output_dir):
+    return f"{output_dir}{'_'.join(tactic_data[1].split()[:3])}_{tactic_data[0].split()[1]}_to_move"
+
+def generate_tactics_pngs(tactics_data, output_dir, n_workers=None):
+    positions_to_images([tactic_data[0] for tactic_data in tactics_data],
+                        [image_name(tactic_data, output_dir) for tactic_data in tactics_data], n_workers=n_workers)
+
+
+# Streaming
+def read_lines(fname):
+    """Complete lines of fname (a last line cut short by a crash is dropped)."""
+    if not os.path.exists(fname):
+        return []
+    with open(fname) as f:
+        return f.read().split("\n")[:-1]
+
+def open_append(fname):
+    """Opens fname for appending, starting a new line if a crash left the last one incomplete."""
+    f = open(fname, 'a+')
+    f.seek(0)
+    content = f.read()
+    if content and not content.endswith("\n"):
+        f.write("\n")
+    return f
+
+def read_tactics(stream_name):
+    """Tactics of the stream, in order, without repeats."""
+    tactics = [json.loads(line) for line in read_lines(stream_name) if line]
+    return list(dict.fromkeys((tactic['position'], tactic['description'], tactic['link']) for tactic in tactics))
+
+def read_checkpoint(checkpoint_name, settings):
+    """(fname, offset) of the games already scanned with the same settings."""
+    lines = read_lines(checkpoint_name)
+    if lines and json.loads(lines[0]) != settings:
+        sys.exit(f"{checkpoint_name} is from a run with other settings ({lines[0]}), remove it or change -output.")
+    scanned = set()
+    for line in lines[1:]:
+        fname, _, offset = line.rpartition("\t")
+        scanned.add((fname, int(offset)))
+    return scanned
+
+def stream_tactics(library, args, mate_in, search):
+    """Scans the games missing from the checkpoint, appending tactics to the JSONL stream as they're
+    found and rendering their PNGs in a background thread (rendering errors are raised once the scan
+    is over). Returns all tactics (old and new)."""
+    os.makedirs(args.output, exist_ok=True)
+    stream_name, checkpoint_name = args.output + STREAM_NAME, args.output + CHECKPOINT_NAME
+    settings = {arg: getattr(args, arg) for arg in SEARCH_ARGS}
+    scanned = read_checkpoint(checkpoint_name, settings)
+    tactics_data = read_tactics(stream_name) if scanned else []
+    games = list(zip(library.df.fname, (int(offset) for offset in library.df.offset)))
+    # A crash between the stream and checkpoint writes leaves a tactic whose game isn't in the
+    # checkpoint: that game is skipped too, so its tactic isn't written twice
+    found = {link for _, _, link in tactics_data if link}
+    skip = [i for i, (game, link) in enumerate(zip(games, library.df.id)) if game in scanned or link in found]
+    print(f"Resuming after {len(skip)} scanned games ({len(tactics_data)} tactics)" if skip else "Starting a new scan")
+
+    with ThreadPoolExecutor(1) as images, open_append(stream_name) as stream, \
+         open_append(checkpoint_name) as checkpoint:
+        if not scanned:
+            stream.truncate(0)
+            checkpoint.truncate(0)
+            checkpoint.write(json.dumps(settings) + "\n")
+        render = [] if args.no_images else [tactic for tactic in tactics_data
+                                             if not os.path.exists(image_name(tactic, args.output) + ".png")]
+        renders = [images.submit(generate_tactics_pngs, [tactic], args.output, 1) for tactic in render]
+        if len(tactics_data) < args.limit:
+            with closing(iter_forced_mates(library, mate_in, args.workers, search=search, skip=skip)) as results:
+                for row, tactic in results:
+                    if tactic[0] is not None:
+                        stream.write(json.dumps(tactic_to_dict(tactic)) + "\n")
+                        stream.flush()
+                        tactics_data.append(tactic)
+                        if not args.no_images:
+                            renders.append(images.submit(generate_tactics_pngs, [tactic], args.output, 1))
+                    checkpoint.write(f"{games[row][0]}\t{games[row][1]}\n")
+                    checkpoint.flush()
+                    if len(tactics_data) >= args.limit:
+                        break
+        for future in renders:
+            future.result()
+    return tactics_data
 
 def main():
     parser = argparse.ArgumentParser()
@@ -27,21 +119,48 @@ def main():
     parser.add_argument('-limit', type=int, default=10)
     parser.add_argument('-output', type=str, default=OUTPUT_DIR)
     parser.add_argument('-no_images', default=False, action='store_true')
-    parser.add_argument('-mate', default=2)
+    parser.add_argument('-mate', type=int, default=2)
+    parser.add_argument('-workers', type=int, default=None)
+    parser.add_argument('-max_mate', type=int, default=None, help="find mates in -mate to -max_mate (staged search)")
+    parser.add_argument('-staged', default=False, action='store_true', help="screen positions, probe, then confirm")
+    parser.add_argument('-min_ply', type=int, default=6)
+    parser.add_argument('-probe_depth', type=int, default=6)
+    parser.add_argument('-confirm_depth', type=int, default=18)
+    parser.add_argument('-confirm_nodes', type=int, default=None)
+    parser.add_argument('-budget', type=float, default=None, help="engine seconds per game (staged search)")
+    parser.add_argument('-stream', default=False, action='store_true', help="write tactics as found, resume from a checkpoint")
+    parser.add_argument('-progress', default=False, action='store_true')
+    parser.add_argument('-stats', type=str, default=None, help="write per-stage timings to this JSON file")
     args = parser.parse_args()
+    run_stats = stats.enable(progress=args.progress) if (args.progress or args.stats) else None
     # 1) Build a library from the directory
     games_directory = args.input
     library = GameLibrary(games_directory)
     print(f"Number of games = {len(library)}")
     # 2) Generate tactics (mate-in-twos)
-    tactics_data = library.find_mate_positions(limit=args.limit, mate_in=args.mate)
+    search, mate_in = None, args.mate
+    if args.staged or args.max_mate is not None:
+        search = MateSearch(min_ply=args.min_ply, probe_depth=args.probe_depth, confirm_depth=args.confirm_depth,
+                            confirm_nodes=args.confirm_nodes, budget=args.budget)
+        mate_in = range(args.mate, (args.max_mate or args.mate) + 1)
+    if args.stream:
+        tactics_data = stream_tactics(library, args, mate_in, search)
+    else:
+        tactics_data = library.find_mate_positions(limit=args.limit, mate_in=mate_in, n_workers=args.workers,
+                                                   search=search)
     print(f"Number of tactics = {len(tactics_data)}")
     # 3) Output tactics as JSON
     output_name = args.output + f"{len(tactics_data)}_tactics.json"
     tactics_to_json(tactics_data, output_name)
-    # 4) Generate tactics pngs 
-    if not args.no_images:
-        generate_tactics_pngs(tactics_data, args.output)
+    # 4) Generate tactics pngs (already done while streaming)
+    if not args.no_images and not args.stream:
+        with stats.stage('tactics.images', len(tactics_data)):
+            generate_tactics_pngs(tactics_data, args.output, args.workers)
+    # 5) Report where the time went
+    if run_stats is not None:
+        print(run_stats.report())
+        if args.stats:
+            run_stats.dump(args.stats)
 
 if __name__=="__main__":
     main()
\ No newline at end of file
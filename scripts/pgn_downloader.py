@@ -1,7 +1,23 @@
+import os
 import sys
-import urllib.request
+import time
+import threading
+import urllib.parse
+import http.client
 import json 
+from datetime import datetime, timezone
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+API_URL = "https://api.chess.com/pub"
+HEADERS = {"User-Agent": "chess_analysis/pgn_downloader"}
+CHUNK_SIZE = 1 << 16
+
+
+def month_end(year, month):
+    """Start of the month after year/month (UTC): an archive written before then may be incomplete."""
+    year, month = int(year), int(month)
+    return datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
 
 
 class GameDownloader:
@@ -9,8 +25,10 @@ class GameDownloader:
     - chess.com/news/view/published-data-api#pubapi-endpoint-games-pgn
     - chess.com/forum/view/suggestions/export-all-my-games-to-my-personal-database
     """
-    def __init__(self, username):
+    def __init__(self, username, api_url = API_URL):
         self.username = username
+        self.api_url = api_url
+        self._local = threading.local()
         self.dates =  self.get_dates()
         self.games = []
         
@@ -19,10 +37,90 @@ class GameDownloader:
         """Find all month/year combos that the user played through a request to
         api.chess.com/pub/player/{username}/games/archives, which returns JSON:
         { "archives": [".../{user}/games/2009/10", ...] }"""
-        archive_url = f'https://api.chess.com/pub/player/{self.username}/games/archives'
-        with urllib.request.urlopen(archive_url) as url:
-            content = json.loads(url.read().decode())
+        content = json.loads(self.request(f"/player/{self.username}/games/archives").decode())
         return [c.split('/')[-2:] for c in content['archives']]
+
+    # Connection handling
+    def connection(self):
+        """HTTP(S) connection of the current thread, kept alive between requests."""
+        if getattr(self._local, 'connection', None) is None:
+            url = urllib.parse.urlsplit(self.api_url)
+            connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+            self._local.connection = connection_class(url.netloc, timeout=60)
+        return self._local.connection
+
+    def close_connection(self):
+        if getattr(self._local, 'connection', None) is not None:
+            self._local.connection.close()
+            self._local.connection = None
+
+    def request(self, path, write_to = None, retries = 3, backoff = 1.0):
+        """GET {api_url}{path} on the thread's connection, retrying network errors, 429s and 5xxs
+        with exponential backoff (backoff * 2^attempt seconds). The body is streamed to the file
+        write_to if given, and returned otherwise."""
+        full_path = urllib.parse.urlsplit(self.api_url).path + path
+        for attempt in range(retries + 1):
+            try:
+                connection = self.connection()
+                connection.request("GET", full_path, headers=HEADERS)
+                response = connection.getresponse()
+                if response.status == 200:
+                    return self.read_response(response, write_to)
+                response.read() # Drain, so the connection can be reused
+                if response.status != 429 and response.status < 500:
+                    raise ValueError(f"HTTP {response.status} for {full_path}")
+                error = ConnectionError(f"HTTP {response.status} for {full_path}")
+            except (OSError, http.client.HTTPException) as e:
+                self.close_connection()
+                error = e
+            if attempt == retries:
+                raise error
+            time.sleep(backoff * 2 ** attempt)
+
+    @staticmethod
+    def read_response(response, write_to = None):
+        if write_to is None:
+            return response.read()
+        with open(write_to, 'wb') as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+        return write_to
+
+    # Streaming download, straight to year/month directories
+    def month_path(self, year, month, foldername = None, root = "data/user_games"):
+        foldername = foldername if foldername else self.username
+        return Path(root) / foldername / year / month / "games.pgn"
+
+    def download_month(self, year, month, foldername = None, root = "data/user_games", **kwargs):
+        """Streams a month's archive to {root}/{foldername}/{year}/{month}/games.pgn (through a
+        .part file, renamed once complete). Months already on disk are skipped if they were written
+        after the month ended: the current month, still being played, is fetched again, and so is a
+        past month that was downloaded while it was still the current one."""
+        path = self.month_path(year, month, foldername, root)
+        if path.exists() and datetime.fromtimestamp(path.stat().st_mtime, timezone.utc) >= month_end(year, month):
+            return None
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = path.with_suffix(".part")
+        self.request(f"/player/{self.username}/games/{year}/{month}/pgn", write_to=part_path, **kwargs)
+        os.replace(part_path, path)
+        return path
+
+    def download_to_folder(self, foldername = None, root = "data/user_games", limit = None, n_workers = 4,
+                           retries = 3, backoff = 1.0):
+        """Downloads every month concurrently (n_workers threads, one connection each) straight
+        to disk, see download_month(). Returns the paths written."""
+        dates = self.dates[:limit]
+        print(f"Downloading {len(dates)} months to {Path(root) / (foldername if foldername else self.username)}")
+
+        def download(date):
+            return self.download_month(date[0], date[1], foldername, root, retries=retries, backoff=backoff)
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            paths = [path for path in executor.map(download, dates) if path is not None]
+        print(f"Got {len(paths)} months ({len(dates) - len(paths)} already on disk).")
+        return paths
     
     def download_games(self, limit = None, specify_dates = None):
         """By year/month: https://api.chess.com/pub/player/{user}/games/2009/10/pgn
@@ -30,10 +128,8 @@ class GameDownloader:
         pgns = {}
         dates = specify_dates if specify_dates else self.dates[:limit]
         for year, month in dates:
-            games_url = f'https://api.chess.com/pub/player/{self.username}/games/{year}/{month}/pgn'
-            with urllib.request.urlopen(games_url) as url:
-                content = url.read().decode()
-                pgns[(year, month)] = content.split('\n\n\n') # Dictionary indexed by (year, month)
+            content = self.request(f"/player/{self.username}/games/{year}/{month}/pgn").decode()
+            pgns[(year, month)] = content.split('\n\n\n') # Dictionary indexed by (year, month)
 
         print(f"Got {sum([len(games_my) for games_my in pgns.values()])} games!")
         self.games = pgns
@@ -70,8 +166,7 @@ def main():
     if len(sys.argv) > 1:
         username = sys.argv[1]
         game_downloader = GameDownloader(username)
-        game_downloader.download_games() 
-        game_downloader.games_to_folder()
+        game_downloader.download_to_folder()
 
     else:
         print("No username provided...")
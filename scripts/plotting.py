@@ -39,18 +39,13 @@ def plot_wrs(library):
     plt.show()
 
 
-def plot_rating_distribution(df):
-    # TODO - Refactor...
-    df_as_white = df[df.White == games_dir.split('/')[-1].capitalize()]
-    df_as_black = df[df.Black == games_dir.split('/')[-1].capitalize()]
-    print(f"Games played: {len(df)} (W: {len(df_as_white)}, B: {len(df_as_black)})")
-    print(f"Sample: \n {df.sample(2)}\n")
-
-    # Round ratings to nearest 100
-    opp_ratings_as_white = df_as_white.BElo.apply(lambda x: round(int(x)/100)*100).value_counts()
-    opp_ratings_as_black = df_as_black.WElo.apply(lambda x: round(int(x)/100)*100).value_counts()
-    opp_ratings_as_white.index = opp_ratings_as_white.index.astype(int)
-    opp_ratings_as_black.index = opp_ratings_as_black.index.astype(int)
+def plot_rating_distribution(library):
+    """Opponent ratings (to the nearest 100) by color, from the library's cube."""
+    cube = library.cube()
+    print(f"Games played: {len(library)} (W: {cube.query(color='white')}, B: {cube.query(color='black')})")
+    ratings = cube.query(['color', 'opponent_rating'], color=['white', 'black'])
+    opp_ratings_as_white = ratings['white'] if 'white' in ratings.index.get_level_values(0) else pd.Series(dtype=int)
+    opp_ratings_as_black = ratings['black'] if 'black' in ratings.index.get_level_values(0) else pd.Series(dtype=int)
 
     # Plot the range of opponents ratings
     fig, ax = plt.subplots()
@@ -63,12 +58,28 @@ def plot_rating_distribution(df):
 
     plt.show()
 
+
+def plot_results_over_time(library, color=None):
+    """Wins, losses and draws per month (for one color, or both)."""
+    where = {'color': color.lower()} if color is not None else {'color': ['white', 'black']}
+    results = library.cube().timeseries('outcome', **where)
+    results.index = [f"{month // 100}-{month % 100:02d}" for month in results.index]
+
+    fig, ax = plt.subplots(figsize=(10,5))
+    ax.set_title(f"Results over time{f' ({color})' if color else ''}")
+    results.reindex(columns=['win', 'loss', 'draw'], fill_value=0).plot.bar(
+        stacked=True, ax=ax, color=['g', 'crimson', 'grey'])
+    ax.set_ylabel("Number of games")
+    ax.tick_params(axis='x', labelrotation=60)
+    plt.show()
+
 if __name__=="__main__":
     # Make game library
     games_dir = sys.argv[1] # data/user_games/Luc777
     library = GameLibrary(games_dir)
 
-    #plot_rating_distribution(library.df)
+    #plot_rating_distribution(library)
+    #plot_results_over_time(library)
     plot_results_by_opening(library)
     # Plot winrate by color
     plot_wrs(library)
@@ -0,0 +1,40 @@
+import random
+from pathlib import Path
+from chess_analytics.synthetic import random_game, pgn_text
+
+""" Small chess.com-style PGN library used by the tests. """
+USERNAME = "Luc777"
+OPPONENTS = ["glennergy", "chocopizza", "manolito49"]
+ECO_URLS = [("C50", "Italian-Game-Two-Knights-Defense"), ("C50", "Italian-Game"),
+            ("B20", "Sicilian-Defense-Bowdler-Attack"), ("B01", "Scandinavian-Defense-2...Qxd5-3.Nc3"),
+            ("D02", "Queens-Pawn-Opening-London-System")]
+RESULTS = ["1-0", "0-1", "1/2-1/2"]
+
+
+def sample_pgn(i, seed=0, n_plies=30):
+    """The i-th sample game as a chess.com PGN string."""
+    rng = random.Random(seed * 100003 + i)
+    as_white = i % 2 == 0
+    opponent = OPPONENTS[i % len(OPPONENTS)]
+    white, black = (USERNAME, opponent) if as_white else (opponent, USERNAME)
+    eco, eco_url = ECO_URLS[i % len(ECO_URLS)]
+    result = RESULTS[rng.randrange(3)]
+    headers = [("Event", "Live Chess"), ("Site", "Chess.com"), ("Date", f"2021.0{1 + i % 9}.{1 + i % 28:02d}"),
+               ("Round", "-"), ("White", white), ("Black", black), ("Result", result),
+               ("ECO", eco), ("ECOUrl", f"https://www.chess.com/openings/{eco_url}"),
+               ("WhiteElo", str(1400 + 10 * (i % 20))), ("BlackElo", str(1390 + 10 * (i % 17))),
+               ("TimeControl", "180" if i % 3 else "600"), ("Termination", f"{white} won by resignation"),
+               ("Link", f"https://www.chess.com/game/live/{1000 + i}")]
+    return pgn_text(headers, random_game(rng, n_plies)[0], result)
+
+
+def write_sample_library(parent_dir, n_games=12, seed=0):
+    """Writes n_games into parent_dir/{year}/{month}/game_{i}.txt, like pgn_downloader.py."""
+    fnames = []
+    for i in range(n_games):
+        month_dir = Path(parent_dir) / "2021" / f"{1 + i % 3:02d}"
+        month_dir.mkdir(parents=True, exist_ok=True)
+        fname = month_dir / f"game_{i}.txt"
+        fname.write_text(sample_pgn(i, seed))
+        fnames.append(str(fname))
+    return fnames
@@ -0,0 +1,149 @@
+import sys
+import json
+import asyncio
+import unittest
+import tempfile
+from unittest import mock
+import chess
+import chess.engine
+sys.path.append("scripts")
+from analysis_daemon import AnalysisDaemon, EnginePool
+from chess_analytics.game_library import GameLibrary
+from chess_analytics.eval_cache import EvalCache
+from sample_games import write_sample_library, sample_pgn
+
+
+class FakeAsyncEngine:
+    """Stands in for chess.engine's asyncio UciProtocol: +0.30 for white, counting searches."""
+    searches = 0
+
+    async def analyse(self, board, limit):
+        FakeAsyncEngine.searches += 1
+        return {'score': chess.engine.PovScore(chess.engine.Cp(30), chess.WHITE), 'depth': limit.depth,
+                'pv': [next(iter(board.legal_moves))]}
+
+    async def quit(self):
+        pass
+
+async def fake_popen_uci(path):
+    return None, FakeAsyncEngine()
+
+async def get(port, target):
+    """(status, JSON body) of an HTTP GET to the daemon."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    return int(head.split()[1]), json.loads(body)
+
+
+class TestAnalysisDaemon(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        write_sample_library(self.parent_dir, n_games=12)
+        self.library = GameLibrary(self.parent_dir)
+        self.daemon = AnalysisDaemon(self.library, EnginePool("stockfish", size=2), cache=EvalCache(path=None),
+                                     watch_interval=None)
+        self.daemon.warm_up()
+        with mock.patch('chess.engine.popen_uci', fake_popen_uci):
+            self.server = await self.daemon.start(port=0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await self.daemon.close()
+        self.tmp_dir.cleanup()
+
+    async def test_library_queries(self):
+        status, body = await get(self.port, "/winrates")
+        self.assertEqual(200, status)
+        self.assertEqual(list(self.library.winrates()), [body['white'], body['black']])
+
+        status, body = await get(self.port, "/winrates?by=color")
+        df, user = self.library.df, self.library.username
+        january = df[df.Date.str.startswith("2021.01") & (df.White == user)]
+        months = sorted(set(df.Date.str[:4].astype(int) * 100 + df.Date.str[5:7].astype(int)))
+        self.assertEqual(months, [row['month'] for row in body])
+        self.assertEqual((january.Result == 1).mean(), body[0]['white'])
+        status, body = await get(self.port, "/winrates?by=month")
+        self.assertEqual(len(months), len(body))
+        self.assertTrue(all(0 <= row['winrate'] <= 1 for row in body))
+
+        status, body = await get(self.port, "/openings?color=black&n=3")
+        expected = list(self.library.results_by_openings('Black').items())[:3]
+        self.assertEqual([[opening, list(counts)] for opening, counts in expected],
+                         [[row['opening'], [row['win'], row['loss'], row['draw']]] for row in body])
+
+        status, body = await get(self.port, f"/position?fen={chess.STARTING_FEN.replace(' ', '%20')}")
+        self.assertEqual(12, body['games'])
+        self.assertEqual(12, sum(count for _, count in body['moves']))
+
+        with mock.patch('chess_analytics.similarity.GameSimilarity', side_effect=AssertionError("rebuilt")):
+            status, body = await get(self.port, "/similar?game=2&k=3") # Built by warm_up
+        self.assertEqual((200, 3), (status, len(body)))
+        self.assertEqual(404, (await get(self.port, "/similar?game=99"))[0])
+        self.assertEqual(400, (await get(self.port, "/similar"))[0])
+        self.assertEqual(404, (await get(self.port, "/unknown"))[0])
+        self.assertEqual(400, (await get(self.port, "/winrates?by=bogus"))[0])
+        self.assertEqual(400, (await get(self.port, "/repertoire?color=purple"))[0])
+        self.assertEqual(200, (await get(self.port, "/repertoire?color=White"))[0])
+
+    async def test_unexpected_errors(self):
+        with mock.patch.object(self.library, 'winrates', side_effect=KeyError('white')), \
+             mock.patch('traceback.print_exc'):
+            status, body = await get(self.port, "/winrates")
+        self.assertEqual(500, status)
+        self.assertIn("KeyError", body['error'])
+        self.assertEqual(200, (await get(self.port, "/status"))[0])
+
+    async def test_concurrent_evaluations(self):
+        FakeAsyncEngine.searches = 0
+        fen = "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3".replace(" ", "%20")
+        responses = await asyncio.gather(*[get(self.port, f"/eval?fen={fen}&depth={depth}") for depth in [10, 12, 14]])
+        self.assertEqual([200] * 3, [status for status, _ in responses])
+        self.assertEqual({'cp': 30, 'mate': None}, responses[0][1]['score'])
+        self.assertEqual(3, FakeAsyncEngine.searches)
+        await get(self.port, f"/eval?fen={fen}&depth=10") # Cached
+        self.assertEqual(3, FakeAsyncEngine.searches)
+        self.assertEqual(400, (await get(self.port, "/eval?fen=not-a-fen"))[0])
+
+    async def test_reloads_new_games(self):
+        self.assertFalse(await self.daemon.reload())
+        with open(f"{self.parent_dir}/2021/02/game_new.txt", 'w') as f:
+            f.write(sample_pgn(40))
+        self.assertTrue(await self.daemon.reload())
+        status, body = await get(self.port, "/status")
+        self.assertEqual((13, 1), (body['games'], body['reloads']))
+        status, body = await get(self.port, "/repertoire?n=50")
+        self.assertEqual(13, sum(row['games'] for row in body))
+        self.assertEqual(13, self.library.game_similarity().matrix.shape[0]) # Rebuilt for the new game
+
+    async def test_watcher_survives_failed_reloads(self):
+        refresh = self.daemon.refresh
+        failures = []
+        def flaky_refresh():
+            if not failures:
+                failures.append(1)
+                raise OSError("disk hiccup")
+            refresh()
+        self.daemon.watch_interval = 0.01
+        with mock.patch.object(self.daemon, 'refresh', flaky_refresh), mock.patch('traceback.print_exc'):
+            watcher = asyncio.create_task(self.daemon.watch())
+            with open(f"{self.parent_dir}/2021/02/game_new.txt", 'w') as f:
+                f.write(sample_pgn(40))
+            for _ in range(200):
+                await asyncio.sleep(0.01)
+                if self.daemon.reloads:
+                    break
+            watcher.cancel()
+        self.assertEqual([1], failures)
+        self.assertEqual((1, 13), (self.daemon.reloads, len(self.library)))
+
+    async def test_evaluations_with_sqlite_cache(self):
+        self.daemon.cache = EvalCache(path=f"{self.tmp_dir.name}/evals.sqlite")
+        fen = chess.STARTING_FEN.replace(" ", "%20")
+        self.assertEqual([200, 200], [(await get(self.port, f"/eval?fen={fen}&depth={depth}"))[0] for depth in [8, 8]])
+        self.assertEqual((1, 1), (self.daemon.cache.hits, self.daemon.cache.misses))
@@ -0,0 +1,28 @@
+import sys
+import unittest
+import tempfile
+from pathlib import Path
+sys.path.append("scripts")
+from benchmark import synthetic_pgn, write_synthetic_library
+from chess_analytics.game_library import GameLibrary
+
+
+class TestSyntheticLibrary(unittest.TestCase):
+    def test_reproducible_prefixes(self):
+        self.assertEqual(synthetic_pgn(7, seed=3), synthetic_pgn(7, seed=3))
+        self.assertNotEqual(synthetic_pgn(7, seed=3), synthetic_pgn(7, seed=4))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            small = write_synthetic_library(20, root=tmp_dir)
+            large = write_synthetic_library(30, root=tmp_dir)
+            small_games = {p.relative_to(small): p.read_text() for p in Path(small).rglob("*.txt")}
+            large_games = {p.relative_to(large): p.read_text() for p in Path(large).rglob("*.txt")}
+            self.assertEqual(20, len(small_games))
+            self.assertTrue(all(large_games[name] == pgn for name, pgn in small_games.items()))
+
+    def test_library_loads(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            library = GameLibrary(write_synthetic_library(25, root=tmp_dir), use_cache=False)
+            self.assertEqual(25, len(library))
+            self.assertTrue(((library.df.White == 'Luc777') ^ (library.df.Black == 'Luc777')).all())
+            self.assertTrue(library.df.Result.isin([0, 0.5, 1]).all())
+            self.assertTrue(all(len(library.get_nth_game(i).moves) > 0 for i in range(len(library))))
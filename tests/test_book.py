@@ -0,0 +1,65 @@
+import unittest
+import pandas as pd
+import tempfile
+from unittest import mock
+import chess
+import chess.polyglot
+from chess_analytics.book import OpeningBook, find_book_deviations, aggregate_deviations, BOOK_PATH
+from chess_analytics.game_library import GameLibrary
+from sample_games import write_sample_library
+
+
+def naive_deviation(game, reader):
+    """First (ply, san) where the move isn't in the book, opening the book per position."""
+    board = game.board()
+    for ply, move in enumerate(game.mainline_moves()):
+        book_moves = [entry.move for entry in reader.find_all(board)]
+        if not book_moves:
+            return None
+        if move not in book_moves:
+            return ply, board.san(move)
+        board.push(move)
+    return None
+
+
+class TestBookDeviations(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        write_sample_library(self.parent_dir, n_games=10)
+        self.library = GameLibrary(self.parent_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_matches_naive_walk(self):
+        index = self.library.position_index()
+        with OpeningBook(BOOK_PATH) as book, mock.patch.object(index, 'fen_at', side_effect=AssertionError("replayed")):
+            deviations = find_book_deviations(index, book) # One board per game, no replays from ply 0
+        found = {self.library.position_index().games[game_id][:2]: (ply, move) for game_id, ply, move
+                 in zip(deviations.game_id, deviations.ply, deviations.move)}
+        with chess.polyglot.open_reader(BOOK_PATH) as reader:
+            for i in range(len(self.library)):
+                expected = naive_deviation(self.library.get_nth_game(i).game, reader)
+                self.assertEqual(expected, found.get((self.library.df.fname.iloc[i], 0)))
+
+    def test_aggregated_by_position(self):
+        aggregated = self.library.book_deviations(user_only=False)
+        self.assertEqual(len(self.library), aggregated.n_games.sum())
+        self.assertTrue(set(aggregated.color) <= {'white', 'black'})
+
+    def test_transpositions_are_one_position(self):
+        rows = []
+        for game_id, sans in enumerate([["Nf3", "Nf6", "d4"], ["d4", "Nf6", "Nf3"]]): # Other halfmove clocks
+            board = chess.Board()
+            for san in sans:
+                board.push_san(san)
+            rows.append((game_id, 3, 'black', True, chess.polyglot.zobrist_hash(board), board.fen(), "a6", ["e6"]))
+        deviations = pd.DataFrame(rows, columns=['game_id', 'ply', 'color', 'by_user', 'key', 'fen', 'move', 'book_moves'])
+        self.assertNotEqual(*deviations.fen)
+        aggregated = aggregate_deviations(deviations)
+        self.assertEqual([(deviations.fen[0], 2)], list(zip(aggregated.fen, aggregated.n_games)))
+
+    def test_book_path_is_absolute(self):
+        self.assertTrue(BOOK_PATH.is_absolute())
+        self.assertTrue(BOOK_PATH.exists())
@@ -0,0 +1,75 @@
+import os
+import unittest
+import tempfile
+import pandas as pd
+from chess_analytics.game_library import GameLibrary
+from chess_analytics.cube import LibraryCube
+from sample_games import write_sample_library, sample_pgn
+
+
+class TestLibraryCube(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        self.fnames = write_sample_library(self.parent_dir, n_games=30)
+        self.library = GameLibrary(self.parent_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_winrates_match_rescan(self):
+        df, user = self.library.df, self.library.username
+        white_df, black_df = df[df.White == user], df[df.Black == user]
+        expected = (len(white_df[white_df.Result == 1]) / len(white_df), len(black_df[black_df.Result == 0]) / len(black_df))
+        self.assertEqual(expected, self.library.winrates())
+
+    def test_queries_match_rescan(self):
+        df, cube = self.library.df, self.library.cube()
+        self.assertEqual(len(df), cube.query())
+        months = df.Date.str[:4].astype(int) * 100 + df.Date.str[5:7].astype(int)
+        expected = df.groupby([months, df.opening_chesscom_general]).size()
+        self.assertEqual(expected.to_dict(), cube.query(['month', 'mainline']).to_dict())
+
+        as_black = df[df.Black == 'Luc777']
+        expected = (as_black.WElo.astype(int) + 50) // 100 * 100
+        self.assertEqual(expected.value_counts().sort_index().to_dict(),
+                         cube.query(['opponent_rating'], color='black').to_dict())
+        self.assertEqual({'resignation': 30}, cube.query(['termination']).to_dict())
+        blitz = (df.TimeControl == '180').sum()
+        self.assertEqual(blitz, cube.query(time_class='blitz'))
+
+        timeseries = cube.timeseries('outcome', color='white')
+        self.assertTrue(set(timeseries.columns) <= {'win', 'loss', 'draw'})
+        self.assertEqual((df.White == 'Luc777').sum(), timeseries.values.sum())
+
+    def test_incremental_update(self):
+        self.library.cube()
+        os.remove(self.fnames[5])
+        with open(f"{self.parent_dir}/2021/02/game_new.txt", 'w') as f:
+            f.write(sample_pgn(40))
+        library = GameLibrary(self.parent_dir)
+        cube = library.cube()
+        self.assertEqual(30, len(cube))
+        rebuilt = LibraryCube()
+        rebuilt.update(library)
+        pd.testing.assert_series_equal(rebuilt.cube.sort_index(), cube.cube.sort_index(), check_categorical=False,
+                                       check_index_type=False)
+
+    def test_update_remaps_mainlines_and_rewritten_files(self):
+        self.library.cube()
+        sicilian = self.library.df.opening_chesscom_general == 'Sicilian-Defense-Bowdler-Attack'
+        self.assertTrue(sicilian.any())
+        with open(f"{self.parent_dir}/2021/02/game_new.txt", 'w') as f: # A shorter name, the others' new mainline
+            f.write(sample_pgn(2).replace("Sicilian-Defense-Bowdler-Attack", "Sicilian-Defense").replace("/1002", "/1100"))
+        with open(self.fnames[0], 'w') as f: # Rewritten in place (same size), with another opponent rating
+            f.write(sample_pgn(0).replace('[BlackElo "1390"]', '[BlackElo "2390"]'))
+        library = GameLibrary(self.parent_dir)
+        cube = library.cube()
+        self.assertEqual({'Sicilian-Defense': sicilian.sum() + 1},
+                         cube.query(['mainline'], mainline=['Sicilian-Defense', 'Sicilian-Defense-Bowdler-Attack']).to_dict())
+        rebuilt = LibraryCube()
+        rebuilt.update(library)
+        pd.testing.assert_series_equal(rebuilt.cube.sort_index(), cube.cube.sort_index(), check_categorical=False,
+                                       check_index_type=False)
+        self.assertEqual(1, cube.query(opponent_rating=2400))
+        self.assertFalse(cube.update(library))
@@ -0,0 +1,56 @@
+import io
+import os
+import shutil
+import unittest
+import tempfile
+from unittest import mock
+from contextlib import redirect_stdout
+from pathlib import Path
+from chess_analytics.game_library import GameLibrary, describe_game
+from chess_analytics.game_reader import GameReader
+from chess_analytics.dedup import game_key
+from sample_games import write_sample_library, sample_pgn
+
+
+class TestDeduplication(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        write_sample_library(self.parent_dir, n_games=12)
+        # A copied month directory, and an export overlapping two games (one with a different Link URL)
+        shutil.copytree(f"{self.parent_dir}/2021/01", f"{self.parent_dir}/backup")
+        self.n_copied = len(os.listdir(f"{self.parent_dir}/backup"))
+        overlapping = [sample_pgn(3), sample_pgn(4).replace('/1004"]', '/1004?tab=review"]'), sample_pgn(50)]
+        Path(f"{self.parent_dir}/export.pgn").write_text("\n\n\n".join(overlapping))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_drops_duplicates(self):
+        with redirect_stdout(io.StringIO()) as output:
+            library = GameLibrary(self.parent_dir)
+        self.assertIn(f"Dropped {self.n_copied + 2} duplicate games", output.getvalue())
+        self.assertNotIn("backup", output.getvalue()) # Only the total is printed
+        self.assertEqual(13, len(library))
+        self.assertEqual(len(library), library.df.game_key.nunique())
+        self.assertEqual(self.n_copied + 2, len(library.duplicates))
+        report = library.duplicate_report()
+        self.assertEqual(self.n_copied, report[('backup', '2021/01')])
+        self.assertEqual(2, report.xs('export.pgn', level='source').sum())
+        self.assertEqual(13 + self.n_copied + 2, len(GameLibrary(self.parent_dir, dedup=False)))
+
+        # Keys are cached with the library table, so a reload doesn't parse anything
+        with mock.patch('chess_analytics.game_library.describe_game', wraps=describe_game) as parsed:
+            reloaded = GameLibrary(self.parent_dir)
+        self.assertEqual(0, parsed.call_count)
+        self.assertEqual(list(library.duplicates.fname), list(reloaded.duplicates.fname))
+
+    def test_game_key(self):
+        game, copy = GameReader(f"{self.parent_dir}/2021/01/game_0.txt"), GameReader(f"{self.parent_dir}/backup/game_0.txt")
+        self.assertEqual(game, copy)
+        self.assertNotEqual(game, GameReader(f"{self.parent_dir}/2021/02/game_1.txt"))
+        headers = dict(game.headers)
+        self.assertNotEqual(game.key, game_key(headers, game.moves[:-1]))
+        del headers['Link']
+        self.assertEqual(game_key(headers, game.moves), game_key(dict(headers), game.moves))
+        self.assertNotEqual(game_key(headers, game.moves), game_key({**headers, 'UTCTime': "12:00:00"}, game.moves))
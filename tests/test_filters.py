@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+import tempfile
+from pathlib import Path
+from chess_analytics.game_library import GameLibrary, GameFilter, describe_game, key_game
+from chess_analytics.game_reader import GameReader
+from chess_analytics.filters import time_class
+from sample_games import write_sample_library
+
+
+class TestGameFilter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        self.fnames = write_sample_library(self.parent_dir, n_games=30)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def expected(self, match):
+        """Brute force: fnames of the games whose directory month and headers pass match."""
+        expected = []
+        for fname in self.fnames:
+            headers = GameReader(fname).headers
+            if match(int(Path(fname).parent.name), headers):
+                expected.append(fname)
+        return sorted(expected)
+
+    def test_time_classes(self):
+        self.assertEqual(['bullet', 'blitz', 'blitz', 'rapid', 'daily', None],
+                         [time_class(tc) for tc in ['60', '180', '120+2', '600', '1/86400', '-']])
+
+    def test_date_range_skips_directories(self):
+        filters = GameFilter(start="2021.02.01", end="2021-03-31")
+        with mock.patch('chess_analytics.game_library.describe_game', wraps=describe_game) as parsed:
+            library = GameLibrary(self.parent_dir, filters=filters)
+        self.assertTrue(all(not call.args[0].endswith(tuple(f"/01/game_{i}.txt" for i in range(30)))
+                            for call in parsed.call_args_list))
+        expected = self.expected(lambda month, headers: month in (2, 3) and headers['Date'][5:7] in ('02', '03'))
+        self.assertEqual(expected, sorted(library.df.fname))
+
+    def test_header_filters(self):
+        filters = GameFilter(time_controls=['blitz'], color='black', min_opponent_elo=1430)
+        library = GameLibrary(self.parent_dir, filters=filters)
+        expected = self.expected(lambda month, headers: headers['TimeControl'] == '180'
+                                 and headers['Black'] == 'Luc777' and int(headers['WhiteElo']) >= 1430)
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(expected, sorted(library.df.fname))
+        self.assertEqual(len(library), len(library.move_store()))
+        self.assertNotIn('game', vars(library.get_nth_game(0)))
+
+    def test_only_kept_games_are_keyed(self):
+        filters = GameFilter(time_controls=['blitz'], color='black')
+        with mock.patch('chess_analytics.game_library.key_game', wraps=key_game) as keyed:
+            library = GameLibrary(self.parent_dir, filters=filters, dedup=False, use_cache=False)
+            self.assertEqual(0, keyed.call_count)
+            library = GameLibrary(self.parent_dir, filters=filters)
+            self.assertEqual(sorted(library.df.fname), sorted(call.args[0] for call in keyed.call_args_list))
+            keyed.reset_mock()
+            self.assertEqual(30, len(GameLibrary(self.parent_dir))) # Only the others' keys are computed
+            self.assertEqual(30 - len(library), keyed.call_count)
+            GameLibrary(self.parent_dir)
+            self.assertEqual(30 - len(library), keyed.call_count)
+
+    def test_filtered_load_keeps_cache(self):
+        GameLibrary(self.parent_dir, filters=GameFilter(start="2021.03.01"))
+        with mock.patch('chess_analytics.game_library.describe_game', wraps=describe_game) as parsed:
+            library = GameLibrary(self.parent_dir)
+        self.assertEqual(30, len(library))
+        self.assertEqual(20, parsed.call_count) # Months 01 and 02 weren't listed by the filtered load
+        with mock.patch('chess_analytics.game_library.describe_game', wraps=describe_game) as parsed:
+            GameLibrary(self.parent_dir, filters=GameFilter(start="2021.03.01"))
+            GameLibrary(self.parent_dir)
+        self.assertEqual(0, parsed.call_count)
@@ -0,0 +1,46 @@
+import os
+import unittest
+from unittest import mock
+import tempfile
+from chess_analytics.game_library import GameLibrary, describe_game
+from sample_games import write_sample_library
+
+
+class TestGameLibrary(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        write_sample_library(self.parent_dir, n_games=12)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parallel_load_matches_serial(self):
+        serial = GameLibrary(self.parent_dir, use_cache=False)
+        parallel = GameLibrary(self.parent_dir, n_workers=2, chunksize=5, use_cache=False)
+        columns = [c for c in serial.df.columns if c != 'Game']
+        self.assertEqual(12, len(parallel))
+        self.assertTrue(serial.df[columns].equals(parallel.df[columns]))
+
+    def test_games_are_parsed_lazily_once(self):
+        library = GameLibrary(self.parent_dir)
+        game = library.get_nth_game(3)
+        self.assertIs(game, library.df.Game.iloc[3])
+        self.assertNotIn('tokens', vars(game))
+        self.assertEqual(game.headers['Link'], library.df.id.iloc[3])
+        self.assertGreater(len(game.moves), 0)
+        self.assertIn('tokens', vars(game))
+        self.assertNotIn('game', vars(game)) # Moves don't need the game tree
+
+    def test_cache_only_parses_changes(self):
+        library = GameLibrary(self.parent_dir)
+        fnames = list(library.df.fname)
+        os.remove(fnames[0])
+        with open(fnames[1], 'a') as f:
+            f.write("\n")
+        with mock.patch('chess_analytics.game_library.describe_game', wraps=describe_game) as parsed:
+            refreshed = GameLibrary(self.parent_dir)
+        self.assertEqual([mock.call(fnames[1], 0)], parsed.call_args_list)
+        self.assertEqual(fnames[1:], list(refreshed.df.fname))
+        columns = [c for c in library.df.columns if c not in ('Game', 'mtime', 'fsize')]
+        self.assertTrue(library.df[columns].iloc[1:].reset_index(drop=True).equals(refreshed.df[columns]))
@@ -0,0 +1,88 @@
+import os
+import sys
+import argparse
+import unittest
+import tempfile
+from unittest import mock
+from pathlib import Path
+sys.path.append("scripts")
+import generate_tactics
+from chess_analytics.game_library import GameLibrary
+from chess_analytics.eval_cache import EvalCache
+from sample_games import write_sample_library
+from test_tactics import FakeStockfish
+
+
+def fake_images(fen_positions, output_names, n_workers=None):
+    for output_name in output_names:
+        Path(output_name + ".png").touch()
+
+
+@mock.patch('stockfish.Stockfish', FakeStockfish)
+@mock.patch('chess_analytics.tactics.default_cache', lambda: EvalCache(path=None))
+@mock.patch('generate_tactics.positions_to_images', fake_images)
+class TestStreamingTactics(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        write_sample_library(f"{self.tmp_dir.name}/Luc777", n_games=8)
+        self.library = GameLibrary(f"{self.tmp_dir.name}/Luc777", use_cache=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def args(self, limit=100, output="out/", **kwargs):
+        args = dict(input=self.library.parent_dir, limit=limit, output=f"{self.tmp_dir.name}/{output}", no_images=False,
+                    mate=2, max_mate=None, staged=False, min_ply=6, probe_depth=6, confirm_depth=18,
+                    confirm_nodes=None, budget=None, workers=1)
+        args.update(kwargs)
+        return argparse.Namespace(**args)
+
+    def test_resumes_from_checkpoint(self):
+        full = generate_tactics.stream_tactics(self.library, self.args(output="full/"), 2, None)
+        self.assertEqual(8, len(full))
+
+        first = generate_tactics.stream_tactics(self.library, self.args(limit=3), 2, None)
+        self.assertEqual(full[:3], first)
+        with open(self.args().output + generate_tactics.CHECKPOINT_NAME, 'a') as f:
+            f.write("/interrupted/mid/li") # A crash while writing a line
+        scanned = []
+        iter_forced_mates = generate_tactics.iter_forced_mates
+        def recording(library, mate_in, n_workers, search=None, skip=()):
+            for row, tactic in iter_forced_mates(library, mate_in, n_workers, search=search, skip=skip):
+                scanned.append(row)
+                yield row, tactic
+        with mock.patch('generate_tactics.iter_forced_mates', recording):
+            resumed = generate_tactics.stream_tactics(self.library, self.args(), 2, None)
+        self.assertEqual([3, 4, 5, 6, 7], scanned)
+        self.assertEqual(full, resumed)
+        self.assertEqual(full, generate_tactics.read_tactics(self.args().output + generate_tactics.STREAM_NAME))
+        self.assertTrue(all(os.path.exists(generate_tactics.image_name(tactic, self.args().output) + ".png")
+                            for tactic in resumed))
+
+    def test_other_settings_refuse_to_resume(self):
+        generate_tactics.stream_tactics(self.library, self.args(limit=2), 2, None)
+        with self.assertRaises(SystemExit):
+            generate_tactics.stream_tactics(self.library, self.args(mate=3), 3, None)
+
+    def test_missing_images_are_rendered_on_resume(self):
+        tactics = generate_tactics.stream_tactics(self.library, self.args(limit=2), 2, None)
+        images = [generate_tactics.image_name(tactic, self.args().output) + ".png" for tactic in tactics]
+        self.assertTrue(all(os.path.exists(image) for image in images))
+        os.remove(images[0])
+        generate_tactics.stream_tactics(self.library, self.args(limit=2), 2, None)
+        self.assertTrue(os.path.exists(images[0]))
+
+    def test_crash_between_stream_and_checkpoint(self):
+        full = generate_tactics.stream_tactics(self.library, self.args(output="full/"), 2, None)
+        generate_tactics.stream_tactics(self.library, self.args(limit=3), 2, None)
+        checkpoint_name = self.args().output + generate_tactics.CHECKPOINT_NAME
+        lines = Path(checkpoint_name).read_text().split("\n")
+        Path(checkpoint_name).write_text("\n".join(lines[:-2]) + "\n") # The last tactic's game wasn't checkpointed
+        self.assertEqual(full, generate_tactics.stream_tactics(self.library, self.args(), 2, None))
+        self.assertEqual(full, generate_tactics.read_tactics(self.args().output + generate_tactics.STREAM_NAME))
+        self.assertEqual(8, len(Path(self.args().output + generate_tactics.STREAM_NAME).read_text().splitlines()))
+
+    def test_rendering_errors_are_raised(self):
+        with mock.patch('generate_tactics.positions_to_images', side_effect=OSError("no space left")):
+            with self.assertRaises(OSError):
+                generate_tactics.stream_tactics(self.library, self.args(limit=2), 2, None)
@@ -0,0 +1,73 @@
+import os
+import unittest
+import tempfile
+import numpy as np
+import chess
+from chess_analytics.game_library import GameLibrary
+from chess_analytics.move_store import MoveStore
+from sample_games import write_sample_library, sample_pgn
+
+
+class TestMoveStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        self.fnames = write_sample_library(self.parent_dir, n_games=10)
+        self.library = GameLibrary(self.parent_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_matches_parsed_games(self):
+        store = self.library.move_store()
+        self.assertEqual(len(self.library), len(store))
+        for i in range(len(self.library)):
+            game = self.library.get_nth_game(i)
+            self.assertEqual(list(game.game.mainline_moves()), store.moves(i))
+            self.assertEqual(game.moves, store.san(i))
+            self.assertEqual(game.play_nth_move(5).fen(), store.board_at(i, 5).fen())
+
+    def test_loaded_memory_mapped(self):
+        self.library.move_store()
+        store = GameLibrary(self.parent_dir).move_store()
+        self.assertIsInstance(store.codes, np.memmap)
+        self.assertEqual(self.library.get_nth_game(2).moves, store.san(2))
+
+    def test_incremental_update_keeps_library_order(self):
+        self.library.move_store()
+        os.remove(self.fnames[3])
+        new_fname = f"{self.parent_dir}/2021/01/game_new.txt"
+        with open(new_fname, 'w') as f:
+            f.write(sample_pgn(20))
+        library = GameLibrary(self.parent_dir)
+        store = library.move_store()
+        self.assertEqual(list(zip(library.df.fname, library.df.offset, library.df.mtime, library.df.fsize)), store.games)
+        rebuilt = MoveStore()
+        rebuilt.update(library)
+        self.assertEqual(rebuilt.codes.tolist(), store.codes.tolist())
+        self.assertEqual(rebuilt.offsets.tolist(), store.offsets.tolist())
+
+    def test_non_standard_start(self):
+        fen = "4k3/8/8/8/8/8/4P3/4K3 w - - 0 1"
+        fname = f"{self.parent_dir}/2021/01/game_setup.txt"
+        with open(fname, 'w') as f:
+            headers = sample_pgn(0).split("\n\n")[0]
+            f.write(f'{headers}\n[SetUp "1"]\n[FEN "{fen}"]\n\n1. e4 Kd7 1-0\n')
+        library = GameLibrary(self.parent_dir)
+        store = library.move_store()
+        i = list(library.df.fname).index(fname)
+        self.assertEqual(chess.Board(fen), store.board(i))
+        self.assertEqual(['e4', 'Kd7'], store.san(i))
+
+    def test_rewritten_files_are_re_encoded(self):
+        self.library.move_store()
+        self.library.position_index()
+        with open(self.fnames[3], 'w') as f: # Rewritten in place with another game
+            f.write(sample_pgn(23))
+        library = GameLibrary(self.parent_dir)
+        store = library.move_store()
+        i = list(library.df.fname).index(self.fnames[3])
+        self.assertEqual(library.get_nth_game(i).moves, store.san(i))
+        self.assertEqual(library.get_nth_game(i).moves, MoveStore.load(f"{self.parent_dir}/.moves_v2").san(i))
+        board = store.board_at(i, 6)
+        self.assertIn((self.fnames[3], 0), library.position_index().games_reaching(board))
@@ -0,0 +1,93 @@
+import os
+import sys
+import unittest
+import tempfile
+import subprocess
+from pathlib import Path
+from unittest import mock
+from chess_analytics.game_reader import GameReader
+from chess_analytics.openings import (split_eco_moves, mainline_map, combine_like_openings,
+                                      compress_openings, chop_opening_ending, OpeningClassifier,
+                                      OPENINGS_PATH)
+
+
+class TestOpeningClassifier(unittest.TestCase):
+    classifier = GameReader.load_opening_classifier()
+
+    def test_eco_codes(self):
+        self.assertEqual("Italian Game", self.classifier.eco_to_nic_opening("C50"))
+        self.assertEqual("Scandinavian Defence", self.classifier.eco_to_nic_opening("B01"))
+        # Narrowest range wins (D43-D49 is inside D30-D69)
+        self.assertEqual("Semi-Slav Defense", self.classifier.eco_to_nic_opening("D45"))
+        self.assertEqual("Queen's Gambit", self.classifier.eco_to_nic_opening("D50"))
+        # Not in the NIC key, falls back on the ECO table
+        self.assertEqual("Philidor Defense; C41 *", self.classifier.eco_to_nic_opening("C41"))
+        self.assertEqual("NaO", self.classifier.eco_to_nic_opening("NaO"))
+
+    def test_moves(self):
+        self.assertEqual(['d4', 'Nf6', 'c4'], split_eco_moves("1.d4 Nf6 2.c4 "))
+        eco, name = self.classifier.classify_moves(['e4', 'e5', 'Nf3', 'd6', 'd4', 'Bg4', 'dxe5'])
+        self.assertEqual("C41", eco)
+        self.assertEqual(('NaO', 'NaO'), self.classifier.classify_moves([]))
+        self.assertEqual("C41", GameReader("data/opera_game.pgn").moves_to_opening()[0])
+
+    def test_precompiled_tables(self):
+        compiled = OpeningClassifier(GameReader.load_eco_table(), GameReader.load_nic_table())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "openings.pkl"
+            compiled.save(path)
+            loaded = OpeningClassifier.load(path)
+            self.assertEqual(compiled.nic_names, loaded.nic_names)
+            self.assertEqual(compiled.move_trie, loaded.move_trie)
+            with mock.patch.object(OpeningClassifier, 'tables_digest', return_value="changed"):
+                self.assertIsNone(OpeningClassifier.load(path)) # Tables edited since
+            self.assertIsNone(OpeningClassifier.load(Path(tmp_dir) / "missing.pkl"))
+            path.write_bytes(path.read_bytes()[:100])
+            self.assertIsNone(OpeningClassifier.load(path)) # Truncated by a crash
+            path.write_bytes(b"not a pickle")
+            self.assertIsNone(OpeningClassifier.load(path))
+
+    def test_changed_tables_are_recompiled_to_the_user_cache(self):
+        GameReader.load_opening_classifier.cache_clear()
+        self.addCleanup(GameReader.load_opening_classifier.cache_clear)
+        shipped = OPENINGS_PATH.read_bytes()
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+             mock.patch('chess_analytics.game_reader.USER_OPENINGS_PATH', Path(tmp_dir) / "cache" / "openings.pkl"), \
+             mock.patch.object(OpeningClassifier, 'tables_digest', return_value="changed"):
+            classifier = GameReader.load_opening_classifier()
+            self.assertEqual(self.classifier.move_trie, classifier.move_trie)
+            self.assertTrue((Path(tmp_dir) / "cache" / "openings.pkl").exists())
+            self.assertEqual(shipped, OPENINGS_PATH.read_bytes())
+            GameReader.load_opening_classifier.cache_clear()
+            with mock.patch.object(OpeningClassifier, '__init__', side_effect=AssertionError("recompiled")):
+                GameReader.load_opening_classifier() # Loaded from the user cache
+
+    def test_cli_from_another_directory(self):
+        script, game = Path("chess_analytics/game_reader.py").resolve(), Path("data/opera_game.pgn").resolve()
+        code = (f"import sys; from game_reader import GameReader; print(GameReader({str(game)!r}).opening); "
+                "print('pandas' in sys.modules, 'stockfish' in sys.modules)")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run = subprocess.run([sys.executable, str(script), str(game)], cwd=tmp_dir, capture_output=True, text=True)
+            self.assertEqual(0, run.returncode, run.stderr)
+            self.assertIn("Paul Morphy", run.stdout)
+            run = subprocess.run([sys.executable, "-c", code], cwd=tmp_dir, capture_output=True, text=True,
+                                 env={**os.environ, 'PYTHONPATH': str(script.parent)})
+        self.assertEqual("Philidor Defense; C41 *\nFalse False\n", run.stdout, run.stderr)
+
+
+class TestOpeningAggregation(unittest.TestCase):
+    openings = ["Sicilian-Defense-Najdorf-6.Bg5", "Sicilian-Defense", "Sicilian-Defense-Bowdler-Attack",
+                "Italian-Game-Two-Knights-Defense", "Italian-Game-Two-Knights-Defense-4.d3", "", "Caro-Kann-Defense-2.c4"]
+
+    def test_mainline_map(self):
+        mapping = mainline_map(self.openings)
+        self.assertEqual("Sicilian-Defense", mapping["Sicilian-Defense-Najdorf-6.Bg5"])
+        self.assertEqual("Italian-Game-Two-Knights-Defense", mapping["Italian-Game-Two-Knights-Defense-4.d3"])
+        self.assertEqual("Caro-Kann-Defense", mapping["Caro-Kann-Defense-2.c4"])
+        self.assertNotIn("", mapping)
+
+    def test_combine_like_openings(self):
+        self.assertEqual([("Sicilian-Defense", 3), ("Italian-Game-Two-Knights-Defense", 2), ("Caro-Kann-Defense", 1)],
+                         combine_like_openings(self.openings))
+        chopped = sorted(chop_opening_ending(op) for op in self.openings if op)
+        self.assertEqual(dict(combine_like_openings(self.openings)), dict(compress_openings(chopped)))
@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.append("scripts")
+from pgn_downloader import GameDownloader
+from sample_games import sample_pgn
+
+
+class FakeChessComHandler(BaseHTTPRequestHandler):
+    """Local stand-in for api.chess.com: 3 archived months plus the current one. The first
+    request for 2021/02 fails with a 503."""
+    protocol_version = "HTTP/1.1"
+    now = datetime.now(timezone.utc)
+    months = [("2021", "01"), ("2021", "02"), ("2021", "03"), (str(now.year), f"{now.month:02d}")]
+    requests = Counter()
+    connections = set()
+
+    def do_GET(self):
+        self.requests[self.path] += 1
+        self.connections.add(self.client_address)
+        if self.path.endswith("/archives"):
+            body = '{"archives": [%s]}' % ", ".join(f'"http://x/pub/player/Luc777/games/{y}/{m}"' for y, m in self.months)
+            self.reply(200, body.encode())
+        elif self.path == "/pub/player/Luc777/games/2021/02/pgn" and self.requests[self.path] == 1:
+            self.reply(503, b"busy")
+        else:
+            year, month = self.path.split('/')[-3:-1]
+            i = int(month)
+            self.reply(200, "\n\n\n".join(sample_pgn(i * 10 + j) for j in range(3)).encode())
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestGameDownloader(unittest.TestCase):
+    def setUp(self):
+        FakeChessComHandler.requests.clear()
+        FakeChessComHandler.connections.clear()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeChessComHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.api_url = f"http://127.0.0.1:{self.server.server_port}/pub"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_download_resume_and_retry(self):
+        downloader = GameDownloader("Luc777", api_url=self.api_url)
+        paths = downloader.download_to_folder(root=self.tmp_dir.name, n_workers=1, backoff=0.01)
+        self.assertEqual(4, len(paths))
+        self.assertEqual(2, FakeChessComHandler.requests["/pub/player/Luc777/games/2021/02/pgn"])
+        # get_dates() + one worker thread, each keeping its connection alive across requests
+        self.assertEqual(2, len(FakeChessComHandler.connections))
+        month = Path(self.tmp_dir.name) / "Luc777" / "2021" / "03" / "games.pgn"
+        self.assertEqual(3, month.read_text().count('[Event '))
+
+        # Second run: only the current month is fetched again
+        paths = downloader.download_to_folder(root=self.tmp_dir.name, n_workers=3, backoff=0.01)
+        self.assertEqual([downloader.month_path(*FakeChessComHandler.months[-1], root=self.tmp_dir.name)], paths)
+        self.assertEqual(1, FakeChessComHandler.requests["/pub/player/Luc777/games/2021/03/pgn"])
+
+        # A past month downloaded while it was still being played is fetched again, once
+        march = datetime(2021, 3, 20, tzinfo=timezone.utc).timestamp()
+        os.utime(month, (march, march))
+        paths = downloader.download_to_folder(root=self.tmp_dir.name, n_workers=3, backoff=0.01)
+        self.assertIn(month, paths)
+        self.assertEqual(2, FakeChessComHandler.requests["/pub/player/Luc777/games/2021/03/pgn"])
+        downloader.download_to_folder(root=self.tmp_dir.name, n_workers=3, backoff=0.01)
+        self.assertEqual(2, FakeChessComHandler.requests["/pub/player/Luc777/games/2021/03/pgn"])
@@ -0,0 +1,45 @@
+import os
+import unittest
+import tempfile
+from pathlib import Path
+from chess_analytics.pgn_stream import PGNStream
+from chess_analytics.game_library import GameLibrary
+from sample_games import sample_pgn
+
+
+class TestPGNStream(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = Path(self.tmp_dir.name) / "Luc777"
+        self.parent_dir.mkdir()
+        # Same layout as GameDownloader.games_to_file (games split by two blank lines)
+        self.archive = self.parent_dir / "2021_01.pgn"
+        games = [sample_pgn(i) for i in range(5)]
+        games[2] = games[2].replace("\n\n1.", "\n\n{ a comment\n[%clk 0:03:00] over lines }\n1.")
+        self.archive.write_text("\n\n\n".join(games))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_index_and_seek(self):
+        stream = PGNStream(self.archive)
+        self.assertEqual(5, len(stream))
+        self.assertTrue(os.path.exists(stream.index_fname))
+        self.assertEqual("https://www.chess.com/game/live/1003", stream.read_game(3).headers['Link'])
+        links = [game.headers['Link'] for game in stream]
+        self.assertEqual([headers['Link'] for _, headers in stream.iter_headers()], links)
+
+    def test_index_is_reused_and_refreshed(self):
+        PGNStream(self.archive)
+        with open(self.archive, 'a') as f:
+            f.write("\n\n\n" + sample_pgn(5))
+        self.assertEqual(6, len(PGNStream(self.archive)))
+
+    def test_library_reads_archives(self):
+        (self.parent_dir / "game_9.txt").write_text(sample_pgn(9))
+        library = GameLibrary(str(self.parent_dir))
+        self.assertEqual(6, len(library))
+        nth = library.df.index[library.df.id == "https://www.chess.com/game/live/1004"][0]
+        library.df['Game'] = None
+        self.assertEqual(sample_pgn(4).split()[-1], library.get_nth_game(nth).game.headers['Result'])
+        self.assertGreater(len(library.get_nth_game(nth).moves), 0)
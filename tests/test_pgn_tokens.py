@@ -0,0 +1,62 @@
+import unittest
+import tempfile
+from pathlib import Path
+import chess
+import chess.pgn
+from chess_analytics.pgn_tokens import read_tokens, read_headers, tokenize_movetext, PGNTokens
+from chess_analytics.pgn_stream import PGNStream
+from sample_games import sample_pgn
+
+
+class TestPGNTokens(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.archive = Path(self.tmp_dir.name) / "2021_01.pgn"
+        games = [sample_pgn(i) for i in range(5)]
+        games[2] = games[2].replace("\n\n1.", "\n\n{ a comment\n[%clk 0:03:00] over lines }\n1.")
+        self.archive.write_text("\n\n\n".join(games))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_matches_python_chess(self):
+        for offset in PGNStream(self.archive).offsets:
+            with open(self.archive) as f:
+                f.seek(offset)
+                game = chess.pgn.read_game(f)
+            tokens = read_tokens(self.archive, offset)
+            self.assertEqual(dict(game.headers), dict(tokens.headers))
+            self.assertEqual(dict(game.headers), dict(read_headers(self.archive, offset)))
+            self.assertEqual(list(game.mainline_moves()), tokens.validate())
+            self.assertEqual([node.clock() for node in game.mainline()], tokens.clocks)
+            self.assertEqual(game.board().variation_san(game.mainline_moves()), tokens.movetext())
+
+        tokens = read_tokens("data/opera_game.pgn")
+        self.assertEqual(33, len(tokens))
+        self.assertEqual(['e4', 'e5', 'Nf3', 'd6', 'd4', 'Bg4', 'dxe5'], tokens.sans[:7])
+        self.assertEqual('Rd8#', tokens.sans[-1])
+
+    def test_blank_lines_in_comments(self):
+        headers = sample_pgn(0).split("\n\n")[0]
+        games = [f"{headers}\n\n1. e4 {{long comment\n\nwith blank line}} e5 {{ ; not a line comment\n\n}} 2. Nf3 *\n",
+                 sample_pgn(1)]
+        self.archive.write_text("\n\n".join(games))
+        offsets = PGNStream(self.archive).offsets
+        self.assertEqual(2, len(offsets))
+        self.assertEqual(['e4', 'e5', 'Nf3'], read_tokens(self.archive, offsets[0]).sans)
+        with open(self.archive) as f:
+            self.assertEqual(list(chess.pgn.read_game(f).mainline_moves()), read_tokens(self.archive).validate())
+        self.assertEqual(dict(read_headers(self.archive, offsets[1])), dict(read_tokens(self.archive, offsets[1]).headers))
+
+    def test_movetext_tokens(self):
+        sans, clocks = tokenize_movetext(
+            "1.e4 {[%clk 0:02:59.9]} 1... c5!? $1 (1... e5 2. Nf3 (2. f4) Nc6) 2. 0-0 { no clock } 1-0")
+        self.assertEqual(['e4', 'c5', 'O-O'], sans)
+        self.assertEqual([179.9, None, None], clocks)
+
+    def test_lazy_validation(self):
+        tokens = PGNTokens(chess.pgn.Headers(), ['e4', 'e5', 'Ke3', 'Nf6'], [None] * 4)
+        self.assertEqual(['e4', 'e5', 'Ke3', 'Nf6'], tokens.sans) # Not checked until asked
+        with self.assertRaises(ValueError):
+            tokens.validate()
+        self.assertEqual([chess.Move.from_uci('e2e4'), chess.Move.from_uci('e7e5')], tokens.validate(strict=False))
@@ -0,0 +1,103 @@
+import os
+import unittest
+import tempfile
+import numpy as np
+import chess
+import chess.pgn
+from chess_analytics.game_library import GameLibrary
+from chess_analytics.positions import PositionIndex, encode_move, decode_move
+from sample_games import write_sample_library, sample_pgn
+
+
+class TestPositionIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        self.fnames = write_sample_library(self.parent_dir, n_games=10)
+        self.library = GameLibrary(self.parent_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_move_codes(self):
+        for uci in ['e2e4', 'e1g1', 'a7a8q', 'b2a1n']:
+            self.assertEqual(chess.Move.from_uci(uci), decode_move(encode_move(chess.Move.from_uci(uci))))
+
+    def test_queries_match_replay(self):
+        game = self.library.get_nth_game(0)
+        fen = game.play_nth_move(6).fen()
+        expected = [self.library.df.id.iloc[i] for i in range(len(self.library))
+                    if fen in [self.library.get_nth_game(i).play_nth_move(j).fen() for j in range(7)]]
+        self.assertEqual(expected, list(self.library.games_reaching(fen).id))
+        self.assertIn((game.moves[6], 1), self.library.moves_from(fen))
+
+        ranked = self.library.rank_fen_positions(n=1)
+        self.assertEqual([(chess.STARTING_FEN, 5)], ranked['white'])
+
+    def test_transpositions(self):
+        index = PositionIndex()
+        for i, moves in enumerate([['e4', 'e5', 'Nf3'], ['Nf3', 'e5', 'e4']]):
+            game = chess.pgn.Game()
+            game.add_line([m for m in _san_line(moves)])
+            index.append(*index.walk_game(game, i), [1])
+            index.games.append((f"game_{i}", 0))
+        board = chess.Board()
+        for san in ['e4', 'e5', 'Nf3']:
+            board.push_san(san)
+        self.assertEqual([("game_0", 0), ("game_1", 0)], index.games_reaching(board))
+
+    def test_incremental_update(self):
+        self.library.position_index()
+        os.remove(self.fnames[3])
+        library = GameLibrary(self.parent_dir)
+        index = library.position_index()
+        self.assertEqual(9, len(index.games))
+        self.assertNotIn(self.fnames[3], [fname for fname, *_ in index.games])
+        rebuilt = PositionIndex()
+        rebuilt.update(library)
+        self.assertEqual(sorted(rebuilt.keys.tolist()), sorted(index.keys.tolist()))
+
+    def test_setup_positions_and_rewritten_files(self):
+        self.library.position_index()
+        setup_fen = "4k3/8/8/8/8/8/4P3/4K2R w K - 0 40"
+        with open(f"{self.parent_dir}/2021/01/setup.txt", 'w') as f:
+            headers = sample_pgn(3).split("\n\n")[0].replace("/1003", "/1100")
+            f.write(f'{headers}\n[SetUp "1"]\n[FEN "{setup_fen}"]\n\n40. O-O Kd7 41. e4 *\n')
+        os.utime(self.fnames[4], ns=(0, 0)) # Rewritten in place
+        library = GameLibrary(self.parent_dir)
+        index = library.position_index()
+        board = chess.Board(setup_fen)
+        for san in ['O-O', 'Kd7']:
+            board.push_san(san)
+        setup_game = [fname for fname, *_ in index.games].index(f"{self.parent_dir}/2021/01/setup.txt")
+        self.assertEqual([(index.games[setup_game][:2])], index.games_reaching(board))
+        fens = [index.fen_at(row) for row in np.flatnonzero(index.game_ids == setup_game)]
+        self.assertEqual(setup_fen, fens[0])
+        self.assertEqual(board.fen(), fens[2])
+        self.assertIn((self.fnames[4], 0, 0, os.path.getsize(self.fnames[4])), index.games)
+        self.assertEqual(11, len(index.games))
+
+        reloaded = PositionIndex.load(f"{self.parent_dir}/.positions_v2.npz")
+        self.assertEqual(index.games, reloaded.games)
+        self.assertEqual(index.start_fens, reloaded.start_fens)
+        self.assertEqual(fens[2], reloaded.fen_at(np.flatnonzero(reloaded.game_ids == setup_game)[2]))
+
+    def test_unreadable_index_is_rebuilt(self):
+        expected = self.library.position_index()
+        path = f"{self.parent_dir}/.positions_v2.npz"
+        with open(path, 'rb') as f:
+            content = f.read()
+        for broken in [content[:len(content) // 2], b"", b"not an npz"]: # e.g. cut short by a crash
+            with open(path, 'wb') as f:
+                f.write(broken)
+            self.assertIsNone(PositionIndex.load(path))
+            index = GameLibrary(self.parent_dir).position_index()
+            self.assertEqual(expected.games, index.games)
+            np.testing.assert_array_equal(expected.keys, index.keys)
+        self.assertFalse(os.path.exists(path + ".tmp"))
+
+
+def _san_line(moves):
+    board = chess.Board()
+    for san in moves:
+        yield board.push_san(san)
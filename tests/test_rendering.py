@@ -0,0 +1,61 @@
+import os
+import sys
+import types
+import hashlib
+import unittest
+import tempfile
+from unittest import mock
+import chess
+from chess_analytics.utils import positions_to_images, position_to_png
+
+FENS = [chess.STARTING_FEN, "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4",
+        "6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1"]
+
+
+def fake_svg2png(bytestring=None, url=None, write_to=None):
+    """Stands in for cairosvg (not needed to test the batching and caching): the 'PNG' is a hash of the SVG."""
+    fake_cairosvg.calls += 1
+    return b"PNG" + hashlib.sha1(bytestring).hexdigest().encode()
+
+fake_cairosvg = types.SimpleNamespace(svg2png=fake_svg2png, calls=0)
+
+
+@mock.patch.dict(sys.modules, {'cairosvg': fake_cairosvg})
+class TestRendering(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = f"{self.tmp_dir.name}/cache"
+        fake_cairosvg.calls = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def render(self, fens, name, **kwargs):
+        os.makedirs(f"{self.tmp_dir.name}/{name}", exist_ok=True)
+        output_names = [f"{self.tmp_dir.name}/{name}/{i}" for i in range(len(fens))]
+        positions_to_images(fens, output_names, cache_dir=self.cache_dir, **kwargs)
+        images = []
+        for output_name in output_names:
+            with open(output_name + ".png", 'rb') as f:
+                images.append(f.read())
+        return images
+
+    def test_distinct_boards_rendered_once(self):
+        images = self.render(FENS + FENS[:2], "first", n_workers=1)
+        self.assertEqual(3, fake_cairosvg.calls)
+        self.assertEqual(images[:2], images[3:])
+        self.assertEqual(images, self.render(FENS + FENS[:2], "again", n_workers=1))
+        self.assertEqual(3, fake_cairosvg.calls)
+        self.assertEqual(3, len(os.listdir(self.cache_dir)))
+        self.assertEqual(5, len(os.listdir(f"{self.tmp_dir.name}/first"))) # No temporary files
+
+    def test_orientation_and_size_are_keys(self):
+        white = position_to_png(FENS[1], cache_dir=self.cache_dir)
+        self.assertNotEqual(white, position_to_png(FENS[1], orientation=chess.BLACK, cache_dir=self.cache_dir))
+        self.assertNotEqual(white, position_to_png(FENS[1], size=200, cache_dir=self.cache_dir))
+        self.assertEqual(3, fake_cairosvg.calls)
+
+    def test_pool_matches_serial(self):
+        pooled = self.render(FENS, "pooled", n_workers=2)
+        serial = [position_to_png(fen, cache_dir=None) for fen in FENS]
+        self.assertEqual(serial, pooled)
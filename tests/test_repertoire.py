@@ -0,0 +1,92 @@
+import os
+import unittest
+import tempfile
+from collections import Counter
+import numpy as np
+from chess_analytics.game_library import GameLibrary
+from chess_analytics.repertoire import MoveTrie
+from sample_games import write_sample_library, sample_pgn
+
+
+class TestMoveTrie(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        self.fnames = write_sample_library(self.parent_dir, n_games=30)
+        self.library = GameLibrary(self.parent_dir)
+        self.lines = [self.library.get_nth_game(i).moves for i in range(len(self.library))]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_continuations_match_rescan(self):
+        trie = self.library.repertoire()
+        first = self.lines[0][0]
+        expected = Counter(line[1] for line in self.lines if line[0] == first)
+        table = trie.continuations(first, n=100)
+        self.assertEqual(dict(expected), dict(zip(table.move, table.games)))
+        self.assertEqual(sorted(np.flatnonzero([line[0] == first for line in self.lines])),
+                         sorted(trie.games_through(first)))
+
+        white = self.library.df.White == 'Luc777'
+        table = trie.continuations(n=100, color='white')
+        self.assertEqual(white.sum(), table.games.sum())
+        wins = (white & (self.library.df.Result == 1)).sum()
+        self.assertEqual(wins, table.win.sum())
+
+    def test_common_lines_and_shared_prefix(self):
+        trie = self.library.repertoire()
+        expected = Counter(" ".join(line[:2]) for line in self.lines)
+        table = trie.common_lines(ply=2, n=100)
+        self.assertEqual(dict(expected), dict(zip(table.line, table.games)))
+
+        line, game_ids = trie.longest_shared_prefix()
+        self.assertGreaterEqual(len(game_ids), 2)
+        self.assertTrue(all(self.lines[i][:len(line)] == line for i in game_ids))
+        prefixes = Counter(tuple(game[:len(line) + 1]) for game in self.lines if len(game) > len(line))
+        self.assertTrue(all(count < 2 for count in prefixes.values()))
+
+        _, game_ids = trie.longest_shared_prefix(outcome='loss', color='black')
+        df = self.library.df
+        self.assertTrue(all(df.Black[i] == 'Luc777' and df.Result[i] == 1 for i in game_ids))
+
+    def test_incremental_update(self):
+        self.library.repertoire(max_ply=10)
+        os.remove(self.fnames[5])
+        with open(f"{self.parent_dir}/2021/02/game_new.txt", 'w') as f:
+            f.write(sample_pgn(40))
+        library = GameLibrary(self.parent_dir)
+        trie = library.repertoire(max_ply=10)
+        self.assertEqual(30, len(trie.games))
+        rebuilt = MoveTrie(max_ply=10)
+        rebuilt.update(library)
+        self.assertEqual(len(rebuilt), len(trie))
+        table, rebuilt_table = trie.common_lines(10, n=100), rebuilt.common_lines(10, n=100)
+        self.assertEqual(dict(zip(rebuilt_table.line, rebuilt_table.games)), dict(zip(table.line, table.games)))
+        self.assertEqual(set(zip(rebuilt_table.line, rebuilt_table.win)), set(zip(table.line, table.win)))
+
+    def test_rewritten_files_are_updated(self):
+        self.library.repertoire(max_ply=10)
+        with open(self.fnames[5], 'w') as f: # Rewritten in place with another game
+            f.write(sample_pgn(41))
+        library = GameLibrary(self.parent_dir)
+        trie = library.repertoire(max_ply=10)
+        self.assertEqual(30, len(trie.games))
+        rebuilt = MoveTrie(max_ply=10)
+        rebuilt.update(library)
+        table, rebuilt_table = trie.common_lines(10, n=100), rebuilt.common_lines(10, n=100)
+        self.assertEqual(dict(zip(rebuilt_table.line, rebuilt_table.games)), dict(zip(table.line, table.games)))
+        self.assertEqual(trie.games, MoveTrie.load(f"{self.parent_dir}/.repertoire_v2.npz").games)
+
+    def test_unreadable_trie_is_rebuilt(self):
+        expected = self.library.repertoire(max_ply=10)
+        path = f"{self.parent_dir}/.repertoire_v2.npz"
+        with open(path, 'rb') as f:
+            content = f.read()
+        for broken in [content[:len(content) // 2], b"", b"not an npz"]: # e.g. cut short by a crash
+            with open(path, 'wb') as f:
+                f.write(broken)
+            self.assertIsNone(MoveTrie.load(path))
+            trie = GameLibrary(self.parent_dir).repertoire(max_ply=10)
+            self.assertEqual(expected.games, trie.games)
+            np.testing.assert_array_equal(expected.counts, trie.counts)
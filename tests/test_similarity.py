@@ -0,0 +1,30 @@
+import unittest
+import random
+import numpy as np
+from chess_analytics.similarity import GameSimilarity
+from chess_analytics.utils import overlap_similarity, jaccard_similarity
+
+rng = random.Random(0)
+VOCABULARY = [f"m{i}" for i in range(200)]
+GAMES = [[rng.choice(VOCABULARY[:rng.randint(10, 200)]) for _ in range(rng.randint(1, 60))] for _ in range(120)]
+
+
+class TestLibrarySimilarity(unittest.TestCase):
+    games = GAMES
+
+    def pairwise(self, similarity):
+        return np.array([[similarity(a, b) for b in self.games] for a in self.games], dtype=np.float32)
+
+    def test_matches_pairwise_definitions(self):
+        for method, similarity in [('overlap', overlap_similarity), ('jaccard', jaccard_similarity)]:
+            expected = self.pairwise(similarity)
+            matrix = GameSimilarity(self.games, method).similarity_matrix(threshold=0.0, block_size=50)
+            np.testing.assert_allclose(expected, matrix.toarray(), atol=1e-6)
+
+    def test_top_k(self):
+        expected = self.pairwise(jaccard_similarity)
+        np.fill_diagonal(expected, -1)
+        neighbours, similarities = GameSimilarity(self.games, 'jaccard').top_k(k=4, block_size=32)
+        np.testing.assert_allclose(-np.sort(-expected, axis=1)[:, :4], similarities, atol=1e-6)
+        np.testing.assert_allclose(expected[np.arange(len(self.games))[:, None], neighbours], similarities, atol=1e-6)
+
@@ -0,0 +1,70 @@
+import json
+import unittest
+import tempfile
+from unittest import mock
+from chess_analytics import stats
+from chess_analytics.game_library import GameLibrary
+from chess_analytics.eval_cache import EvalCache
+from chess_analytics.tactics import find_forced_mate_positions
+from sample_games import write_sample_library
+from test_tactics import FakeStockfish
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        write_sample_library(self.parent_dir, n_games=8)
+
+    def tearDown(self):
+        stats.disable()
+        self.tmp_dir.cleanup()
+
+    def test_disabled_is_a_no_op(self):
+        self.assertIs(stats.NULL_STAGE, stats.stage('library.list_games'))
+        self.assertIs(stats.NULL_STAGE, stats.progress('tactics', 10))
+        GameLibrary(self.parent_dir, use_cache=False)
+        self.assertIsNone(stats.get_stats())
+        self.assertIsNone(stats.collect())
+
+    def test_library_stages(self):
+        run_stats = stats.enable()
+        library = GameLibrary(self.parent_dir, use_cache=False)
+        library.get_nth_game(0).moves
+        stages = run_stats.as_dict()['stages']
+        self.assertEqual(8, stages['library.describe_games']['items'])
+        self.assertEqual(8, stages['reader.read_headers']['calls'])
+        self.assertEqual(8 + 1, stages['reader.tokenize']['calls']) # Content keys while loading, then moves
+        self.assertNotIn('reader.parse_game', stages)
+        self.assertIn('reader.read_headers', run_stats.report())
+
+        path = f"{self.tmp_dir.name}/stats.json"
+        run_stats.dump(path)
+        with open(path) as f:
+            self.assertEqual(8, json.load(f)['stages']['library.describe_games']['items'])
+
+    @mock.patch('stockfish.Stockfish', FakeStockfish)
+    def test_pool_workers_report_back(self):
+        library = GameLibrary(self.parent_dir, use_cache=False)
+        results = {}
+        for n_workers in [1, 2]:
+            run_stats = stats.enable()
+            find_forced_mate_positions(library, limit=100, n_workers=n_workers, cache=EvalCache(path=None))
+            results[n_workers] = run_stats.as_dict()
+            stages, counters = results[n_workers]['stages'], results[n_workers]['counters']
+            self.assertEqual(len(library), stages['tactics.scan_game']['calls'])
+            self.assertEqual(counters['cache.miss'], stages['engine.search']['calls'])
+            self.assertEqual(counters['tactics.positions'], counters['cache.miss'] + counters.get('cache.hit', 0))
+        self.assertEqual(results[1]['counters']['tactics.positions'], results[2]['counters']['tactics.positions'])
+
+    @mock.patch('stockfish.Stockfish', FakeStockfish)
+    def test_pool_workers_dont_send_back_parent_stats(self):
+        run_stats = stats.enable()
+        library = GameLibrary(self.parent_dir, use_cache=False)
+        before = run_stats.as_dict()['stages']
+        find_forced_mate_positions(library, limit=100, n_workers=4, cache=EvalCache(path=None))
+        after = run_stats.as_dict()['stages']
+        for name in before:
+            self.assertEqual(before[name]['calls'], after[name]['calls'], name)
+            self.assertEqual(before[name]['items'], after[name]['items'], name)
+        self.assertEqual(len(library), after['tactics.scan_game']['calls'])
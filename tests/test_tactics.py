@@ -0,0 +1,183 @@
+import os
+import unittest
+import tempfile
+from unittest import mock
+from pathlib import Path
+import chess
+import chess.engine
+from chess_analytics.game_library import GameLibrary
+from chess_analytics.eval_cache import EvalCache
+from chess_analytics.tactics import (find_forced_mate, find_forced_mate_positions, find_mate_staged,
+                                     static_screen, MateSearch)
+from sample_games import write_sample_library, sample_pgn
+
+
+class FakeStockfish:
+    """Stands in for Stockfish: reports a mate in 2 whenever white is to move on move 6."""
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        self.fens = []
+        self.running = True
+        self.instances.append(self)
+
+    def send_quit_command(self):
+        self.running = False
+
+    def set_fen_position(self, fen):
+        self.fens.append(fen)
+
+    def get_top_moves(self):
+        fen = self.fens[-1].split()
+        mate = 2 if (fen[1] == 'w' and fen[-1] == '6') else None
+        return [{'Move': 'a2a3', 'Centipawn': None if mate else 10, 'Mate': mate}]
+
+
+class TestTactics(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parent_dir = f"{self.tmp_dir.name}/Luc777"
+        write_sample_library(self.parent_dir, n_games=8)
+        self.library = GameLibrary(self.parent_dir, use_cache=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_positions_are_replayed_incrementally(self):
+        game = self.library.get_nth_game(0)
+        engine = FakeStockfish()
+        engine.get_top_moves = lambda: [{'Move': 'a2a3', 'Centipawn': 0, 'Mate': None}]
+        self.assertEqual((None, None, None), find_forced_mate(game, engine, cache=EvalCache(path=None)))
+        self.assertEqual([game.play_nth_move(j).fen() for j in range(len(game.moves))], engine.fens)
+
+    @mock.patch('stockfish.Stockfish', FakeStockfish)
+    def test_engine_pool_matches_serial(self):
+        serial = find_forced_mate_positions(self.library, limit=3, n_workers=1, cache=EvalCache(path=None))
+        pooled = find_forced_mate_positions(self.library, limit=3, n_workers=2, cache=EvalCache(path=None))
+        self.assertEqual(3, len(serial))
+        self.assertEqual(serial, pooled)
+        self.assertEqual(list(self.library.df.id[:3]), [link for _, _, link in pooled])
+        self.assertTrue(all(fen.split()[1] == 'w' and fen.split()[-1] == '6' for fen, _, _ in pooled))
+
+    @mock.patch('stockfish.Stockfish', side_effect=FileNotFoundError("no stockfish"))
+    def test_engine_errors_are_raised_from_the_pool(self, _):
+        for n_workers in [1, 2]:
+            with self.assertRaises(FileNotFoundError):
+                find_forced_mate_positions(self.library, n_workers=n_workers, cache=EvalCache(path=None))
+
+    @mock.patch('stockfish.Stockfish', FakeStockfish)
+    def test_limit_is_checked_before_scanning(self):
+        FakeStockfish.instances.clear()
+        self.assertEqual([], find_forced_mate_positions(self.library, limit=0, n_workers=1, cache=EvalCache(path=None)))
+        self.assertEqual([], FakeStockfish.instances) # No engine was started
+        self.assertEqual(1, len(find_forced_mate_positions(self.library, limit=1, n_workers=1, cache=EvalCache(path=None))))
+        self.assertEqual(1, len(FakeStockfish.instances))
+        self.assertFalse(FakeStockfish.instances[0].running) # Quit once the serial scan stopped
+
+    @mock.patch('stockfish.Stockfish', FakeStockfish)
+    def test_cache_is_sent_once_per_worker_and_keyed_on_depth(self):
+        unpickled = f"{self.tmp_dir.name}/unpickled.txt"
+        setstate = EvalCache.__setstate__
+        def counting_setstate(cache, state):
+            with open(unpickled, 'a') as f:
+                f.write("cache\n")
+            setstate(cache, state)
+        with mock.patch.object(EvalCache, '__setstate__', counting_setstate):
+            find_forced_mate_positions(self.library, limit=100, n_workers=2, cache=EvalCache(path=None))
+        n_unpickled = len(open(unpickled).readlines()) if os.path.exists(unpickled) else 0
+        self.assertLessEqual(n_unpickled, 2)
+
+        cache = EvalCache(path=None)
+        find_forced_mate_positions(self.library, limit=100, n_workers=1, cache=cache, depth=10)
+        n_searches = cache.misses
+        find_forced_mate_positions(self.library, limit=100, n_workers=1, cache=cache, depth=12)
+        self.assertEqual(2 * n_searches, cache.misses)
+        find_forced_mate_positions(self.library, limit=100, n_workers=1, cache=cache, depth=10)
+        self.assertEqual(2 * n_searches, cache.misses)
+
+    def test_repeated_positions_come_from_cache(self):
+        cache = EvalCache(path=f"{self.tmp_dir.name}/evals.sqlite")
+        engine = FakeStockfish()
+        game = self.library.get_nth_game(1)
+        find_forced_mate(game, engine, cache=cache)
+        n_searches = len(engine.fens)
+        find_forced_mate(game, engine, cache=EvalCache(path=cache.path))
+        self.assertEqual(n_searches, len(engine.fens))
+        self.assertEqual(n_searches, cache.misses)
+
+    def test_default_cache_is_found_from_any_directory(self):
+        self.assertTrue(Path(EvalCache().path).is_absolute())
+
+
+class FakeUciEngine:
+    """Stands in for a chess.engine engine: finds mates in 1 (by trying every move), else 0cp."""
+    def __init__(self, *args, **kwargs):
+        self.limits = []
+
+    def analyse(self, board, limit):
+        self.limits.append(limit)
+        for move in board.legal_moves:
+            board.push(move)
+            mate = board.is_checkmate()
+            board.pop()
+            if mate:
+                return {'score': chess.engine.PovScore(chess.engine.Mate(1), board.turn)}
+        return {'score': chess.engine.PovScore(chess.engine.Cp(0), board.turn)}
+
+    def quit(self):
+        pass
+
+
+class TestStagedMateSearch(unittest.TestCase):
+    SCHOLARS_MATE = ['e4', 'e5', 'Bc4', 'Nc6', 'Qh5', 'Nf6', 'Qxf7#']
+
+    def play(self, sans):
+        board = chess.Board()
+        return [board.push_san(san) for san in sans]
+
+    def test_finds_mate_in_one(self):
+        engine = FakeUciEngine()
+        search = MateSearch(min_ply=0, probe_depth=2, confirm_depth=10)
+        fen, mate = find_mate_staged(chess.Board(), self.play(self.SCHOLARS_MATE), engine, 1, search,
+                                     cache=EvalCache(path=None))
+        board = chess.Board()
+        for move in self.play(self.SCHOLARS_MATE[:6]):
+            board.push(move)
+        self.assertEqual((board.fen(), 1), (fen, mate))
+        self.assertEqual([2, 10], [limit.depth for limit in engine.limits[-2:]])
+        self.assertLess(len(engine.limits), len(self.SCHOLARS_MATE)) # Positions without checks are screened out
+        self.assertIsNone(find_mate_staged(chess.Board(), self.play(self.SCHOLARS_MATE), engine, range(2, 4), search,
+                                           cache=EvalCache(path=None)))
+
+    def test_screens_never_drop_a_mate_in_one(self):
+        search = MateSearch(min_ply=0)
+        boards = [chess.Board(), chess.Board("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1")]
+        for move in self.play(self.SCHOLARS_MATE[:6]):
+            boards[0].push(move)
+        for board in boards:
+            self.assertTrue(static_screen(board, 10, {1}, search))
+        self.assertFalse(static_screen(chess.Board("8/8/4k3/8/8/3K4/8/7N w - - 0 1"), 10, {1, 2}, search))
+        self.assertFalse(static_screen(boards[1], 3, {1}, MateSearch(min_ply=4)))
+
+    def test_budget(self):
+        search = MateSearch(min_ply=0, budget=0)
+        self.assertIsNone(find_mate_staged(chess.Board(), self.play(self.SCHOLARS_MATE), FakeUciEngine(), 1, search,
+                                           cache=EvalCache(path=None)))
+
+    @mock.patch('chess.engine.SimpleEngine.popen_uci', FakeUciEngine)
+    def test_library_scan_matches_serial(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_sample_library(f"{tmp_dir}/Luc777", n_games=8)
+            with open(f"{tmp_dir}/Luc777/2021/01/scholars_mate.txt", 'w') as f:
+                headers = sample_pgn(0).split("\n\n")[0]
+                f.write(f"{headers}\n\n1. e4 e5 2. Bc4 Nc6 3. Qh5 Nf6 4. Qxf7# 1-0\n")
+            library = GameLibrary(f"{tmp_dir}/Luc777", use_cache=False)
+            search = MateSearch(min_ply=0)
+            serial = find_forced_mate_positions(library, 1, n_workers=1, cache=EvalCache(path=None), search=search)
+            pooled = find_forced_mate_positions(library, 1, n_workers=2, cache=EvalCache(path=None), search=search)
+        self.assertEqual(serial, pooled)
+        self.assertIn("(mate in 1)", serial[0][1])
+        board = chess.Board()
+        for move in self.play(self.SCHOLARS_MATE[:6]):
+            board.push(move)
+        self.assertIn(board.fen(), [fen for fen, _, _ in serial])